@@ -0,0 +1,479 @@
+"""
+Offline replay of post and vote events against the feed ranking engines.
+
+Every feed request in the stream is answered by each engine and reported as
+latency (p50/p95/mean), stability between consecutive loads of the same feed
+page, and agreement with the reference ordering (overlap and Kendall tau on the
+page, and the share of pages that match exactly). A separate pass reports each
+engine's memory footprint. Nothing touches the network or a database, so
+ranking changes can be measured before rollout.
+
+Engines:
+    reference   scalar scores mirroring the SQL functions and the database's
+                `score DESC, id DESC` order, fully sorted per request
+    vectorized  services.ranking_service scorers and top_k over the newest
+                --candidates posts in scope (how "best" and "rising" are served)
+    index       services.ranking_service Ranking per community and globally,
+                merged per page and reloaded every --refresh-seconds of event
+                time (how hot, top and controversial are served); pages past
+                the tracked posts fall back to the reference
+
+A new engine is a class with `name`, `sorts`, `apply(event, row)` and
+`page(request)`, added to ENGINES.
+
+Events are JSON lines, in order, each with an `at` epoch timestamp:
+
+    {"type": "post", "at": ..., "id": "...", "community_id": "..."}
+    {"type": "vote", "at": ..., "post_id": "...", "up": 1, "down": 0}
+    {"type": "feed", "at": ..., "community_id": null, "sort": "hot", "offset": 0, "limit": 25}
+
+Votes carry deltas to the post's counts (a flipped vote is up -1, down +1).
+Without --events a seeded synthetic stream is generated; --save writes it out
+as a fixture. Run from the backend directory:
+
+    python -m benchmarks.ranking_replay --posts 20000 --votes 200000 --feeds 2000
+    python -m benchmarks.ranking_replay --save ranking_events.jsonl
+    python -m benchmarks.ranking_replay --events ranking_events.jsonl --capacity 100
+"""
+from services.ranking_service import (
+    HOT_DECAY_SECONDS,
+    HOT_EPOCH,
+    RISING_GRAVITY,
+    WILSON_Z,
+    Ranking,
+    hot_scores,
+    merge_rankings,
+    rising_scores,
+    top_k,
+    wilson_scores,
+)
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import heapq
+import json
+import math
+import random
+import statistics
+import time
+import tracemalloc
+import numpy as np
+
+SORTS = ["hot", "top", "controversial", "new", "best", "rising"]
+INDEXED_SORTS = {"hot": "hot_score", "top": "net_score", "controversial": "controversy_score"}
+
+# Computed sorts rank the newest candidates and keep candidate order on ties
+COMPUTED = ("best", "rising")
+
+# (community_id, created_at, upvotes, downvotes) after an event is applied
+Row = Tuple[Optional[str], float, int, int]
+
+def _hot(up: int, down: int, created: float) -> float:
+    score = up - down
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    return round(sign * order + (created - HOT_EPOCH) / HOT_DECAY_SECONDS, 7)
+
+def _controversy(up: int, down: int) -> float:
+    total = up + down
+    if total <= 0:
+        return 0.0
+    return (1 - abs(0.5 - up / total) * 2) * total
+
+def _wilson(up: int, down: int) -> float:
+    n = up + down
+    if n <= 0:
+        return 0.0
+    z2 = WILSON_Z * WILSON_Z
+    p = up / n
+    return (p + z2 / (2 * n) - WILSON_Z * math.sqrt((p * (1 - p) + z2 / (4 * n)) / n)) / (1 + z2 / n)
+
+def _rising(up: int, down: int, created: float, now: float) -> float:
+    hours = max((now - created) / 3600, 0)
+    return (up - down) / math.pow(hours + 2, RISING_GRAVITY)
+
+def _score(sort: str, row: Row, now: float) -> float:
+    _, created, up, down = row
+    if sort == "hot":
+        return _hot(up, down, created)
+    if sort == "top":
+        return up - down
+    if sort == "controversial":
+        return _controversy(up, down)
+    if sort == "best":
+        return _wilson(up, down)
+    if sort == "rising":
+        return _rising(up, down, created, now)
+    return created
+
+class ReferenceEngine:
+    """The expected ordering; also the database the index falls back to"""
+
+    name = "reference"
+    sorts = SORTS
+
+    def __init__(self, candidates: int):
+        self.candidates = candidates
+        self.rows: Dict[str, Row] = {}
+        self.by_community: Dict[Optional[str], List[str]] = {}
+
+    def apply(self, event: Dict[str, Any], row: Row) -> None:
+        if event["type"] == "post":
+            self.by_community.setdefault(row[0], []).append(event["id"])
+            self.rows[event["id"]] = row
+        else:
+            self.rows[event["post_id"]] = row
+
+    def _scope(self, community_id: Optional[str]) -> List[str]:
+        if community_id is None:
+            return list(self.rows)
+        return self.by_community.get(community_id, [])
+
+    def page(self, request: Dict[str, Any]) -> Optional[List[str]]:
+        sort, now = request["sort"], request["at"]
+        ids = self._scope(request["community_id"])
+        if sort in COMPUTED:
+            ids = sorted(ids, key=lambda id: self.rows[id][1], reverse=True)[:self.candidates]
+            ids.sort(key=lambda id: _score(sort, self.rows[id], now), reverse=True)
+        else:
+            ids = sorted(ids, key=lambda id: (_score(sort, self.rows[id], now), id), reverse=True)
+        return ids[request["offset"]:request["offset"] + request["limit"]]
+
+class VectorizedEngine:
+    """Columnar post state scored per request, as read_computed_ranking does"""
+
+    name = "vectorized"
+    sorts = ["hot", "best", "rising"]
+
+    def __init__(self, candidates: int):
+        self.candidates = candidates
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.communities: Dict[Optional[str], int] = {}
+        self.community = np.zeros(1024, dtype=np.int32)
+        self.created = np.zeros(1024, dtype=np.float64)
+        self.upvotes = np.zeros(1024, dtype=np.float64)
+        self.downvotes = np.zeros(1024, dtype=np.float64)
+
+    def _grow(self) -> None:
+        size = self.created.size * 2
+        for name in ("community", "created", "upvotes", "downvotes"):
+            column = getattr(self, name)
+            grown = np.zeros(size, dtype=column.dtype)
+            grown[:column.size] = column
+            setattr(self, name, grown)
+
+    def apply(self, event: Dict[str, Any], row: Row) -> None:
+        if event["type"] == "post":
+            if len(self.ids) == self.created.size:
+                self._grow()
+            i = len(self.ids)
+            self.ids.append(event["id"])
+            self.positions[event["id"]] = i
+            self.community[i] = self.communities.setdefault(row[0], len(self.communities))
+            self.created[i] = row[1]
+        else:
+            i = self.positions[event["post_id"]]
+        self.upvotes[i] = row[2]
+        self.downvotes[i] = row[3]
+
+    def page(self, request: Dict[str, Any]) -> Optional[List[str]]:
+        n = len(self.ids)
+        community_id = request["community_id"]
+        if community_id is None:
+            in_scope = np.arange(n)
+        elif community_id in self.communities:
+            in_scope = np.flatnonzero(self.community[:n] == self.communities[community_id])
+        else:
+            return []
+        # Newest first, like the post_candidates statement
+        candidates = in_scope[np.argsort(-self.created[in_scope], kind="stable")[:self.candidates]]
+
+        up, down, created = self.upvotes[candidates], self.downvotes[candidates], self.created[candidates]
+        sort = request["sort"]
+        if sort == "best":
+            scores = wilson_scores(up, down)
+        elif sort == "rising":
+            scores = rising_scores(up, down, created, now=request["at"])
+        else:
+            scores = hot_scores(up, down, created)
+        page = top_k(scores, request["offset"], request["limit"])
+        return [self.ids[i] for i in candidates[page]]
+
+class IndexEngine:
+    """Bounded per-scope rankings kept current by writes, as the ranking index does"""
+
+    name = "index"
+    sorts = list(INDEXED_SORTS)
+
+    def __init__(self, capacity: int, refresh_seconds: float, database: Optional[ReferenceEngine] = None):
+        self.capacity = capacity
+        self.refresh_seconds = refresh_seconds
+        self.database = database
+        # scope (community id, or None for all communities) -> sort -> ranking
+        self.scopes: Dict[Optional[str], Dict[str, Ranking]] = {None: self._empty()}
+        self.refreshed_at: Optional[float] = None
+        self.fallbacks = 0
+        self.refreshes = 0
+
+    def _empty(self) -> Dict[str, Ranking]:
+        return {sort: Ranking(self.capacity, [], column, True) for sort, column in INDEXED_SORTS.items()}
+
+    def _refresh(self) -> None:
+        """Reload every scope's top posts from the database, like RankingIndex.refresh"""
+        for scope, rankings in self.scopes.items():
+            ids = self.database._scope(scope)
+            for sort, ranking in rankings.items():
+                top = heapq.nlargest(self.capacity + 1, ((_score(sort, self.database.rows[id], 0), id) for id in ids))
+                rows = [{"id": id, ranking.column: score} for score, id in top[:self.capacity]]
+                rankings[sort] = Ranking(self.capacity, rows, ranking.column, len(top) <= self.capacity)
+        self.refreshes += 1
+
+    def apply(self, event: Dict[str, Any], row: Row) -> None:
+        if self.database is not None and self.refresh_seconds > 0:
+            if self.refreshed_at is None:
+                self.refreshed_at = event["at"]
+            elif event["at"] - self.refreshed_at >= self.refresh_seconds:
+                self._refresh()
+                self.refreshed_at = event["at"]
+
+        post_id = event["id"] if event["type"] == "post" else event["post_id"]
+        if row[0] not in self.scopes:
+            self.scopes[row[0]] = self._empty()
+        for scope in (row[0], None):
+            for sort, ranking in self.scopes[scope].items():
+                ranking.upsert(post_id, _score(sort, row, 0))
+
+    def page(self, request: Dict[str, Any]) -> Optional[List[str]]:
+        rankings = self.scopes.get(request["community_id"])
+        if rankings is None:
+            return []
+        entries = merge_rankings([rankings[request["sort"]]], request["offset"], request["limit"])
+        if entries is None:
+            if self.database is not None:
+                self.fallbacks += 1
+                return self.database.page(request)
+            return None
+        return [id for _, id in entries]
+
+ENGINES = ["reference", "vectorized", "index"]
+
+def _create_engines(args: argparse.Namespace, with_database: bool = True) -> List[Any]:
+    reference = ReferenceEngine(args.candidates)
+    return [
+        reference,
+        VectorizedEngine(args.candidates),
+        IndexEngine(args.capacity, args.refresh_seconds, reference if with_database else None),
+    ]
+
+def generate_events(posts: int, votes: int, feeds: int, communities: int, seed: int) -> Iterator[Dict[str, Any]]:
+    """
+    A synthetic stream over about three days: community sizes follow a Zipf law,
+    votes favour recent posts and posts that already drew votes, and feed
+    requests repeat popular pages so consecutive loads can be compared
+    """
+    rng = random.Random(seed)
+    community_ids = [f"c{i:04d}" for i in range(communities)]
+    community_weights = [1 / (i + 1) for i in range(communities)]
+    sort_weights = [0.4, 0.15, 0.1, 0.15, 0.1, 0.1]
+    clock = 1_700_000_000.0
+    gap = 3 * 86400 / max(posts + votes + feeds, 1)
+
+    post_ids: List[str] = []
+    quality: Dict[str, float] = {}
+    counts: Dict[str, List[int]] = {}
+    voted: List[str] = []
+    remaining = {"post": posts, "vote": votes, "feed": feeds}
+    while any(remaining.values()):
+        clock += rng.expovariate(1 / gap)
+        kinds = [kind for kind, left in remaining.items() if left and (kind == "post" or post_ids)]
+        if not kinds:
+            break
+        kind = rng.choices(kinds, weights=[remaining[k] for k in kinds])[0]
+        remaining[kind] -= 1
+
+        if kind == "post":
+            post_id = f"{rng.getrandbits(128):032x}"
+            post_ids.append(post_id)
+            quality[post_id] = rng.betavariate(5, 2)
+            counts[post_id] = [0, 0]
+            community_id = rng.choices(community_ids, weights=community_weights)[0]
+            yield {"type": "post", "at": clock, "id": post_id, "community_id": community_id}
+        elif kind == "vote":
+            if voted and rng.random() < 0.3:
+                post_id = rng.choice(voted)
+            else:
+                age = int(rng.expovariate(1 / (len(post_ids) / 10 + 1)))
+                post_id = post_ids[max(len(post_ids) - 1 - age, 0)]
+            voted.append(post_id)
+            up, down = counts[post_id]
+            if up and rng.random() < 0.05:
+                delta = (-1, 1)
+            elif rng.random() < quality[post_id]:
+                delta = (1, 0)
+            else:
+                delta = (0, 1)
+            counts[post_id] = [up + delta[0], down + delta[1]]
+            yield {"type": "vote", "at": clock, "post_id": post_id, "up": delta[0], "down": delta[1]}
+        else:
+            community_id = None if rng.random() < 0.3 else rng.choices(community_ids, weights=community_weights)[0]
+            yield {
+                "type": "feed",
+                "at": clock,
+                "community_id": community_id,
+                "sort": rng.choices(SORTS, weights=sort_weights)[0],
+                "offset": rng.choices([0, 25, 50], weights=[0.7, 0.2, 0.1])[0],
+                "limit": 25,
+            }
+
+def load_events(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_events(path: str, events: List[Dict[str, Any]]) -> None:
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+def _with_rows(events: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Optional[Row]]]:
+    """Pair each post and vote event with the post's row after it, so engines share one source of truth"""
+    rows: Dict[str, Row] = {}
+    paired = []
+    for event in events:
+        if event["type"] == "post":
+            rows[event["id"]] = (event["community_id"], event["at"], 0, 0)
+            paired.append((event, rows[event["id"]]))
+        elif event["type"] == "vote" and event["post_id"] in rows:
+            community_id, created, up, down = rows[event["post_id"]]
+            rows[event["post_id"]] = (community_id, created, up + event["up"], down + event["down"])
+            paired.append((event, rows[event["post_id"]]))
+        elif event["type"] == "feed":
+            paired.append((event, None))
+    return paired
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def _jaccard(a: List[str], b: List[str]) -> float:
+    union = set(a) | set(b)
+    return len(set(a) & set(b)) / len(union) if union else 1.0
+
+def _kendall_tau(page: List[str], expected: List[str]) -> float:
+    """Rank correlation over the posts both pages contain (1.0 when fewer than two)"""
+    positions = {id: i for i, id in enumerate(expected)}
+    shared = [positions[id] for id in page if id in positions]
+    pairs = len(shared) * (len(shared) - 1) // 2
+    if not pairs:
+        return 1.0
+    discordant = sum(1 for i in range(len(shared)) for j in range(i + 1, len(shared)) if shared[i] > shared[j])
+    return 1 - 2 * discordant / pairs
+
+def replay(paired: List[Tuple[Dict[str, Any], Optional[Row]]], engines: List[Any]) -> Dict[Tuple[str, str], Dict[str, List[float]]]:
+    """Feed every event to every engine; per (engine, sort) samples of each metric"""
+    results: Dict[Tuple[str, str], Dict[str, List[float]]] = {}
+    last_pages: Dict[Tuple[str, Any], List[str]] = {}
+    for event, row in paired:
+        if row is not None:
+            for engine in engines:
+                engine.apply(event, row)
+            continue
+
+        sort = event["sort"]
+        feed_key = (event["community_id"], sort, event["offset"], event["limit"])
+        expected = None
+        for engine in engines:
+            if sort not in engine.sorts:
+                continue
+            start = time.perf_counter()
+            page = engine.page(event)
+            elapsed = (time.perf_counter() - start) * 1000
+            if expected is None:
+                expected = page
+
+            samples = results.setdefault((engine.name, sort), {"latency": [], "stability": [], "overlap": [], "tau": [], "exact": []})
+            samples["latency"].append(elapsed)
+            previous = last_pages.get((engine.name, feed_key))
+            if previous is not None:
+                samples["stability"].append(_jaccard(previous, page))
+            last_pages[(engine.name, feed_key)] = page
+            samples["overlap"].append(len(set(page) & set(expected)) / len(expected) if expected else 1.0)
+            samples["tau"].append(_kendall_tau(page, expected))
+            samples["exact"].append(1.0 if page == expected else 0.0)
+    return results
+
+def measure_memory(paired: List[Tuple[Dict[str, Any], Optional[Row]]], args: argparse.Namespace) -> List[Tuple[str, float, float]]:
+    """
+    (engine, retained KiB after all writes, extra peak KiB while serving one page of each sort)
+    """
+    final_at = paired[-1][0]["at"] if paired else 0.0
+    measured = []
+    for i, name in enumerate(ENGINES):
+        tracemalloc.start()
+        engine = _create_engines(args, with_database=False)[i]
+        for event, row in paired:
+            if row is not None:
+                engine.apply(event, row)
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for sort in engine.sorts:
+            engine.page({"at": final_at, "community_id": None, "sort": sort, "offset": 0, "limit": 25})
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measured.append((name, retained / 1024, (peak - current) / 1024))
+    return measured
+
+def main(args: argparse.Namespace) -> None:
+    if args.events:
+        events = load_events(args.events)
+    else:
+        events = list(generate_events(args.posts, args.votes, args.feeds, args.communities, args.seed))
+    if args.save:
+        save_events(args.save, events)
+
+    paired = _with_rows(events)
+    kinds = [event["type"] for event, _ in paired]
+    print(f"{kinds.count('post')} posts, {kinds.count('vote')} votes, {kinds.count('feed')} feed requests; "
+          f"index capacity {args.capacity}, {args.candidates} candidates, refresh every {args.refresh_seconds:g}s")
+
+    engines = _create_engines(args)
+    results = replay(paired, engines)
+    index = engines[-1]
+
+    print()
+    print(f"{'engine':<12}{'sort':<15}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'stable':>9}{'overlap':>9}{'tau':>8}{'exact':>8}")
+    for name in ENGINES:
+        for sort in SORTS:
+            samples = results.get((name, sort))
+            if samples is None:
+                continue
+            latency = samples["latency"]
+            stable = statistics.mean(samples["stability"]) if samples["stability"] else float("nan")
+            print(
+                f"{name:<12}{sort:<15}{len(latency):>9}{statistics.median(latency):>10.3f}{_percentile(latency, 0.95):>10.3f}"
+                f"{statistics.mean(latency):>10.3f}{stable:>9.3f}{statistics.mean(samples['overlap']):>9.3f}"
+                f"{statistics.mean(samples['tau']):>8.3f}{statistics.mean(samples['exact']):>8.1%}"
+            )
+    served = sum(len(results[(index.name, sort)]["latency"]) for sort in index.sorts if (index.name, sort) in results)
+    if served:
+        print(f"\nindex: {index.fallbacks} of {served} pages fell back to the reference, {index.refreshes} refreshes")
+
+    if not args.skip_memory:
+        print()
+        print(f"{'engine':<12}{'state KiB':>12}{'page peak KiB':>15}")
+        for name, retained, peak in measure_memory(paired, args):
+            print(f"{name:<12}{retained:>12.0f}{peak:>15.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", help="replay a recorded JSON-lines event stream instead of a synthetic one")
+    parser.add_argument("--save", help="write the replayed event stream to this path")
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--votes", type=int, default=200000)
+    parser.add_argument("--feeds", type=int, default=2000)
+    parser.add_argument("--communities", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--capacity", type=int, default=500, help="posts per scope and sort in the index (RANKING_INDEX_SIZE)")
+    parser.add_argument("--candidates", type=int, default=10000, help="newest posts scored for best and rising (RANKING_CANDIDATES)")
+    parser.add_argument("--refresh-seconds", type=float, default=3600, help="event time between index reloads; production uses RANKING_INDEX_REFRESH_SECONDS but each reload rescans every post here; 0 disables")
+    parser.add_argument("--skip-memory", action="store_true", help="skip the memory pass")
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+"""
+Side-by-side latency of the hot read queries over PostgREST and the direct Postgres path.
+
+Point SUPABASE_URL/SUPABASE_SERVICE_KEY and DATABASE_URL at the same database
+(e.g. a local `supabase start` stack) and run from the backend directory:
+
+    python -m benchmarks.read_path --iterations 200
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from services import postgres_service
+from services.supabase_service import get_db, execute
+from services.projection_service import POST_PROJECTIONS
+from typing import Awaitable, Callable, List
+import argparse
+import asyncio
+import statistics
+import time
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+async def _time(call: Callable[[], Awaitable], iterations: int, warmup: int) -> List[float]:
+    for _ in range(warmup):
+        await call()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+async def main(iterations: int, warmup: int) -> None:
+    if not postgres_service.is_enabled():
+        raise SystemExit("DATABASE_URL must be set to benchmark the direct read path")
+
+    db = get_db()
+    sample_post = await execute(db.table("posts").select("id, community_id").limit(1))
+    sample_recipient = await execute(db.table("notifications").select("recipient_id").limit(1))
+    if not sample_post.data:
+        raise SystemExit("Seed at least one post (and ideally notifications) before benchmarking")
+
+    post_id = sample_post.data[0]["id"]
+    community_id = sample_post.data[0]["community_id"]
+    recipient_id = sample_recipient.data[0]["recipient_id"] if sample_recipient.data else None
+    card = POST_PROJECTIONS["card"]
+    detail = POST_PROJECTIONS["detail"]
+
+    cases = [
+        (
+            "feed (community, new, 25)",
+            lambda: postgres_service.fetch_all(f"posts_by_created_{card.key}", [community_id], None, 25, 0),
+            lambda: execute(db.table("posts").select(card.select()).in_("community_id", [community_id]).order("created_at", desc=True).limit(25)),
+        ),
+        (
+            "feed (all, top, 25)",
+            lambda: postgres_service.fetch_all(f"posts_by_net_score_{card.key}", None, None, 25, 0),
+            lambda: execute(db.table("posts").select(card.select()).order("net_score", desc=True).limit(25)),
+        ),
+        (
+            "feed (community, hot, 25)",
+            lambda: postgres_service.fetch_all(f"posts_by_hot_{card.key}", [community_id], None, 25, 0),
+            lambda: execute(db.table("posts").select(card.select()).in_("community_id", [community_id]).order("hot_score", desc=True).limit(25)),
+        ),
+        (
+            "post detail",
+            lambda: postgres_service.fetch_all(f"post_detail_{detail.key}", post_id),
+            lambda: execute(db.table("posts").select(detail.select()).eq("id", post_id)),
+        ),
+        (
+            "post comments",
+            lambda: postgres_service.fetch_all("post_comments", post_id),
+            lambda: execute(db.table("comments").select("*, user:users(*)").eq("post_id", post_id).is_("parent_comment_id", "null").order("created_at")),
+        ),
+    ]
+    if recipient_id:
+        cases.append((
+            "notifications (50)",
+            lambda: postgres_service.fetch_all("notifications_list", recipient_id, False, 50, 0),
+            lambda: execute(db.table("notifications").select("*, actor:users(display_name, username, avatar_url:profile_picture_url)").eq("recipient_id", recipient_id).order("created_at", desc=True).limit(50)),
+        ))
+
+    print(f"{'query':<28}{'path':<12}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, direct_call, postgrest_call in cases:
+        for path, call in (("postgres", direct_call), ("postgrest", postgrest_call)):
+            samples = await _time(call, iterations, warmup)
+            print(f"{name:<28}{path:<12}{statistics.median(samples):>10.2f}{_percentile(samples, 0.95):>10.2f}{statistics.mean(samples):>10.2f}")
+
+    postgres_service.close_pool()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.warmup))
@@ -1,15 +1,50 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from middleware.auth import refresh_public_keys_periodically
+    from services.supabase_service import close_db
+    from services.postgres_service import close_pool
+    from services.ranking_index_service import refresh_ranking_index_periodically
+    from services.leaderboard_service import prune_leaderboards_periodically
+    from services.counter_buffer_service import flush_counters_periodically, close_counter_buffer
+    from services.karma_service import reconcile_karma_periodically
+    from services.notification_service import deliver_notifications_periodically, close_notification_queue
+    from services.notification_push_service import sync_notification_counts_periodically
+    from services.notification_retention_service import archive_notifications_periodically
+
+    background_tasks = [
+        asyncio.create_task(refresh_public_keys_periodically()),
+        asyncio.create_task(refresh_ranking_index_periodically()),
+        asyncio.create_task(prune_leaderboards_periodically()),
+        asyncio.create_task(flush_counters_periodically()),
+        asyncio.create_task(reconcile_karma_periodically()),
+        asyncio.create_task(deliver_notifications_periodically()),
+        asyncio.create_task(sync_notification_counts_periodically()),
+        asyncio.create_task(archive_notifications_periodically()),
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await close_counter_buffer()
+    await close_notification_queue()
+    await close_db()
+    close_pool()
+
 app = FastAPI(
     title="X-Repo API",
     description="Quantum Collaborative Platform API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS configuration
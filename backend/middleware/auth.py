@@ -1,9 +1,19 @@
-from fastapi import HTTPException, Depends, Header
+from fastapi import HTTPException, Depends, Header, Query
 from firebase_admin import auth
 import firebase_admin
-from typing import Optional
+from typing import Any, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from google.auth import jwt as google_jwt
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token as google_id_token
+from services.cache_service import TTLCache
+from services.supabase_service import get_db, execute
+import asyncio
+import cachecontrol
+import hashlib
 import os
 import json
+import requests
 
 # Initialize Firebase Admin
 if not firebase_admin._apps:
@@ -23,6 +33,90 @@ if not firebase_admin._apps:
             # Default initialization (will use default credentials if available)
             firebase_admin.initialize_app()
 
+# Verified tokens are cached until their own `exp`, keyed by a hash so raw tokens never sit in memory
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+KEY_REFRESH_INTERVAL_SECONDS = int(os.getenv("AUTH_KEY_REFRESH_INTERVAL_SECONDS", "1800"))
+
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE)
+
+# Firebase UID -> users row, so authenticated routes skip the per-request profile lookup.
+# Writes through the API invalidate it; karma, which triggers change, lags by up to the TTL.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "15"))
+
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+# RSA verification and certificate fetches are blocking, so they run off the event loop
+_verify_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AUTH_VERIFY_WORKERS", "4")),
+    thread_name_prefix="firebase-verify",
+)
+
+# ID tokens are checked as firebase_admin's verify_id_token checks them, but against
+# certificates fetched through this HTTP cache, which a background task keeps fresh
+ID_TOKEN_CERT_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+ID_TOKEN_ISSUER_PREFIX = "https://securetoken.google.com/"
+
+_cert_request = google_requests.Request(session=cachecontrol.CacheControl(requests.Session()))
+
+def _project_id() -> Optional[str]:
+    return firebase_admin.get_app().project_id
+
+def _verify_id_token(token: str) -> Dict[str, Any]:
+    project_id = _project_id()
+    if not project_id or os.getenv("FIREBASE_AUTH_EMULATOR_HOST"):
+        # The SDK reports a missing project id, and accepts the emulator's unsigned tokens
+        return auth.verify_id_token(token)
+    
+    header = google_jwt.decode_header(token)
+    if not header.get("kid") or header.get("alg") != "RS256":
+        raise ValueError("ID token is not signed with a Google key")
+    # Checks the signature, expiry and audience
+    claims = google_id_token.verify_token(token, _cert_request, audience=project_id, certs_url=ID_TOKEN_CERT_URL)
+    if claims.get("iss") != ID_TOKEN_ISSUER_PREFIX + project_id:
+        raise ValueError("ID token has an incorrect issuer")
+    subject = claims.get("sub")
+    if not isinstance(subject, str) or not subject or len(subject) > 128:
+        raise ValueError("ID token has an invalid subject")
+    claims["uid"] = subject
+    return claims
+
+def _refresh_public_keys() -> None:
+    """Re-fetch Google's signing certificates into the cache verification reads from"""
+    # no-cache skips the cached copy but stores the fresh one
+    response = _cert_request(ID_TOKEN_CERT_URL, method="GET", headers={"Cache-Control": "no-cache"})
+    if response.status != 200:
+        raise ValueError(f"certificate fetch returned {response.status}")
+
+async def refresh_public_keys_periodically() -> None:
+    """
+    Keep the certificate cache warm so cold verifications never wait on a key download
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(_verify_executor, _refresh_public_keys)
+        except Exception as e:
+            print(f"Warning: failed to refresh Firebase public keys: {e}")
+        await asyncio.sleep(KEY_REFRESH_INTERVAL_SECONDS)
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+async def verify_id_token_cached(token: str) -> Dict[str, Any]:
+    """
+    Verify a Firebase ID token, serving repeat verifications from the cache
+    """
+    cache_key = _token_cache_key(token)
+    decoded_token = _token_cache.get(cache_key)
+    if decoded_token is not None:
+        return decoded_token
+
+    loop = asyncio.get_running_loop()
+    decoded_token = await loop.run_in_executor(_verify_executor, _verify_id_token, token)
+    _token_cache.set(cache_key, decoded_token, expires_at=decoded_token["exp"])
+    return decoded_token
+
 async def verify_firebase_token(authorization: Optional[str] = Header(None)) -> str:
     """
     Verify Firebase JWT token and return user UID
@@ -33,7 +127,27 @@ async def verify_firebase_token(authorization: Optional[str] = Header(None)) ->
     try:
         # Extract token from "Bearer <token>"
         token = authorization.replace("Bearer ", "")
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = await verify_id_token_cached(token)
+        return decoded_token['uid']
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=f"Invalid authentication: {str(e)}")
+
+async def verify_firebase_token_or_query(
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+) -> str:
+    """
+    Like verify_firebase_token, but also takes the ID token as `?token=`, for
+    clients that cannot set headers (EventSource). Only for streaming routes,
+    since URLs end up in logs; ID tokens expire within the hour.
+    """
+    if authorization:
+        return await verify_firebase_token(authorization)
+    if not token:
+        raise HTTPException(status_code=401, detail="Authorization header or token missing")
+    
+    try:
+        decoded_token = await verify_id_token_cached(token)
         return decoded_token['uid']
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid authentication: {str(e)}")
@@ -42,3 +156,31 @@ async def verify_firebase_token(authorization: Optional[str] = Header(None)) ->
 async def get_current_user_uid(uid: str = Depends(verify_firebase_token)) -> str:
     return uid
 
+async def lookup_user(uid: str) -> Optional[Dict[str, Any]]:
+    """
+    Resolve a Firebase UID to its users row, or None if no profile exists yet
+    """
+    user = _user_cache.get(uid)
+    if user is not None:
+        return user
+
+    result = await execute(get_db().table("users").select("*").eq("firebase_uid", uid))
+    if not result.data:
+        return None
+
+    user = result.data[0]
+    _user_cache.set(uid, user)
+    return user
+
+def invalidate_user(uid: str) -> None:
+    """Drop a cached profile; call after every write to a users row (insert, update or delete)"""
+    _user_cache.pop(uid)
+
+async def get_current_user(uid: str = Depends(get_current_user_uid)) -> Dict[str, Any]:
+    """
+    Dependency resolving the caller's full user record once per request
+    """
+    user = await lookup_user(uid)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from middleware.auth import get_current_user, get_current_user_uid, invalidate_user
+from services.supabase_service import get_db, execute
+from services import mention_service
 from datetime import datetime
 
 router = APIRouter()
@@ -27,14 +29,14 @@ async def register(
     uid: str = Depends(get_current_user_uid)
 ):
     """Create user profile in Supabase after Firebase authentication"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Get Firebase user email
     from firebase_admin import auth as firebase_auth
-    firebase_user = firebase_auth.get_user(uid)
+    firebase_user = await run_in_threadpool(firebase_auth.get_user, uid)
     
     # Check if username already exists
-    existing = supabase.table("users").select("id").eq("username", request.username).execute()
+    existing = await execute(db.table("users").select("id").eq("username", request.username))
     if existing.data:
         raise HTTPException(status_code=400, detail="Username already taken")
     
@@ -48,24 +50,20 @@ async def register(
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("users").insert(user_data).execute()
+    result = await execute(db.table("users").insert(user_data))
     
     if not result.data:
         raise HTTPException(status_code=500, detail="Failed to create user profile")
     
+    invalidate_user(uid)
+    mention_service.invalidate_usernames(request.username)
+    
     return {"message": "User profile created", "user": result.data[0]}
 
 @router.get("/me")
-async def get_current_user(uid: str = Depends(get_current_user_uid)):
+async def get_me(user: dict = Depends(get_current_user)):
     """Get current user profile"""
-    supabase = get_supabase()
-    
-    result = supabase.table("users").select("*").eq("firebase_uid", uid).execute()
-    
-    if not result.data:
-        raise HTTPException(status_code=404, detail="User profile not found")
-    
-    return result.data[0]
+    return user
 
 @router.post("/verify-token")
 async def verify_token(uid: str = Depends(get_current_user_uid)):
@@ -1,8 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from typing import Optional
+from middleware.auth import get_current_user
+from services.supabase_service import get_db, execute
+from services.projection_service import BOOKMARK_PROJECTIONS, resolve_projection
+from services.pagination_service import apply_keyset, decode_cursor, next_cursor
+from services import count_service
 from datetime import datetime
+import asyncio
 import uuid
 
 router = APIRouter()
@@ -13,24 +18,21 @@ class BookmarkCreate(BaseModel):
 @router.post("")
 async def save_post(
     bookmark: BookmarkCreate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Save/bookmark a post"""
-    supabase = get_supabase()
+    db = get_db()
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_id = user["id"]
     
-    user_id = user_result.data[0]["id"]
-    
-    # Check if post exists
-    post_result = supabase.table("posts").select("id").eq("id", bookmark.post_id).execute()
+    # Check if post exists and whether it's already bookmarked
+    post_result, existing = await asyncio.gather(
+        execute(db.table("posts").select("id").eq("id", bookmark.post_id)),
+        execute(db.table("bookmarks").select("*").eq("post_id", bookmark.post_id).eq("user_id", user_id)),
+    )
     if not post_result.data:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    # Check if already bookmarked
-    existing = supabase.table("bookmarks").select("*").eq("post_id", bookmark.post_id).eq("user_id", user_id).execute()
     if existing.data:
         raise HTTPException(status_code=400, detail="Post already bookmarked")
     
@@ -42,7 +44,8 @@ async def save_post(
         "created_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("bookmarks").insert(bookmark_data).execute()
+    result = await execute(db.table("bookmarks").insert(bookmark_data))
+    count_service.invalidate(("bookmarks", user_id))
     
     return {"message": "Post bookmarked successfully", "bookmark_id": result.data[0]["id"] if result.data else None}
 
@@ -50,59 +53,57 @@ async def save_post(
 @router.delete("/{post_id}")
 async def remove_bookmark(
     post_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Remove a bookmark"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Delete bookmark
-    supabase.table("bookmarks").delete().eq("post_id", post_id).eq("user_id", user_id).execute()
+    await execute(db.table("bookmarks").delete().eq("post_id", post_id).eq("user_id", user_id))
+    count_service.invalidate(("bookmarks", user_id))
     
     return {"message": "Bookmark removed successfully"}
 
 
 @router.get("/user")
 async def get_user_bookmarks(
-    uid: str = Depends(get_current_user_uid),
+    user: dict = Depends(get_current_user),
     limit: int = 20,
-    offset: int = 0
+    offset: int = 0,
+    fields: Optional[str] = None,  # projection name and/or extra fields, e.g. "detail"
+    cursor: Optional[str] = None  # next_cursor from the previous page; takes precedence over offset
 ):
     """Get user's saved/bookmarked posts"""
-    supabase = get_supabase()
+    db = get_db()
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_id = user["id"]
     
-    user_id = user_result.data[0]["id"]
+    # Get bookmarked posts with details, newest first
+    after = decode_cursor(cursor, "new")
+    query = db.table("bookmarks").select(resolve_projection(BOOKMARK_PROJECTIONS, fields).select()).eq("user_id", user_id)
+    query = apply_keyset(query, "created_at", after).limit(limit)
+    if after is None:
+        query = query.offset(offset)
+    result = await execute(query)
+    bookmarks = result.data or []
+    total = await count_service.estimated_count(("bookmarks", user_id), count_service.count_query("bookmarks").eq("user_id", user_id))
     
-    # Get bookmarked posts with details
-    result = supabase.table("bookmarks").select("*, post:posts(*), user:users(*)").eq("user_id", user_id).limit(limit).offset(offset).order("created_at", desc=True).execute()
-    
-    return {"bookmarks": result.data or [], "total": len(result.data or [])}
+    return {"bookmarks": bookmarks, "total": total, "next_cursor": next_cursor(bookmarks, "new", "created_at", limit)}
 
 
 @router.get("/check/{post_id}")
 async def check_bookmark_status(
     post_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Check if a post is bookmarked by the user"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Check if bookmark exists
-    existing = supabase.table("bookmarks").select("*").eq("post_id", post_id).eq("user_id", user_id).execute()
+    existing = await execute(db.table("bookmarks").select("*").eq("post_id", post_id).eq("user_id", user_id))
     
     return {"bookmarked": bool(existing.data)}
\ No newline at end of file
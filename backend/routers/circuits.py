@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from middleware.auth import get_current_user_uid, get_current_user
+from services.supabase_service import get_db, execute
 from services.qiskit_service import (
     simulate_circuit,
     export_to_qasm,
@@ -66,16 +66,12 @@ async def import_qasm(qasm_request: dict):
 @router.post("/save")
 async def save_circuit(
     circuit_request: CircuitSaveRequest,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Save circuit to user account"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Generate QASM and Qiskit code
     qasm = export_to_qasm(circuit_request.circuit_data)
@@ -93,16 +89,16 @@ async def save_circuit(
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("circuits").insert(circuit_data).execute()
+    result = await execute(db.table("circuits").insert(circuit_data))
     
     return result.data[0] if result.data else None
 
 @router.get("/{circuit_id}")
 async def get_circuit(circuit_id: str):
     """Get saved circuit"""
-    supabase = get_supabase()
+    db = get_db()
     
-    result = supabase.table("circuits").select("*").eq("id", circuit_id).execute()
+    result = await execute(db.table("circuits").select("*").eq("id", circuit_id))
     
     if not result.data:
         raise HTTPException(status_code=404, detail="Circuit not found")
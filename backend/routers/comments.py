@@ -1,14 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from middleware.auth import get_current_user
+from services.supabase_service import get_db, execute, is_missing_reference
+from services.loader_service import Loaders, get_loaders
+from services import count_service, counter_buffer_service, mention_service, notification_service
+from services.vote_service import VOTE_TYPES, cast_vote
+from services.comment_tree_service import COMMENT_SORTS, read_comment_tree
 from datetime import datetime
+import asyncio
 import uuid
-import re
 
 router = APIRouter()
 
+async def _none():
+    return None
+
 class CommentCreate(BaseModel):
     post_id: str
     content: str
@@ -17,19 +24,45 @@ class CommentCreate(BaseModel):
 class CommentUpdate(BaseModel):
     content: str
 
+# Upper bounds for the tree's shape parameters
+COMMENT_TREE_MAX_LIMIT = 100
+COMMENT_TREE_MAX_DEPTH = 10
+COMMENT_TREE_MAX_REPLIES = 50
+
+@router.get("/post/{post_id}/tree")
+async def get_comment_tree(
+    post_id: str,
+    sort: str = "best",  # best, top, new
+    limit: int = 20,  # comments at the first level
+    depth: int = 4,  # levels returned, counting the first
+    replies: int = 5,  # replies shown per comment below the first level
+    parent_id: Optional[str] = None,  # from a "more" link: expand this comment instead of the post
+    cursor: Optional[str] = None  # from a "more" link: continue after the last sibling shown
+):
+    """Get a post's comments as a sorted tree, with "more" links for truncated subtrees"""
+    if sort not in COMMENT_SORTS:
+        raise HTTPException(status_code=400, detail="sort must be 'best', 'top' or 'new'")
+    
+    return await read_comment_tree(
+        post_id,
+        sort,
+        parent_id=parent_id,
+        cursor=cursor,
+        limit=max(1, min(limit, COMMENT_TREE_MAX_LIMIT)),
+        depth=max(1, min(depth, COMMENT_TREE_MAX_DEPTH)),
+        replies=max(0, min(replies, COMMENT_TREE_MAX_REPLIES)),
+    )
+
 @router.post("")
 async def create_comment(
     comment: CommentCreate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
 ):
     """Create a comment"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     comment_data = {
         "id": str(uuid.uuid4()),
@@ -43,88 +76,58 @@ async def create_comment(
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("comments").insert(comment_data).execute()
+    if not await counter_buffer_service.hold("posts", comment.post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    try:
+        result = await execute(db.table("comments").insert(comment_data))
+    except Exception as e:
+        # The foreign keys stand in for looking the post and parent up first
+        for column, missing in (("parent_comment_id", "Parent comment"), ("post_id", "Post")):
+            if is_missing_reference(e, column):
+                await counter_buffer_service.release("posts", comment.post_id)
+                raise HTTPException(status_code=404, detail=f"{missing} not found")
+        raise
     created_comment = result.data[0] if result.data else None
     
-    # Increment comment count on post
-    supabase.rpc("increment", {"table_name": "posts", "column_name": "comment_count", "id": comment.post_id}).execute()
-    
-    # Trigger notifications
+    # Increment comment count on post while the post, parent comment and
+    # mentioned users (distinct @usernames, capped, mostly from cache) are looked up
+    posts = loaders.get("posts", select="id, user_id, title")
+    comments = loaders.get("comments", select="id, user_id")
+    _, post, parent_comment, mentioned_users = await asyncio.gather(
+        counter_buffer_service.adjust("posts", comment.post_id, "comment_count", 1),
+        posts.load(comment.post_id),
+        comments.load(comment.parent_comment_id) if comment.parent_comment_id else _none(),
+        mention_service.resolve_mentions(comment.content),
+    )
+    count_service.invalidate(("post_comments", comment.post_id))
+    
+    # Queue notifications; they are inserted and pushed in the background
     if created_comment:
-        # Get the post to notify the post author
-        post_result = supabase.table("posts").select("user_id, title").eq("id", comment.post_id).execute()
-        if post_result.data:
-            post_author_id = post_result.data[0]["user_id"]
-            post_title = post_result.data[0]["title"]
-            
-            # Don't notify the post author if they're the one commenting
-            if post_author_id != user_id:
-                # Create notification for post author
-                notification_data = {
-                    "id": str(uuid.uuid4()),
-                    "recipient_id": post_author_id,
-                    "type": "comment",
-                    "title": "New comment on your post",
-                    "content": f"{user_result.data[0].get('display_name', 'A user')} commented on your post '{post_title}'",
-                    "post_id": comment.post_id,
-                    "comment_id": created_comment["id"],
-                    "actor_id": user_id,
-                    "is_read": False,
-                    "created_at": datetime.utcnow().isoformat(),
-                    "updated_at": datetime.utcnow().isoformat(),
-                }
-                supabase.table("notifications").insert(notification_data).execute()
+        actor_name = user.get('display_name') or 'A user'
+        
+        def notify(recipient_id: str, type: str, title: str, content: str, action: Optional[str] = None):
+            notifications.append(notification_service.notification(
+                recipient_id, type, title, content, comment.post_id, created_comment["id"], user_id, action
+            ))
+        
+        notifications = []
         
         # If this is a reply to another comment, notify the parent comment author
-        if comment.parent_comment_id:
-            parent_comment_result = supabase.table("comments").select("user_id").eq("id", comment.parent_comment_id).execute()
-            if parent_comment_result.data:
-                parent_comment_author_id = parent_comment_result.data[0]["user_id"]
-                
-                # Don't notify if the same user is replying to their own comment
-                if parent_comment_author_id != user_id:
-                    # Create notification for parent comment author
-                    notification_data = {
-                        "id": str(uuid.uuid4()),
-                        "recipient_id": parent_comment_author_id,
-                        "type": "comment_reply",
-                        "title": "New reply to your comment",
-                        "content": f"{user_result.data[0].get('display_name', 'A user')} replied to your comment",
-                        "post_id": comment.post_id,
-                        "comment_id": created_comment["id"],
-                        "actor_id": user_id,
-                        "is_read": False,
-                        "created_at": datetime.utcnow().isoformat(),
-                        "updated_at": datetime.utcnow().isoformat(),
-                    }
-                    supabase.table("notifications").insert(notification_data).execute()
+        if parent_comment:
+            notify(parent_comment["user_id"], "comment_reply", "New reply to your comment", f"{actor_name} replied to your comment")
+        
+        # Notify the post author
+        if post:
+            action = f"commented on your post '{post['title']}'"
+            notify(post["user_id"], "comment", "New comment on your post", f"{actor_name} {action}", action)
         
-        # Check for mentions in the comment content
-        # Find mentions like @username
-        mentions = re.findall(r'@([a-zA-Z0-9_]+)', comment.content)
-        if mentions:
-            for username in mentions:
-                # Find the user by username
-                user_lookup = supabase.table("users").select("id").eq("username", username).execute()
-                if user_lookup.data:
-                    mentioned_user_id = user_lookup.data[0]["id"]
-                    # Don't notify if the same user is mentioning themselves
-                    if mentioned_user_id != user_id:
-                        # Create notification for mentioned user
-                        notification_data = {
-                            "id": str(uuid.uuid4()),
-                            "recipient_id": mentioned_user_id,
-                            "type": "mention",
-                            "title": "You were mentioned in a comment",
-                            "content": f"{user_result.data[0].get('display_name', 'A user')} mentioned you in a comment on post '{post_title if 'post_title' in locals() else 'a post'}'",
-                            "post_id": comment.post_id,
-                            "comment_id": created_comment["id"],
-                            "actor_id": user_id,
-                            "is_read": False,
-                            "created_at": datetime.utcnow().isoformat(),
-                            "updated_at": datetime.utcnow().isoformat(),
-                        }
-                        supabase.table("notifications").insert(notification_data).execute()
+        # Notify mentioned users
+        post_title = post["title"] if post else "a post"
+        for mentioned_user in mentioned_users:
+            notify(mentioned_user["id"], "mention", "You were mentioned in a comment", f"{actor_name} mentioned you in a comment on post '{post_title}'")
+        
+        # Skips the commenter, and anyone notified above gets only their first notification
+        await notification_service.notify(notifications, notification_service.actor_card(user))
     
     return created_comment
 
@@ -132,50 +135,50 @@ async def create_comment(
 async def update_comment(
     comment_id: str,
     comment: CommentUpdate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Update comment"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify ownership
-    comment_result = supabase.table("comments").select("user_id").eq("id", comment_id).execute()
+    comment_result = await execute(db.table("comments").select("user_id").eq("id", comment_id))
     if not comment_result.data:
         raise HTTPException(status_code=404, detail="Comment not found")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data or comment_result.data[0]["user_id"] != user_result.data[0]["id"]:
+    if comment_result.data[0]["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    result = supabase.table("comments").update({
+    result = await execute(db.table("comments").update({
         "content": comment.content,
         "updated_at": datetime.utcnow().isoformat()
-    }).eq("id", comment_id).execute()
+    }).eq("id", comment_id))
     
     return result.data[0] if result.data else None
 
 @router.delete("/{comment_id}")
 async def delete_comment(
     comment_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Delete comment"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify ownership
-    comment_result = supabase.table("comments").select("user_id, post_id").eq("id", comment_id).execute()
+    comment_result = await execute(db.table("comments").select("user_id, post_id").eq("id", comment_id))
     if not comment_result.data:
         raise HTTPException(status_code=404, detail="Comment not found")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data or comment_result.data[0]["user_id"] != user_result.data[0]["id"]:
+    if comment_result.data[0]["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     post_id = comment_result.data[0]["post_id"]
     
-    supabase.table("comments").delete().eq("id", comment_id).execute()
+    await counter_buffer_service.hold("posts", post_id)
+    await execute(db.table("comments").delete().eq("id", comment_id))
     
     # Decrement comment count on post
-    supabase.rpc("decrement", {"table_name": "posts", "column_name": "comment_count", "id": post_id}).execute()
+    await counter_buffer_service.adjust("posts", post_id, "comment_count", -1)
+    count_service.invalidate(("post_comments", post_id))
     
     return {"message": "Comment deleted"}
 
@@ -183,65 +186,20 @@ async def delete_comment(
 async def vote_comment(
     comment_id: str,
     vote_type: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Vote on a comment"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    if vote_type not in VOTE_TYPES:
+        raise HTTPException(status_code=400, detail="vote_type must be 'upvote' or 'downvote'")
     
-    user_id = user_result.data[0]["id"]
-    
-    # Get the comment to find the author
-    comment_result = supabase.table("comments").select("user_id").eq("id", comment_id).execute()
-    if not comment_result.data:
+    totals = await cast_vote(user["id"], "comment", comment_id, vote_type)
+    if totals is None:
         raise HTTPException(status_code=404, detail="Comment not found")
-    comment_author_id = comment_result.data[0]["user_id"]
-    
-    # Check existing vote
-    existing = supabase.table("votes").select("*").eq("votable_type", "comment").eq("votable_id", comment_id).eq("user_id", user_id).execute()
-    
-    if existing.data:
-        existing_vote = existing.data[0]
-        if existing_vote["vote_type"] == vote_type:
-            # Remove vote
-            supabase.table("votes").delete().eq("id", existing_vote["id"]).execute()
-            if vote_type == "upvote":
-                supabase.rpc("decrement", {"table_name": "comments", "column_name": "upvotes", "id": comment_id}).execute()
-                # Update author's reputation (decrement for removing upvote)
-                # We could implement reputation update here if needed
-            else:
-                supabase.rpc("decrement", {"table_name": "comments", "column_name": "downvotes", "id": comment_id}).execute()
-                # Update author's reputation (increment for removing downvote)
-                # We could implement reputation update here if needed
-            return {"voted": False, "vote_type": None}
-        else:
-            # Change vote
-            supabase.table("votes").update({"vote_type": vote_type}).eq("id", existing_vote["id"]).execute()
-            if vote_type == "upvote":
-                supabase.rpc("increment", {"table_name": "comments", "column_name": "upvotes", "id": comment_id}).execute()
-                supabase.rpc("decrement", {"table_name": "comments", "column_name": "downvotes", "id": comment_id}).execute()
-            else:
-                supabase.rpc("increment", {"table_name": "comments", "column_name": "downvotes", "id": comment_id}).execute()
-                supabase.rpc("decrement", {"table_name": "comments", "column_name": "upvotes", "id": comment_id}).execute()
-            return {"voted": True, "vote_type": vote_type}
-    else:
-        # New vote
-        supabase.table("votes").insert({
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "votable_type": "comment",
-            "votable_id": comment_id,
-            "vote_type": vote_type,
-            "created_at": datetime.utcnow().isoformat(),
-        }).execute()
-        
-        if vote_type == "upvote":
-            supabase.rpc("increment", {"table_name": "comments", "column_name": "upvotes", "id": comment_id}).execute()
-        else:
-            supabase.rpc("increment", {"table_name": "comments", "column_name": "downvotes", "id": comment_id}).execute()
-        
-        return {"voted": True, "vote_type": vote_type}
+    
+    return {
+        "voted": totals["vote_type"] is not None,
+        "vote_type": totals["vote_type"],
+        "upvotes": totals["upvotes"],
+        "downvotes": totals["downvotes"],
+    }
 
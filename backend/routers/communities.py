@@ -1,8 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from middleware.auth import get_current_user
+from services.supabase_service import get_db, execute
+from services.projection_service import POST_PROJECTIONS, resolve_projection
+from services.membership_service import invalidate_memberships
+from services.feed_cache_service import cached_feed
+from services.feed_service import count_posts, ranked_page
+from services import count_service
 from datetime import datetime
 import uuid
 
@@ -17,28 +22,25 @@ class CommunityCreate(BaseModel):
 @router.get("")
 async def list_communities(limit: int = 20, offset: int = 0):
     """List all communities"""
-    supabase = get_supabase()
+    db = get_db()
     
-    result = supabase.table("communities").select("*, created_by_user:users(*)").limit(limit).offset(offset).order("member_count", desc=True).execute()
+    result = await execute(db.table("communities").select("*, created_by_user:users(*)").limit(limit).offset(offset).order("member_count", desc=True))
+    total = await count_service.estimated_count(("communities",), count_service.count_query("communities"))
     
-    return {"communities": result.data or [], "total": len(result.data or [])}
+    return {"communities": result.data or [], "total": total}
 
 @router.post("")
 async def create_community(
     community: CommunityCreate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Create a new community"""
-    supabase = get_supabase()
+    db = get_db()
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Check if name already exists
-    existing = supabase.table("communities").select("id").eq("name", community.name).execute()
+    existing = await execute(db.table("communities").select("id").eq("name", community.name))
     if existing.data:
         raise HTTPException(status_code=400, detail="Community name already taken")
     
@@ -53,25 +55,26 @@ async def create_community(
         "created_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("communities").insert(community_data).execute()
+    result = await execute(db.table("communities").insert(community_data))
     
     if not result.data:
         raise HTTPException(status_code=500, detail="Failed to create community")
     
     # Auto-join creator
-    supabase.table("community_members").insert({
+    await execute(db.table("community_members").insert({
         "community_id": result.data[0]["id"],
         "user_id": user_id
-    }).execute()
+    }))
+    invalidate_memberships(user_id)
     
     return result.data[0]
 
 @router.get("/{name}")
 async def get_community(name: str):
     """Get community details"""
-    supabase = get_supabase()
+    db = get_db()
     
-    result = supabase.table("communities").select("*, created_by_user:users(*)").eq("name", name).execute()
+    result = await execute(db.table("communities").select("*, created_by_user:users(*)").eq("name", name))
     
     if not result.data:
         raise HTTPException(status_code=404, detail="Community not found")
@@ -81,64 +84,58 @@ async def get_community(name: str):
 @router.post("/{name}/join")
 async def join_community(
     name: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Join a community"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
-    community_result = supabase.table("communities").select("id").eq("name", name).execute()
+    community_result = await execute(db.table("communities").select("id").eq("name", name))
     if not community_result.data:
         raise HTTPException(status_code=404, detail="Community not found")
     
     community_id = community_result.data[0]["id"]
     
     # Check if already member
-    existing = supabase.table("community_members").select("*").eq("community_id", community_id).eq("user_id", user_id).execute()
+    existing = await execute(db.table("community_members").select("*").eq("community_id", community_id).eq("user_id", user_id))
     if existing.data:
         return {"message": "Already a member", "joined": True}
     
     # Join
-    supabase.table("community_members").insert({
+    await execute(db.table("community_members").insert({
         "community_id": community_id,
         "user_id": user_id
-    }).execute()
+    }))
+    invalidate_memberships(user_id)
     
     # Increment member count
-    supabase.rpc("increment", {"table_name": "communities", "column_name": "member_count", "id": community_id}).execute()
+    await execute(db.rpc("increment", {"table_name": "communities", "column_name": "member_count", "id": community_id}))
     
     return {"message": "Joined community", "joined": True}
 
 @router.post("/{name}/leave")
 async def leave_community(
     name: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Leave a community"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
-    community_result = supabase.table("communities").select("id").eq("name", name).execute()
+    community_result = await execute(db.table("communities").select("id").eq("name", name))
     if not community_result.data:
         raise HTTPException(status_code=404, detail="Community not found")
     
     community_id = community_result.data[0]["id"]
     
     # Leave
-    supabase.table("community_members").delete().eq("community_id", community_id).eq("user_id", user_id).execute()
+    await execute(db.table("community_members").delete().eq("community_id", community_id).eq("user_id", user_id))
+    invalidate_memberships(user_id)
     
     # Decrement member count
-    supabase.rpc("decrement", {"table_name": "communities", "column_name": "member_count", "id": community_id}).execute()
+    await execute(db.rpc("decrement", {"table_name": "communities", "column_name": "member_count", "id": community_id}))
     
     return {"message": "Left community", "joined": False}
 
@@ -149,55 +146,32 @@ async def get_community_posts(
     offset: int = 0,
     sort: str = "hot",
     time_range: Optional[str] = None,  # day, week, month, year, all
-    search: Optional[str] = None  # search query
+    search: Optional[str] = None,  # search query
+    fields: Optional[str] = None,  # projection name and/or extra fields, e.g. "detail" or "user.bio"
+    cursor: Optional[str] = None  # next_cursor from the previous page; takes precedence over offset
 ):
     """Get posts in a community with various sorting options"""
-    from typing import Optional
+    db = get_db()
     
-    supabase = get_supabase()
-    
-    community_result = supabase.table("communities").select("id").eq("name", name).execute()
+    community_result = await execute(db.table("communities").select("id").eq("name", name))
     if not community_result.data:
         raise HTTPException(status_code=404, detail="Community not found")
     
     community_id = community_result.data[0]["id"]
     
-    query = supabase.table("posts").select("*, user:users(*)").eq("community_id", community_id)
-    
-    # Filter by time range if specified
-    if time_range and time_range != "all":
-        from datetime import datetime, timedelta
-        now = datetime.utcnow()
-        if time_range == "day":
-            from_date = now - timedelta(days=1)
-        elif time_range == "week":
-            from_date = now - timedelta(weeks=1)
-        elif time_range == "month":
-            from_date = now - timedelta(days=30)
-        elif time_range == "year":
-            from_date = now - timedelta(days=365)
-        else:
-            from_date = now  # fallback
+    projection = resolve_projection(POST_PROJECTIONS, fields)
+    
+    async def build():
+        posts, page_cursor = await ranked_page([community_id], time_range, projection, sort, limit, offset, cursor, search)
         
-        query = query.gte("created_at", from_date.isoformat())
-    
-    # Apply search filter if provided
-    if search:
-        query = query.text_search("title,content", f"{search}", {"type": "websearch"})
-    
-    # Apply sorting
-    if sort == "new":
-        query = query.order("created_at", desc=True)
-    elif sort == "top":
-        query = query.order("upvotes", desc=True)
-    elif sort == "controversial":
-        # Controversial: posts with high upvote/downvote ratios
-        query = query.order("created_at", desc=True)  # Simplified for now
-    else:  # hot
-        # Simple hot algorithm: (upvotes - downvotes) / age_in_hours
-        query = query.order("created_at", desc=True)  # Simplified for now
-    
-    result = query.limit(limit).offset(offset).execute()
-    
-    return {"posts": result.data or [], "total": len(result.data or [])}
+        # Exact from the community's post counter when unfiltered, estimated otherwise
+        total = await count_posts([community_id], time_range, community_id, search)
+        return {"posts": posts, "total": total, "next_cursor": page_cursor}
+    
+    # Served through the shared feed cache, invalidated by writes to the community
+    return await cached_feed(
+        [community_id],
+        ("community_posts", community_id, sort, time_range, search, projection.key, limit, offset, cursor),
+        build
+    )
 
@@ -1,13 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from middleware.auth import get_current_user, get_current_user_uid, lookup_user, verify_firebase_token_or_query
+from services.supabase_service import get_db, execute
+from services import postgres_service, count_service
+from services.pagination_service import apply_keyset, decode_cursor, next_cursor
+from services.notification_push_service import notification_push
+from services.websocket_service import manager
 from datetime import datetime
+import asyncio
+import json
 import uuid
 
 router = APIRouter()
 
+# Comment lines sent on an idle event stream so proxies keep it open
+STREAM_KEEPALIVE_SECONDS = 15
+
 class NotificationCreate(BaseModel):
     recipient_id: str
     type: str  # 'mention', 'reply', 'reaction', 'comment_reply'
@@ -19,41 +29,50 @@ class NotificationCreate(BaseModel):
 
 @router.get("")
 async def get_user_notifications(
-    uid: str = Depends(get_current_user_uid),
+    user: dict = Depends(get_current_user),
     limit: int = 50,
     offset: int = 0,
-    unread_only: bool = False
+    unread_only: bool = False,
+    cursor: Optional[str] = None  # next_cursor from the previous page; takes precedence over offset
 ):
     """Get user's notifications"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Get user ID
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
-    
-    # Build query
-    query = supabase.table("notifications").select("*, actor:users(display_name, username, avatar_url)")
-    query = query.eq("recipient_id", user_id)
-    
-    if unread_only:
-        query = query.eq("is_read", False)
-    
-    query = query.order("created_at", desc=True)
-    
-    result = query.limit(limit).offset(offset).execute()
-    
+    user_id = user["id"]
+    
+    after = decode_cursor(cursor, "new")
+    if after is not None:
+        notifications = await postgres_service.fetch_all("notifications_list_after", user_id, unread_only, after[0], after[1], limit)
+    else:
+        notifications = await postgres_service.fetch_all("notifications_list", user_id, unread_only, limit, offset)
+    if notifications is None:
+        # Build query
+        query = db.table("notifications").select("*, actor:users(display_name, username, avatar_url:profile_picture_url)")
+        query = query.eq("recipient_id", user_id)
+        
+        if unread_only:
+            query = query.eq("is_read", False)
+        
+        query = apply_keyset(query, "created_at", after).limit(limit)
+        if after is None:
+            query = query.offset(offset)
+        
+        result = await execute(query)
+        notifications = result.data or []
+    
+    counts = await count_service.notification_counts(user_id)
     return {
-        "notifications": result.data or [],
-        "total": len(result.data or [])
+        "notifications": notifications,
+        "total": counts["unread"] if unread_only else counts["total"],
+        "unread": counts["unread"],
+        "next_cursor": next_cursor(notifications, "new", "created_at", limit)
     }
 
 @router.post("")
 async def create_notification(notification: NotificationCreate):
     """Create a new notification (internal use)"""
-    supabase = get_supabase()
+    db = get_db()
     
     notification_data = {
         "id": str(uuid.uuid4()),
@@ -69,27 +88,23 @@ async def create_notification(notification: NotificationCreate):
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("notifications").insert(notification_data).execute()
+    result = await execute(db.table("notifications").insert(notification_data))
     
     return result.data[0] if result.data else None
 
 @router.patch("/{notification_id}/read")
 async def mark_notification_as_read(
     notification_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Mark a notification as read"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Get user ID
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Verify notification belongs to user
-    notification_result = supabase.table("notifications").select("recipient_id").eq("id", notification_id).execute()
+    notification_result = await execute(db.table("notifications").select("recipient_id, is_read").eq("id", notification_id))
     if not notification_result.data:
         raise HTTPException(status_code=404, detail="Notification not found")
     
@@ -97,46 +112,44 @@ async def mark_notification_as_read(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Update notification as read
-    supabase.table("notifications").update({"is_read": True}).eq("id", notification_id).execute()
+    if not notification_result.data[0]["is_read"]:
+        await execute(db.table("notifications").update({"is_read": True}).eq("id", notification_id))
+        count_service.invalidate(("notifications", user_id))
+        await notification_push.adjust(user_id, unread=-1)
     
     return {"message": "Notification marked as read"}
 
 @router.patch("/read-all")
 async def mark_all_notifications_as_read(
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Mark all user's notifications as read"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Get user ID
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
-    # Update all notifications as read
-    supabase.table("notifications").update({"is_read": True}).eq("recipient_id", user_id).execute()
+    # Only unread rows are updated, and the unread counter is moved once
+    result = await execute(db.rpc("mark_all_notifications_read", {"p_user_id": user_id}))
+    if result.data:
+        count_service.invalidate(("notifications", user_id))
+        await notification_push.read_all(user_id)
     
     return {"message": "All notifications marked as read"}
 
 @router.delete("/{notification_id}")
 async def delete_notification(
     notification_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Delete a notification"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Get user ID
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Verify notification belongs to user
-    notification_result = supabase.table("notifications").select("recipient_id").eq("id", notification_id).execute()
+    notification_result = await execute(db.table("notifications").select("recipient_id, is_read").eq("id", notification_id))
     if not notification_result.data:
         raise HTTPException(status_code=404, detail="Notification not found")
     
@@ -144,6 +157,75 @@ async def delete_notification(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Delete notification
-    supabase.table("notifications").delete().eq("id", notification_id).execute()
+    await execute(db.table("notifications").delete().eq("id", notification_id))
+    count_service.invalidate(("notifications", user_id))
+    await notification_push.adjust(user_id, total=-1, unread=0 if notification_result.data[0]["is_read"] else -1)
+    
+    return {"message": "Notification deleted"}
+
+@router.websocket("/ws")
+async def notifications_websocket(websocket: WebSocket, uid: str = Depends(get_current_user_uid)):
+    """WebSocket pushing the user's new notifications and unread count"""
+    user = await lookup_user(uid)
+    if not user:
+        await websocket.close(code=1008, reason="User not found")
+        return
+    
+    user_id = user["id"]
+    
+    await manager.connect(websocket, connection_type="notifications", user_id=user_id)
+    try:
+        counts = await notification_push.attach(user_id)
+    except Exception:
+        manager.disconnect(websocket, user_id=user_id)
+        await websocket.close(code=1011)
+        return
+    try:
+        await websocket.send_text(json.dumps({"type": "unread_count", **counts}))
+        # Messages only flow to the client; this waits for it to disconnect
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(websocket, user_id=user_id)
+        notification_push.detach(user_id)
+
+@router.get("/stream")
+async def notifications_stream(
+    request: Request,
+    uid: str = Depends(verify_firebase_token_or_query)  # EventSource sends the ID token as ?token=
+):
+    """Server-sent events fallback for the notifications WebSocket, with the same messages"""
+    user = await lookup_user(uid)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    return {"message": "Notification deleted"}
\ No newline at end of file
+    user_id = user["id"]
+    
+    queue = notification_push.subscribe(user_id)
+    try:
+        counts = await notification_push.attach(user_id)
+    except Exception:
+        notification_push.unsubscribe(user_id, queue)
+        raise
+    
+    async def events():
+        try:
+            yield f"data: {json.dumps({'type': 'unread_count', **counts})}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            notification_push.unsubscribe(user_id, queue)
+            notification_push.detach(user_id)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stops nginx from buffering the stream
+        "X-Accel-Buffering": "no",
+    })
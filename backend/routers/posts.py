@@ -1,10 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from enum import Enum
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
-from datetime import datetime, timedelta
+from middleware.auth import get_current_user
+from services.supabase_service import get_db, execute
+from services import postgres_service, count_service, counter_buffer_service
+from services.projection_service import POST_PROJECTIONS, resolve_projection
+from services.ranking_index_service import ranking_index
+from services.membership_service import get_community_ids
+from services.feed_cache_service import ALL, cached_feed, invalidate_feeds
+from services.feed_service import count_posts, ranked_page
+from services.vote_service import VOTE_TYPES, cast_vote
+from datetime import datetime
+import asyncio
 import uuid
 
 
@@ -17,6 +25,7 @@ class PostType(str, Enum):
 
 router = APIRouter()
 
+
 class PostCreate(BaseModel):
     community_id: str
     title: str
@@ -28,300 +37,110 @@ class PostUpdate(BaseModel):
     content: Optional[str] = None
     post_type: Optional[PostType] = None
 
+class ViewerStateRequest(BaseModel):
+    post_ids: List[str]
+
+# Posts per viewer-state request; a feed page is at most 100
+VIEWER_STATE_MAX_POSTS = 100
+
 @router.get("")
 async def list_posts(
     limit: int = 25,
     offset: int = 0,
     community_id: Optional[str] = None,
-    sort: str = "hot",
-    time_range: Optional[str] = None  # day, week, month, year, all
+    sort: str = "hot",  # hot, new, top, controversial, best, rising
+    time_range: Optional[str] = None,  # day, week, month, year, all
+    fields: Optional[str] = None,  # projection name and/or extra fields, e.g. "detail" or "user.bio"
+    cursor: Optional[str] = None  # next_cursor from the previous page; takes precedence over offset
 ):
     """List posts with various sorting options"""
-    supabase = get_supabase()
-    
-    query = supabase.table("posts").select("*, user:users(*), community:communities(*)")
-    
-    # Filter by community if provided
-    if community_id:
-        query = query.eq("community_id", community_id)
-    
-    # Filter by time range if specified
-    if time_range and time_range != "all":
-        from datetime import datetime, timedelta
-        now = datetime.utcnow()
-        if time_range == "day":
-            from_date = now - timedelta(days=1)
-        elif time_range == "week":
-            from_date = now - timedelta(weeks=1)
-        elif time_range == "month":
-            from_date = now - timedelta(days=30)
-        elif time_range == "year":
-            from_date = now - timedelta(days=365)
-        else:
-            from_date = now  # fallback
-        
-        query = query.gte("created_at", from_date.isoformat())
-    
-    # Apply sorting
-    if sort == "new":
-        query = query.order("created_at", desc=True)
-    elif sort == "top":
-        # For top posts, we may want to filter by time_range as well
-        query = query.order("upvotes", desc=True)
-    elif sort == "controversial":
-        # Controversial: posts with high upvote/downvote ratios
-        # For now, we'll order by the absolute difference between upvotes and downvotes
-        query = query.order("created_at", desc=True)  # Supabase doesn't support complex expressions in order, so we'll handle this in code
-    else:  # hot
-        # Simple hot algorithm: (upvotes - downvotes) / age_in_hours
-        query = query.order("created_at", desc=True)  # Supabase doesn't support complex expressions in order, so we'll handle this in code
-    
-    result = query.limit(limit).offset(offset).execute()
-    posts = result.data or []
-    
-    # Apply complex sorting algorithms after fetching from database
-    if sort == "hot":
-        import math
-        from datetime import datetime
-        
-        def calculate_hot_score(post):
-            upvotes = post.get('upvotes', 0) or 0
-            downvotes = post.get('downvotes', 0) or 0
-            created_at = datetime.fromisoformat(post['created_at'].replace('Z', '+00:00'))
-            
-            # Reddit-style hot algorithm
-            score = upvotes - downvotes
-            order = math.log10(max(abs(score), 1))
-            sign = 1 if score > 0 else -1 if score < 0 else 0
-            
-            # Time in hours since post
-            hours = (datetime.utcnow() - created_at.replace(tzinfo=None)).total_seconds() / 3600
-            
-            return round(order + sign * hours, 7)
+    community_ids = [community_id] if community_id else None
+    projection = resolve_projection(POST_PROJECTIONS, fields)
+    
+    async def build():
+        posts, page_cursor = await ranked_page(community_ids, time_range, projection, sort, limit, offset, cursor)
         
-        posts.sort(key=calculate_hot_score, reverse=True)
-    elif sort == "controversial":
-        def calculate_controversy(post):
-            upvotes = post.get('upvotes', 0) or 0
-            downvotes = post.get('downvotes', 0) or 0
-            
-            # Controversy score based on balance of upvotes and downvotes
-            total_votes = upvotes + downvotes
-            if total_votes == 0:
-                return 0
-            
-            # Ratio closer to 0.5 is more controversial
-            upvote_ratio = upvotes / total_votes
-            balance = 1 - abs(0.5 - upvote_ratio) * 2  # This will be 1 when ratio is 0.5, 0 when ratio is 0 or 1
-            return balance * total_votes
+        # Total for pagination, from the community's post counter or a planner estimate
+        total_count = await count_posts(community_ids, time_range, community_id)
         
-        posts.sort(key=calculate_controversy, reverse=True)
-    
-    # Get the total count for pagination (without the limit/offset)
-    count_query = supabase.table("posts").select("count", count="exact")
-    if community_id:
-        count_query = count_query.eq("community_id", community_id)
-    if time_range and time_range != "all":
-        count_query = count_query.gte("created_at", from_date.isoformat())
-    
-    count_result = count_query.execute()
-    total_count = count_result.data[0]['count'] if count_result.data else 0
-    
-    # Return the sorted posts and total count
-    return {"posts": posts, "total": total_count}
+        # Return the posts, total count and the cursor for the next page
+        return {"posts": posts, "total": total_count, "next_cursor": page_cursor}
+    
+    # Served through the shared feed cache, invalidated by writes to the community
+    return await cached_feed(
+        [community_id or ALL],
+        ("posts", community_id, sort, time_range, projection.key, limit, offset, cursor),
+        build
+    )
 
 
 @router.get("/feed/home")
 async def get_home_feed(
-    uid: str = Depends(get_current_user_uid),
+    user: dict = Depends(get_current_user),
     limit: int = 25,
     offset: int = 0,
-    sort: str = "hot",
-    time_range: Optional[str] = None  # day, week, month, year, all
+    sort: str = "hot",  # hot, new, top, controversial, best, rising
+    time_range: Optional[str] = None,  # day, week, month, year, all
+    fields: Optional[str] = None,  # projection name and/or extra fields, e.g. "detail" or "user.bio"
+    cursor: Optional[str] = None  # next_cursor from the previous page; takes precedence over offset
 ):
     """Get posts from communities the user is following"""
-    supabase = get_supabase()
-    
     # Get user's joined communities
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
-    # Get communities the user is following
-    membership_result = supabase.table("community_members").select("community_id").eq("user_id", user_id).execute()
-    community_ids = [m["community_id"] for m in membership_result.data] if membership_result.data else []
+    # Get communities the user is following (cached per user)
+    community_ids = await get_community_ids(user_id)
     
     # If user is not in any communities, return empty result
     if not community_ids:
-        return {"posts": [], "total": 0}
-    
-    # Build query for posts in user's communities
-    query = supabase.table("posts").select("*, user:users(*), community:communities(*)")
-    query = query.in_("community_id", community_ids)
-    
-    # Filter by time range if specified
-    if time_range and time_range != "all":
-        from datetime import datetime, timedelta
-        now = datetime.utcnow()
-        if time_range == "day":
-            from_date = now - timedelta(days=1)
-        elif time_range == "week":
-            from_date = now - timedelta(weeks=1)
-        elif time_range == "month":
-            from_date = now - timedelta(days=30)
-        elif time_range == "year":
-            from_date = now - timedelta(days=365)
-        else:
-            from_date = now  # fallback
-        
-        query = query.gte("created_at", from_date.isoformat())
-    
-    result = query.execute()
-    all_posts = result.data or []
-    
-    # Apply complex sorting algorithms after fetching from database
-    if sort == "hot":
-        import math
-        from datetime import datetime
-        
-        def calculate_hot_score(post):
-            upvotes = post.get('upvotes', 0) or 0
-            downvotes = post.get('downvotes', 0) or 0
-            created_at = datetime.fromisoformat(post['created_at'].replace('Z', '+00:00'))
-            
-            # Reddit-style hot algorithm
-            score = upvotes - downvotes
-            order = math.log10(max(abs(score), 1))
-            sign = 1 if score > 0 else -1 if score < 0 else 0
-            
-            # Time in hours since post
-            hours = (datetime.utcnow() - created_at.replace(tzinfo=None)).total_seconds() / 3600
-            
-            return round(order + sign * hours, 7)
-        
-        all_posts.sort(key=calculate_hot_score, reverse=True)
-    elif sort == "controversial":
-        def calculate_controversy(post):
-            upvotes = post.get('upvotes', 0) or 0
-            downvotes = post.get('downvotes', 0) or 0
-            
-            # Controversy score based on balance of upvotes and downvotes
-            total_votes = upvotes + downvotes
-            if total_votes == 0:
-                return 0
-            
-            # Ratio closer to 0.5 is more controversial
-            upvote_ratio = upvotes / total_votes
-            balance = 1 - abs(0.5 - upvote_ratio) * 2  # This will be 1 when ratio is 0.5, 0 when ratio is 0 or 1
-            return balance * total_votes
-        
-        all_posts.sort(key=calculate_controversy, reverse=True)
-    elif sort == "new":
-        all_posts.sort(key=lambda x: x['created_at'], reverse=True)
-    elif sort == "top":
-        all_posts.sort(key=lambda x: x['upvotes'], reverse=True)
-    
-    # Apply pagination
-    paginated_posts = all_posts[offset:offset+limit]
-    
-    return {"posts": paginated_posts, "total": len(all_posts)}
+        return {"posts": [], "total": 0, "next_cursor": None}
+    
+    # Fetch the top posts in user's communities, filtered by time range if specified
+    posts, page_cursor = await ranked_page(
+        community_ids,
+        time_range,
+        resolve_projection(POST_PROJECTIONS, fields),
+        sort,
+        limit,
+        offset,
+        cursor
+    )
+    total_count = await count_posts(community_ids, time_range, ("home", user_id))
+    
+    return {"posts": posts, "total": total_count, "next_cursor": page_cursor}
 
 
 @router.get("/feed/explore")
 async def get_explore_feed(
     limit: int = 25,
     offset: int = 0,
-    sort: str = "hot",
-    time_range: Optional[str] = None  # day, week, month, year, all
+    sort: str = "hot",  # hot, new, top, controversial, best, rising
+    time_range: Optional[str] = None,  # day, week, month, year, all
+    fields: Optional[str] = None,  # projection name and/or extra fields, e.g. "detail" or "user.bio"
+    cursor: Optional[str] = None  # next_cursor from the previous page; takes precedence over offset
 ):
     """Get trending posts across all communities"""
-    supabase = get_supabase()
-    
-    query = supabase.table("posts").select("*, user:users(*), community:communities(*)")
-    
-    # Filter by time range if specified
-    if time_range and time_range != "all":
-        from datetime import datetime, timedelta
-        now = datetime.utcnow()
-        if time_range == "day":
-            from_date = now - timedelta(days=1)
-        elif time_range == "week":
-            from_date = now - timedelta(weeks=1)
-        elif time_range == "month":
-            from_date = now - timedelta(days=30)
-        elif time_range == "year":
-            from_date = now - timedelta(days=365)
-        else:
-            from_date = now  # fallback
-        
-        query = query.gte("created_at", from_date.isoformat())
-    
-    result = query.execute()
-    all_posts = result.data or []
+    projection = resolve_projection(POST_PROJECTIONS, fields)
     
-    # Apply complex sorting algorithms after fetching from database
-    if sort == "hot":
-        import math
-        from datetime import datetime
-        
-        def calculate_hot_score(post):
-            upvotes = post.get('upvotes', 0) or 0
-            downvotes = post.get('downvotes', 0) or 0
-            created_at = datetime.fromisoformat(post['created_at'].replace('Z', '+00:00'))
-            
-            # Reddit-style hot algorithm
-            score = upvotes - downvotes
-            order = math.log10(max(abs(score), 1))
-            sign = 1 if score > 0 else -1 if score < 0 else 0
-            
-            # Time in hours since post
-            hours = (datetime.utcnow() - created_at.replace(tzinfo=None)).total_seconds() / 3600
-            
-            return round(order + sign * hours, 7)
-        
-        all_posts.sort(key=calculate_hot_score, reverse=True)
-    elif sort == "controversial":
-        def calculate_controversy(post):
-            upvotes = post.get('upvotes', 0) or 0
-            downvotes = post.get('downvotes', 0) or 0
-            
-            # Controversy score based on balance of upvotes and downvotes
-            total_votes = upvotes + downvotes
-            if total_votes == 0:
-                return 0
-            
-            # Ratio closer to 0.5 is more controversial
-            upvote_ratio = upvotes / total_votes
-            balance = 1 - abs(0.5 - upvote_ratio) * 2  # This will be 1 when ratio is 0.5, 0 when ratio is 0 or 1
-            return balance * total_votes
+    async def build():
+        # Fetch the top posts across all communities, filtered by time range if specified
+        posts, page_cursor = await ranked_page(None, time_range, projection, sort, limit, offset, cursor)
+        total_count = await count_posts(None, time_range, None)
         
-        all_posts.sort(key=calculate_controversy, reverse=True)
-    elif sort == "new":
-        all_posts.sort(key=lambda x: x['created_at'], reverse=True)
-    elif sort == "top":
-        all_posts.sort(key=lambda x: x['upvotes'], reverse=True)
+        return {"posts": posts, "total": total_count, "next_cursor": page_cursor}
     
-    # Apply pagination
-    paginated_posts = all_posts[offset:offset+limit]
-    
-    return {"posts": paginated_posts, "total": len(all_posts)}
+    return await cached_feed([ALL], ("explore", sort, time_range, projection.key, limit, offset, cursor), build)
 
 
 @router.post("")
 async def create_post(
     post: PostCreate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Create a new post"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Validate content based on post type
     if post.post_type == PostType.link:
@@ -351,38 +170,46 @@ async def create_post(
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("posts").insert(post_data).execute()
+    result = await execute(db.table("posts").insert(post_data))
+    count_service.invalidate(("community_posts", post.community_id))
+    if result.data:
+        ranking_index.on_post_scored(result.data[0])
+    await invalidate_feeds(post.community_id)
     
     return result.data[0] if result.data else None
 
 @router.get("/{post_id}")
-async def get_post(post_id: str):
+async def get_post(post_id: str, fields: Optional[str] = None):
     """Get post details"""
-    supabase = get_supabase()
-    
-    result = supabase.table("posts").select("*, user:users(*), community:communities(*)").eq("id", post_id).execute()
-    
-    if not result.data:
+    projection = resolve_projection(POST_PROJECTIONS, fields, default="detail")
+    posts = None
+    if not projection.adhoc:
+        posts = await postgres_service.fetch_all(f"post_detail_{projection.key}", post_id)
+    if posts is None:
+        result = await execute(get_db().table("posts").select(projection.select()).eq("id", post_id))
+        posts = result.data
+    
+    if not posts:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    return result.data[0]
+    # Counters may still have buffered votes and comments from this worker
+    return counter_buffer_service.overlay("posts", posts[0])
 
 @router.patch("/{post_id}")
 async def update_post(
     post_id: str,
     post: PostUpdate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Update post"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify ownership
-    post_result = supabase.table("posts").select("user_id").eq("id", post_id).execute()
+    post_result = await execute(db.table("posts").select("user_id, community_id").eq("id", post_id))
     if not post_result.data:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data or post_result.data[0]["user_id"] != user_result.data[0]["id"]:
+    if post_result.data[0]["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     update_data = post.dict(exclude_unset=True)
@@ -410,28 +237,31 @@ async def update_post(
         if 'post_type' in update_data:
             update_data['post_type'] = update_data['post_type'].value
     
-    result = supabase.table("posts").update(update_data).eq("id", post_id).execute()
+    result = await execute(db.table("posts").update(update_data).eq("id", post_id))
+    await invalidate_feeds(post_result.data[0]["community_id"])
     
     return result.data[0] if result.data else None
 
 @router.delete("/{post_id}")
 async def delete_post(
     post_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Delete post"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify ownership
-    post_result = supabase.table("posts").select("user_id").eq("id", post_id).execute()
+    post_result = await execute(db.table("posts").select("user_id, community_id").eq("id", post_id))
     if not post_result.data:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data or post_result.data[0]["user_id"] != user_result.data[0]["id"]:
+    if post_result.data[0]["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    supabase.table("posts").delete().eq("id", post_id).execute()
+    await execute(db.table("posts").delete().eq("id", post_id))
+    count_service.invalidate(("community_posts", post_result.data[0]["community_id"]))
+    ranking_index.on_post_deleted(post_result.data[0]["community_id"], post_id)
+    await invalidate_feeds(post_result.data[0]["community_id"])
     
     return {"message": "Post deleted"}
 
@@ -439,75 +269,79 @@ async def delete_post(
 async def vote_post(
     post_id: str,
     vote_type: str,  # "upvote" or "downvote"
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Vote on a post"""
-    supabase = get_supabase()
+    if vote_type not in VOTE_TYPES:
+        raise HTTPException(status_code=400, detail="vote_type must be 'upvote' or 'downvote'")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    # One call records the vote, applies the counter delta and returns the new totals and scores
+    scored = await cast_vote(user["id"], "post", post_id, vote_type)
+    if scored is None:
+        raise HTTPException(status_code=404, detail="Post not found")
     
-    user_id = user_result.data[0]["id"]
+    ranking_index.on_post_scored(scored)
+    # Cross-community feeds ride out a vote on their short TTL
+    await invalidate_feeds(scored["community_id"], include_all=False)
     
-    # Get the post to find the author
-    post_result = supabase.table("posts").select("user_id").eq("id", post_id).execute()
-    if not post_result.data:
-        raise HTTPException(status_code=404, detail="Post not found")
-    post_author_id = post_result.data[0]["user_id"]
-    
-    # Check existing vote
-    existing = supabase.table("votes").select("*").eq("votable_type", "post").eq("votable_id", post_id).eq("user_id", user_id).execute()
-    
-    if existing.data:
-        existing_vote = existing.data[0]
-        if existing_vote["vote_type"] == vote_type:
-            # Remove vote
-            supabase.table("votes").delete().eq("id", existing_vote["id"]).execute()
-            if vote_type == "upvote":
-                supabase.rpc("decrement", {"table_name": "posts", "column_name": "upvotes", "id": post_id}).execute()
-                # Update author's reputation (decrement for removing upvote)
-                # We could implement reputation update here if needed
-            else:
-                supabase.rpc("decrement", {"table_name": "posts", "column_name": "downvotes", "id": post_id}).execute()
-                # Update author's reputation (increment for removing downvote)
-                # We could implement reputation update here if needed
-            return {"voted": False, "vote_type": None}
-        else:
-            # Change vote
-            supabase.table("votes").update({"vote_type": vote_type}).eq("id", existing_vote["id"]).execute()
-            if vote_type == "upvote":
-                supabase.rpc("increment", {"table_name": "posts", "column_name": "upvotes", "id": post_id}).execute()
-                supabase.rpc("decrement", {"table_name": "posts", "column_name": "downvotes", "id": post_id}).execute()
-            else:
-                supabase.rpc("increment", {"table_name": "posts", "column_name": "downvotes", "id": post_id}).execute()
-                supabase.rpc("decrement", {"table_name": "posts", "column_name": "upvotes", "id": post_id}).execute()
-            return {"voted": True, "vote_type": vote_type}
-    else:
-        # New vote
-        supabase.table("votes").insert({
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "votable_type": "post",
-            "votable_id": post_id,
-            "vote_type": vote_type,
-            "created_at": datetime.utcnow().isoformat(),
-        }).execute()
-        
-        if vote_type == "upvote":
-            supabase.rpc("increment", {"table_name": "posts", "column_name": "upvotes", "id": post_id}).execute()
-        else:
-            supabase.rpc("increment", {"table_name": "posts", "column_name": "downvotes", "id": post_id}).execute()
-        
-        return {"voted": True, "vote_type": vote_type}
+    return {
+        "voted": scored["vote_type"] is not None,
+        "vote_type": scored["vote_type"],
+        "upvotes": scored["upvotes"],
+        "downvotes": scored["downvotes"],
+    }
+
+@router.post("/viewer-state")
+async def get_viewer_state(
+    request: ViewerStateRequest,
+    user: dict = Depends(get_current_user)
+):
+    """The caller's vote, reaction and bookmark on each of a page of posts"""
+    post_ids = list(dict.fromkeys(request.post_ids))
+    if len(post_ids) > VIEWER_STATE_MAX_POSTS:
+        raise HTTPException(status_code=400, detail=f"At most {VIEWER_STATE_MAX_POSTS} posts per request")
+    if not post_ids:
+        return {"states": {}}
+    
+    db = get_db()
+    user_id = user["id"]
+    
+    # One query per table, all at once
+    votes, reactions, bookmarks = await asyncio.gather(
+        execute(db.table("votes").select("votable_id, vote_type").eq("user_id", user_id).eq("votable_type", "post").in_("votable_id", post_ids)),
+        execute(db.table("reactions").select("post_id, reaction_type").eq("user_id", user_id).in_("post_id", post_ids)),
+        execute(db.table("bookmarks").select("post_id").eq("user_id", user_id).in_("post_id", post_ids)),
+    )
+    
+    states = {post_id: {"vote_type": None, "reaction_type": None, "bookmarked": False} for post_id in post_ids}
+    for vote in votes.data or []:
+        if vote["votable_id"] in states:
+            states[vote["votable_id"]]["vote_type"] = vote["vote_type"]
+    for reaction in reactions.data or []:
+        if reaction["post_id"] in states:
+            states[reaction["post_id"]]["reaction_type"] = reaction["reaction_type"]
+    for bookmark in bookmarks.data or []:
+        if bookmark["post_id"] in states:
+            states[bookmark["post_id"]]["bookmarked"] = True
+    
+    return {"states": states}
 
 @router.get("/{post_id}/comments")
 async def get_post_comments(post_id: str):
     """Get comments for a post"""
-    supabase = get_supabase()
+    comments = await postgres_service.fetch_all("post_comments", post_id)
+    if comments is None:
+        result = await execute(get_db().table("comments").select("*, user:users(*)").eq("post_id", post_id).is_("parent_comment_id", "null").order("created_at", desc=False))
+        comments = result.data
     
-    result = supabase.table("comments").select("*, user:users(*)").eq("post_id", post_id).is_("parent_comment_id", "null").order("created_at", desc=False).execute()
+    comments = comments or []
     
     # TODO: Build nested comment structure
-    return {"comments": result.data or []}
+    # The list holds every top-level comment, so total counts those; comment_count
+    # (the post's maintained counter) includes replies
+    return {
+        "comments": comments,
+        "total": len(comments),
+        "comment_count": await count_service.post_comment_count(post_id),
+    }
 
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from middleware.auth import get_current_user
+from services.supabase_service import get_supabase, get_db, execute, is_missing_reference
+from services.projection_service import PROJECT_PROJECTIONS, resolve_projection
+from services import count_service, counter_buffer_service
 from datetime import datetime
 import uuid
 import io
@@ -31,38 +34,40 @@ async def list_projects(
     offset: int = 0,
     search: Optional[str] = None,
     tags: Optional[str] = None,
-    visibility: str = "public"
+    visibility: str = "public",
+    fields: Optional[str] = None  # projection name and/or extra fields, e.g. "detail" or "user.bio"
 ):
     """List projects with filters"""
-    supabase = get_supabase()
+    db = get_db()
     
-    query = supabase.table("projects").select("*, user:users(*)").eq("visibility", visibility)
+    projection = resolve_projection(PROJECT_PROJECTIONS, fields)
+    query = db.table("projects").select(projection.select()).eq("visibility", visibility)
+    count_query = count_service.count_query("projects").eq("visibility", visibility)
     
     if search:
         query = query.ilike("title", f"%{search}%")
+        count_query = count_query.ilike("title", f"%{search}%")
     
     if tags:
         tag_list = tags.split(",")
         query = query.contains("tags", tag_list)
+        count_query = count_query.contains("tags", tag_list)
     
-    result = query.limit(limit).offset(offset).order("created_at", desc=True).execute()
+    result = await execute(query.limit(limit).offset(offset).order("created_at", desc=True))
+    total = await count_service.estimated_count(("projects", visibility, search, tags), count_query)
     
-    return {"projects": result.data or [], "total": len(result.data or [])}
+    return {"projects": result.data or [], "total": total}
 
 @router.post("")
 async def create_project(
     project: ProjectCreate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Create a new project"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Get user ID
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User profile not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     project_data = {
         "id": str(uuid.uuid4()),
@@ -78,7 +83,7 @@ async def create_project(
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("projects").insert(project_data).execute()
+    result = await execute(db.table("projects").insert(project_data))
     
     if not result.data:
         raise HTTPException(status_code=500, detail="Failed to create project")
@@ -88,17 +93,17 @@ async def create_project(
 @router.get("/{project_id}")
 async def get_project(project_id: str):
     """Get project details"""
-    supabase = get_supabase()
+    db = get_db()
     
-    result = supabase.table("projects").select("*, user:users(*)").eq("id", project_id).execute()
+    result = await execute(db.table("projects").select("*, user:users(*)").eq("id", project_id))
     
     if not result.data:
         raise HTTPException(status_code=404, detail="Project not found")
     
     # Get files
-    files_result = supabase.table("project_files").select("*").eq("project_id", project_id).execute()
+    files_result = await execute(db.table("project_files").select("*").eq("project_id", project_id))
     
-    project = result.data[0]
+    project = counter_buffer_service.overlay("projects", result.data[0])
     project["files"] = files_result.data or []
     
     return project
@@ -107,94 +112,92 @@ async def get_project(project_id: str):
 async def update_project(
     project_id: str,
     project: ProjectUpdate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Update project"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify ownership
-    project_result = supabase.table("projects").select("user_id").eq("id", project_id).execute()
+    project_result = await execute(db.table("projects").select("user_id").eq("id", project_id))
     if not project_result.data:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data or project_result.data[0]["user_id"] != user_result.data[0]["id"]:
+    if project_result.data[0]["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     update_data = project.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.utcnow().isoformat()
     
-    result = supabase.table("projects").update(update_data).eq("id", project_id).execute()
+    result = await execute(db.table("projects").update(update_data).eq("id", project_id))
     
     return result.data[0] if result.data else None
 
 @router.delete("/{project_id}")
 async def delete_project(
     project_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Delete project"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify ownership
-    project_result = supabase.table("projects").select("user_id").eq("id", project_id).execute()
+    project_result = await execute(db.table("projects").select("user_id").eq("id", project_id))
     if not project_result.data:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data or project_result.data[0]["user_id"] != user_result.data[0]["id"]:
+    if project_result.data[0]["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    supabase.table("projects").delete().eq("id", project_id).execute()
+    await execute(db.table("projects").delete().eq("id", project_id))
     
     return {"message": "Project deleted"}
 
 @router.post("/{project_id}/star")
 async def star_project(
     project_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Star/unstar a project"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Check if already starred
-    existing = supabase.table("project_stars").select("*").eq("project_id", project_id).eq("user_id", user_id).execute()
+    existing = await execute(db.table("project_stars").select("*").eq("project_id", project_id).eq("user_id", user_id))
     
+    if not await counter_buffer_service.hold("projects", project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
     if existing.data:
         # Unstar
-        supabase.table("project_stars").delete().eq("project_id", project_id).eq("user_id", user_id).execute()
+        await execute(db.table("project_stars").delete().eq("project_id", project_id).eq("user_id", user_id))
         # Decrement star count
-        supabase.rpc("decrement", {"table_name": "projects", "column_name": "star_count", "id": project_id}).execute()
+        await counter_buffer_service.adjust("projects", project_id, "star_count", -1)
         return {"starred": False}
     else:
         # Star
-        supabase.table("project_stars").insert({"project_id": project_id, "user_id": user_id}).execute()
+        try:
+            await execute(db.table("project_stars").insert({"project_id": project_id, "user_id": user_id}))
+        except Exception as e:
+            if is_missing_reference(e, "project_id"):
+                await counter_buffer_service.release("projects", project_id)
+                raise HTTPException(status_code=404, detail="Project not found")
+            raise
         # Increment star count
-        supabase.rpc("increment", {"table_name": "projects", "column_name": "star_count", "id": project_id}).execute()
+        await counter_buffer_service.adjust("projects", project_id, "star_count", 1)
         return {"starred": True}
 
 @router.post("/{project_id}/fork")
 async def fork_project(
     project_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Fork a project (create a copy)"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Get original project
-    original_result = supabase.table("projects").select("*").eq("id", project_id).execute()
+    original_result = await execute(db.table("projects").select("*").eq("id", project_id))
     if not original_result.data:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -219,7 +222,7 @@ async def fork_project(
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("projects").insert(forked_project_data).execute()
+    result = await execute(db.table("projects").insert(forked_project_data))
     
     if not result.data:
         raise HTTPException(status_code=500, detail="Failed to fork project")
@@ -227,10 +230,10 @@ async def fork_project(
     forked_project_id = result.data[0]["id"]
     
     # Copy files (create references to original files)
-    files_result = supabase.table("project_files").select("*").eq("project_id", project_id).execute()
+    files_result = await execute(db.table("project_files").select("*").eq("project_id", project_id))
     if files_result.data:
         for file in files_result.data:
-            supabase.table("project_files").insert({
+            await execute(db.table("project_files").insert({
                 "id": str(uuid.uuid4()),
                 "project_id": forked_project_id,
                 "file_name": file["file_name"],
@@ -238,20 +241,20 @@ async def fork_project(
                 "file_type": file.get("file_type"),
                 "file_size": file.get("file_size", 0),
                 "created_at": datetime.utcnow().isoformat(),
-            }).execute()
+            }))
     
     # Increment fork count on original project
-    supabase.rpc("increment", {"table_name": "projects", "column_name": "fork_count", "id": project_id}).execute()
+    await execute(db.rpc("increment", {"table_name": "projects", "column_name": "fork_count", "id": project_id}))
     
     return {"message": "Project forked successfully", "forked_project_id": forked_project_id}
 
 @router.get("/{project_id}/download")
 async def download_project(project_id: str):
     """Download project as ZIP file"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Get project and files
-    project_result = supabase.table("projects").select("*").eq("id", project_id).execute()
+    project_result = await execute(db.table("projects").select("*").eq("id", project_id))
     if not project_result.data:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -261,7 +264,7 @@ async def download_project(project_id: str):
     if project["visibility"] == "private":
         raise HTTPException(status_code=403, detail="Cannot download private project")
     
-    files_result = supabase.table("project_files").select("*").eq("project_id", project_id).execute()
+    files_result = await execute(db.table("project_files").select("*").eq("project_id", project_id))
     files = files_result.data or []
     
     # Create ZIP file in memory
@@ -290,7 +293,7 @@ async def download_project(project_id: str):
 async def upload_file(
     project_id: str,
     file: UploadFile = File(...),
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Upload file to project"""
     # Validate file extension
@@ -300,28 +303,28 @@ async def upload_file(
     if file_extension not in valid_extensions:
         raise HTTPException(status_code=400, detail=f"File type not supported. Valid types: {', '.join(valid_extensions)}")
     
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify ownership
-    project_result = supabase.table("projects").select("user_id").eq("id", project_id).execute()
+    project_result = await execute(db.table("projects").select("user_id").eq("id", project_id))
     if not project_result.data:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data or project_result.data[0]["user_id"] != user_result.data[0]["id"]:
+    if project_result.data[0]["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Upload to Supabase Storage
     file_content = await file.read()
     file_path = f"projects/{project_id}/{file.filename}"
     
-    storage_result = supabase.storage.from_("project-files").upload(file_path, file_content)
+    storage = get_supabase().storage.from_("project-files")
+    storage_result = await run_in_threadpool(storage.upload, file_path, file_content)
     
     if not storage_result:
         raise HTTPException(status_code=500, detail="Failed to upload file")
     
     # Get public URL
-    url_result = supabase.storage.from_("project-files").get_public_url(file_path)
+    url_result = storage.get_public_url(file_path)
     
     # Save file metadata
     file_data = {
@@ -334,6 +337,6 @@ async def upload_file(
         "created_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("project_files").insert(file_data).execute()
+    result = await execute(db.table("project_files").insert(file_data))
     
     return result.data[0] if result.data else None
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from middleware.auth import get_current_user_uid, get_current_user, lookup_user
+from services.supabase_service import get_db, execute
 from services.websocket_service import manager
+from services.loader_service import Loaders, get_loaders
+from services import notification_service
 from datetime import datetime
+import asyncio
 import uuid
 import json
 
@@ -16,23 +19,20 @@ class ReactionCreate(BaseModel):
 @router.post("")
 async def add_reaction(
     reaction: ReactionCreate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
 ):
     """Add reaction to a post"""
-    supabase = get_supabase()
+    db = get_db()
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Check if reaction already exists
-    existing = supabase.table("reactions").select("*").eq("post_id", reaction.post_id).eq("user_id", user_id).eq("reaction_type", reaction.reaction_type).execute()
+    existing = await execute(db.table("reactions").select("*").eq("post_id", reaction.post_id).eq("user_id", user_id).eq("reaction_type", reaction.reaction_type))
     
     if existing.data:
         # Remove reaction
-        supabase.table("reactions").delete().eq("id", existing.data[0]["id"]).execute()
+        await execute(db.table("reactions").delete().eq("id", existing.data[0]["id"]))
         
         # Broadcast to all connected clients watching this post
         await manager.broadcast_to_post(reaction.post_id, json.dumps({
@@ -45,7 +45,7 @@ async def add_reaction(
         return {"added": False}
     else:
         # Remove any existing reaction from this user on this post
-        supabase.table("reactions").delete().eq("post_id", reaction.post_id).eq("user_id", user_id).execute()
+        await execute(db.table("reactions").delete().eq("post_id", reaction.post_id).eq("user_id", user_id))
         
         # Add new reaction
         reaction_data = {
@@ -55,33 +55,27 @@ async def add_reaction(
             "reaction_type": reaction.reaction_type,
             "created_at": datetime.utcnow().isoformat(),
         }
-        result = supabase.table("reactions").insert(reaction_data).execute()
+        result = await execute(db.table("reactions").insert(reaction_data))
         reaction_id = result.data[0]["id"] if result.data else None
         
-        # Get updated reactions for the post
-        reactions_result = supabase.table("reactions").select("*, user:users(*)").eq("post_id", reaction.post_id).execute()
+        # Get updated reactions for the post, and the post itself for the notification
+        reactions_result, post = await asyncio.gather(
+            execute(db.table("reactions").select("*, user:users(*)").eq("post_id", reaction.post_id)),
+            loaders.get("posts", select="id, user_id, title").load(reaction.post_id),
+        )
         
-        # Create notification for post author
-        post_result = supabase.table("posts").select("user_id, title").eq("id", reaction.post_id).execute()
-        if post_result.data:
-            post_author_id = post_result.data[0]["user_id"]
-            post_title = post_result.data[0]["title"]
-            
-            # Don't notify if the same user is reacting to their own post
-            if post_author_id != user_id:
-                notification_data = {
-                    "id": str(uuid.uuid4()),
-                    "recipient_id": post_author_id,
-                    "type": "reaction",
-                    "title": f"New {reaction.reaction_type} reaction to your post",
-                    "content": f"{user_result.data[0].get('display_name', 'A user')} reacted to your post '{post_title}' with {reaction.reaction_type}",
-                    "post_id": reaction.post_id,
-                    "actor_id": user_id,
-                    "is_read": False,
-                    "created_at": datetime.utcnow().isoformat(),
-                    "updated_at": datetime.utcnow().isoformat(),
-                }
-                supabase.table("notifications").insert(notification_data).execute()
+        # Queue a notification for the post author (skipped for their own post),
+        # merged with other recent reactions to the post they have not read yet
+        if post:
+            await notification_service.notify([notification_service.notification(
+                post["user_id"],
+                "reaction",
+                f"New {reaction.reaction_type} reaction to your post",
+                f"{user.get('display_name') or 'A user'} reacted to your post '{post['title']}' with {reaction.reaction_type}",
+                post_id=reaction.post_id,
+                actor_id=user_id,
+                action=f"reacted to your post '{post['title']}'",
+            )], notification_service.actor_card(user))
         
         # Broadcast to all connected clients watching this post
         await manager.broadcast_to_post(reaction.post_id, json.dumps({
@@ -98,28 +92,24 @@ async def add_reaction(
 @router.get("/posts/{post_id}")
 async def get_post_reactions(post_id: str):
     """Get all reactions for a post"""
-    supabase = get_supabase()
+    db = get_db()
     
-    result = supabase.table("reactions").select("*, user:users(*)").eq("post_id", post_id).execute()
+    result = await execute(db.table("reactions").select("*, user:users(*)").eq("post_id", post_id))
     
     return {"reactions": result.data or []}
 
 @router.delete("/{reaction_id}")
 async def remove_reaction(
     reaction_id: str,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Remove a reaction"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Get reaction before deleting to get post_id
-    reaction_result = supabase.table("reactions").select("user_id, post_id").eq("id", reaction_id).execute()
+    reaction_result = await execute(db.table("reactions").select("user_id, post_id").eq("id", reaction_id))
     if not reaction_result.data:
         raise HTTPException(status_code=404, detail="Reaction not found")
     
@@ -128,7 +118,7 @@ async def remove_reaction(
     
     post_id = reaction_result.data[0]["post_id"]
     
-    supabase.table("reactions").delete().eq("id", reaction_id).execute()
+    await execute(db.table("reactions").delete().eq("id", reaction_id))
     
     # Broadcast to all connected clients watching this post
     await manager.broadcast_to_post(post_id, json.dumps({
@@ -143,15 +133,15 @@ async def remove_reaction(
 @router.websocket("/ws/{post_id}")
 async def websocket_reactions(websocket: WebSocket, post_id: str, uid: str = Depends(get_current_user_uid)):
     """WebSocket endpoint for real-time reactions"""
-    supabase = get_supabase()
+    db = get_db()
     
     # Verify user exists
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
+    user = await lookup_user(uid)
+    if not user:
         await websocket.close(code=1008, reason="User not found")
         return
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     await manager.connect(websocket, connection_type="reactions", post_id=post_id, user_id=user_id)
     try:
@@ -165,16 +155,16 @@ async def websocket_reactions(websocket: WebSocket, post_id: str, uid: str = Dep
                     reaction_type = message.get("reaction_type")
                     if reaction_type:
                         # Check if reaction already exists
-                        existing = supabase.table("reactions").select("*").eq("post_id", post_id).eq("user_id", user_id).eq("reaction_type", reaction_type).execute()
+                        existing = await execute(db.table("reactions").select("*").eq("post_id", post_id).eq("user_id", user_id).eq("reaction_type", reaction_type))
                         
                         if existing.data:
                             # Remove reaction
-                            supabase.table("reactions").delete().eq("id", existing.data[0]["id"]).execute()
+                            await execute(db.table("reactions").delete().eq("id", existing.data[0]["id"]))
                             reaction_id = existing.data[0]["id"]
                             action_type = "removed"
                         else:
                             # Remove any existing reaction from this user on this post
-                            supabase.table("reactions").delete().eq("post_id", post_id).eq("user_id", user_id).execute()
+                            await execute(db.table("reactions").delete().eq("post_id", post_id).eq("user_id", user_id))
                             
                             # Add new reaction
                             reaction_data = {
@@ -184,12 +174,12 @@ async def websocket_reactions(websocket: WebSocket, post_id: str, uid: str = Dep
                                 "reaction_type": reaction_type,
                                 "created_at": datetime.utcnow().isoformat(),
                             }
-                            result = supabase.table("reactions").insert(reaction_data).execute()
+                            result = await execute(db.table("reactions").insert(reaction_data))
                             reaction_id = result.data[0]["id"] if result.data else None
                             action_type = "added"
                         
                         # Get updated reactions for the post
-                        reactions_result = supabase.table("reactions").select("*, user:users(*)").eq("post_id", post_id).execute()
+                        reactions_result = await execute(db.table("reactions").select("*, user:users(*)").eq("post_id", post_id))
                         
                         # Broadcast to all connected clients watching this post
                         await manager.broadcast_to_post(post_id, json.dumps({
@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from middleware.auth import get_current_user_uid
-from services.supabase_service import get_supabase
+from typing import Optional
+from middleware.auth import get_current_user
+from services.supabase_service import get_db, execute
+from services.pagination_service import apply_keyset, decode_cursor, next_cursor
+from services import count_service
 from datetime import datetime
 import uuid
 
@@ -16,24 +19,20 @@ class ReportCreate(BaseModel):
 @router.post("")
 async def report_content(
     report: ReportCreate,
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Report inappropriate content"""
-    supabase = get_supabase()
+    db = get_db()
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Validate report type and check if item exists
     if report.report_type == "post":
-        item_result = supabase.table("posts").select("id").eq("id", report.item_id).execute()
+        item_result = await execute(db.table("posts").select("id").eq("id", report.item_id))
     elif report.report_type == "comment":
-        item_result = supabase.table("comments").select("id").eq("id", report.item_id).execute()
+        item_result = await execute(db.table("comments").select("id").eq("id", report.item_id))
     elif report.report_type == "user":
-        item_result = supabase.table("users").select("id").eq("id", report.item_id).execute()
+        item_result = await execute(db.table("users").select("id").eq("id", report.item_id))
     else:
         raise HTTPException(status_code=400, detail="Invalid report type. Must be 'post', 'comment', or 'user'")
     
@@ -41,7 +40,7 @@ async def report_content(
         raise HTTPException(status_code=404, detail=f"{report.report_type.title()} not found")
     
     # Check if user has already reported this item
-    existing = supabase.table("reports").select("*").eq("report_type", report.report_type).eq("item_id", report.item_id).eq("user_id", user_id).execute()
+    existing = await execute(db.table("reports").select("*").eq("report_type", report.report_type).eq("item_id", report.item_id).eq("user_id", user_id))
     if existing.data:
         raise HTTPException(status_code=400, detail="Content already reported by this user")
     
@@ -57,70 +56,67 @@ async def report_content(
         "created_at": datetime.utcnow().isoformat(),
     }
     
-    result = supabase.table("reports").insert(report_data).execute()
+    result = await execute(db.table("reports").insert(report_data))
     
     return {"message": "Report submitted successfully", "report_id": result.data[0]["id"] if result.data else None}
 
 
 @router.get("/user")
 async def get_user_reports(
-    uid: str = Depends(get_current_user_uid),
+    user: dict = Depends(get_current_user),
     limit: int = 20,
     offset: int = 0
 ):
     """Get user's submitted reports"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
-    result = supabase.table("reports").select("*").eq("user_id", user_id).limit(limit).offset(offset).order("created_at", desc=True).execute()
+    result = await execute(db.table("reports").select("*").eq("user_id", user_id).limit(limit).offset(offset).order("created_at", desc=True))
+    total = await count_service.estimated_count(("reports_by_user", user_id), count_service.count_query("reports").eq("user_id", user_id))
     
-    return {"reports": result.data or [], "total": len(result.data or [])}
+    return {"reports": result.data or [], "total": total}
 
 
 @router.get("/moderation")
 async def get_reports_for_moderation(
-    uid: str = Depends(get_current_user_uid),
+    user: dict = Depends(get_current_user),
     status: str = "pending",
     limit: int = 20,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None  # next_cursor from the previous page; takes precedence over offset
 ):
     """Get reports for moderation (requires moderator privileges)"""
-    supabase = get_supabase()
+    db = get_db()
     
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # For now, just return reports (in a real app, you'd check if user is a moderator)
-    result = supabase.table("reports").select("*, reporter:users(*)").eq("status", status).limit(limit).offset(offset).order("created_at", desc=True).execute()
-    
-    return {"reports": result.data or [], "total": len(result.data or [])}
+    after = decode_cursor(cursor, "new")
+    query = db.table("reports").select("*, reporter:users(*)").eq("status", status)
+    query = apply_keyset(query, "created_at", after).limit(limit)
+    if after is None:
+        query = query.offset(offset)
+    result = await execute(query)
+    reports = result.data or []
+    total = await count_service.estimated_count(("reports_by_status", status), count_service.count_query("reports").eq("status", status))
+    
+    return {"reports": reports, "total": total, "next_cursor": next_cursor(reports, "new", "created_at", limit)}
 
 
 @router.patch("/{report_id}/status")
 async def update_report_status(
     report_id: str,
     status: str,  # reviewed, resolved
-    uid: str = Depends(get_current_user_uid)
+    user: dict = Depends(get_current_user)
 ):
     """Update report status (moderation)"""
-    supabase = get_supabase()
-    
-    user_result = supabase.table("users").select("id").eq("firebase_uid", uid).execute()
-    if not user_result.data:
-        raise HTTPException(status_code=404, detail="User not found")
+    db = get_db()
     
-    user_id = user_result.data[0]["id"]
+    user_id = user["id"]
     
     # Update report status
-    result = supabase.table("reports").update({"status": status}).eq("id", report_id).execute()
+    result = await execute(db.table("reports").update({"status": status}).eq("id", report_id))
     
     if not result.data:
         raise HTTPException(status_code=404, detail="Report not found")
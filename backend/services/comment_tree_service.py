@@ -0,0 +1,104 @@
+# Threaded comment reads. comment_tree() (see docs/database_migrations.sql)
+# reads only what one screen shows, level by level from each sort's index
+# (post, parent, key): the first `limit` children of the expanded parent after
+# the cursor, then at most `replies` children per comment shown, down to
+# `depth` levels and within COMMENT_TREE_MAX_NODES, with each comment's reply
+# count. Full rows are then fetched for those ids alone. Subtrees cut off by
+# the caps come back as "more" links carrying a keyset cursor among their siblings.
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional
+from services.supabase_service import get_db, execute
+from services.pagination_service import encode_cursor, decode_cursor
+from services.projection_service import USER_CARD
+from services import counter_buffer_service
+import os
+
+COMMENT_SORTS = ("best", "top", "new")
+
+# Comments returned by one tree request, across all levels
+COMMENT_TREE_MAX_NODES = int(os.getenv("COMMENT_TREE_MAX_NODES", "200"))
+
+_ROW_SELECT = f"*, user:users({', '.join(USER_CARD)})"
+
+
+def _cursor_sort(sort: str) -> str:
+    # Cursors name the sort so a "top" cursor cannot page a "new" thread
+    return f"comments_{sort}"
+
+
+async def read_comment_tree(
+    post_id: str,
+    sort: str = "best",
+    parent_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    depth: int = 4,
+    replies: int = 5,
+) -> Dict[str, Any]:
+    """
+    Up to `limit` children of `parent_id` (top-level comments when None) after
+    `cursor`, each with up to `depth - 1` levels of replies and at most `replies`
+    replies per comment, filled level by level until COMMENT_TREE_MAX_NODES.
+
+    Every comment carries "replies", "reply_count" and "more"; "more" is None when
+    all replies are shown, else {"parent_id", "cursor", "count"} to pass back as
+    parent_id/cursor for the rest.
+    """
+    after = decode_cursor(cursor, _cursor_sort(sort))
+    db = get_db()
+
+    result = await execute(db.rpc("comment_tree", {
+        "p_post_id": post_id,
+        "p_parent_id": parent_id,
+        "p_sort": sort,
+        # Cast by the function to the sort's key type
+        "p_after_key": None if after is None else str(after[0]),
+        "p_after_id": None if after is None else after[1],
+        "p_limit": limit,
+        "p_depth": depth,
+        "p_replies": replies,
+        "p_max_nodes": COMMENT_TREE_MAX_NODES,
+    }))
+    tree = result.data
+    if tree is None:
+        raise HTTPException(status_code=404, detail="Comment not found")
+
+    # The skeleton comes in display order: level by level, each parent's replies ranked
+    nodes = {node["id"]: node for node in tree["comments"]}
+    top = [node["id"] for node in tree["comments"] if node["level"] == 1]
+    shown_replies: Dict[str, List[str]] = {id: [] for id in nodes}
+    for node in tree["comments"]:
+        if node["level"] > 1:
+            shown_replies[node["parent_comment_id"]].append(node["id"])
+
+    def more(parent: Optional[str], shown: List[str], remaining: int, start: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if not remaining:
+            return None
+        if shown:
+            start = encode_cursor(_cursor_sort(sort), nodes[shown[-1]]["key"], shown[-1])
+        return {"parent_id": parent, "cursor": start, "count": remaining}
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    if nodes:
+        result = await execute(db.table("comments").select(_ROW_SELECT).in_("id", list(nodes)))
+        # Shown with the counts this worker has yet to flush; ranked on the stored ones
+        rows = {row["id"]: counter_buffer_service.overlay("comments", row) for row in result.data or []}
+
+    def build(id: str) -> Optional[Dict[str, Any]]:
+        row = rows.get(id)
+        if row is None:
+            # Deleted between the two reads
+            return None
+        shown = shown_replies[id]
+        return {
+            **row,
+            "reply_count": nodes[id]["reply_count"],
+            "replies": [node for node in map(build, shown) if node is not None],
+            "more": more(id, shown, nodes[id]["reply_count"] - len(shown)),
+        }
+
+    return {
+        "comments": [node for node in map(build, top) if node is not None],
+        "more": more(parent_id, top, tree["siblings"] - len(top), cursor),
+        "sort": sort,
+    }
@@ -0,0 +1,72 @@
+from typing import Any, Dict, Hashable
+from services.cache_service import TTLCache
+from services.supabase_service import get_db, execute
+import os
+
+# Totals for paginated lists. Common totals come from counters maintained by
+# triggers (see docs/database_migrations.sql); anything else uses PostgREST's
+# planner-based estimate. Both are cached briefly so a page load never scans.
+COUNT_CACHE_TTL_SECONDS = int(os.getenv("COUNT_CACHE_TTL_SECONDS", "15"))
+
+_counts = TTLCache(maxsize=10000, ttl=COUNT_CACHE_TTL_SECONDS)
+
+
+def count_query(table: str) -> Any:
+    """Start a query whose response carries a planner-estimated row count"""
+    return get_db().table(table).select("id", count="estimated")
+
+
+async def estimated_count(key: Hashable, query: Any) -> int:
+    """
+    Estimated total for an ad-hoc filter built on `count_query`, cached under `key`
+    """
+    cached = _counts.get(key)
+    if cached is not None:
+        return cached
+
+    result = await execute(query.limit(1))
+    count = result.count or 0
+    _counts.set(key, count)
+    return count
+
+
+async def community_post_count(community_id: str) -> int:
+    key = ("community_posts", community_id)
+    cached = _counts.get(key)
+    if cached is not None:
+        return cached
+
+    result = await execute(get_db().table("communities").select("post_count").eq("id", community_id))
+    count = result.data[0]["post_count"] if result.data else 0
+    _counts.set(key, count)
+    return count
+
+
+async def post_comment_count(post_id: str) -> int:
+    key = ("post_comments", post_id)
+    cached = _counts.get(key)
+    if cached is not None:
+        return cached
+
+    result = await execute(get_db().table("posts").select("comment_count").eq("id", post_id))
+    count = result.data[0]["comment_count"] if result.data else 0
+    _counts.set(key, count)
+    return count
+
+
+async def notification_counts(user_id: str) -> Dict[str, int]:
+    """{"total": ..., "unread": ...} for a recipient"""
+    key = ("notifications", user_id)
+    cached = _counts.get(key)
+    if cached is not None:
+        return cached
+
+    result = await execute(get_db().table("notification_counters").select("total_count, unread_count").eq("user_id", user_id))
+    row = result.data[0] if result.data else {}
+    counts = {"total": row.get("total_count", 0), "unread": row.get("unread_count", 0)}
+    _counts.set(key, counts)
+    return counts
+
+
+def invalidate(key: Hashable) -> None:
+    _counts.pop(key)
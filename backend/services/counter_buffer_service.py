@@ -0,0 +1,395 @@
+# Write-behind counters. Hot counters (post and comment votes, comment and star
+# counts) are accumulated per row in this worker and applied in one batch by
+# apply_counter_deltas() every COUNTER_FLUSH_INTERVAL_MS, or sooner once
+# COUNTER_FLUSH_THRESHOLD rows are pending, instead of one UPDATE per event.
+#
+# The rows being counted (votes, comments, stars) are still written at once, so
+# a counter can always be recomputed from them. Before such a write, its
+# counter row is noted in a SQLite journal shared by the workers on this host,
+# and the note is cleared once the delta is flushed. Notes left behind by a
+# worker that stopped heartbeating (or by a flush that failed) are recomputed
+# with reconcile_counters() once no live worker holds the same row. Reads add
+# this worker's pending deltas (overlay), so a voter sees their vote at once.
+#
+# The journal only sees workers on one host: with the buffer on, every worker
+# writing to the database must run on the same host (or set COUNTER_BUFFER=off).
+from fastapi.concurrency import run_in_threadpool
+from typing import Any, Dict, List, Optional, Tuple
+from services.supabase_service import get_db, execute
+from services.ranking_index_service import ranking_index
+from services.feed_cache_service import invalidate_feeds
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+COUNTER_BUFFER = os.getenv("COUNTER_BUFFER", "on")  # on or off
+COUNTER_FLUSH_INTERVAL_MS = int(os.getenv("COUNTER_FLUSH_INTERVAL_MS", "250"))
+COUNTER_FLUSH_THRESHOLD = int(os.getenv("COUNTER_FLUSH_THRESHOLD", "500"))
+COUNTER_JOURNAL_PATH = os.getenv("COUNTER_JOURNAL_PATH", os.path.join(tempfile.gettempdir(), "x-repo-counter-journal.sqlite3"))
+
+# A worker whose heartbeat is older than this is presumed dead
+OWNER_TIMEOUT_SECONDS = 30
+RECONCILE_INTERVAL_SECONDS = 30
+
+# Rows claimed by a reconciler that has not finished within this long may be claimed again
+CLAIM_SECONDS = 120
+
+# Journal owner of rows whose flush failed; it never heartbeats, so they get reconciled
+ABANDONED = ""
+
+# table -> counters that may be buffered
+BUFFERED_COUNTERS = {
+    "posts": ("upvotes", "downvotes", "comment_count"),
+    "comments": ("upvotes", "downvotes"),
+    "projects": ("star_count",),
+}
+
+Key = Tuple[str, str]  # (table, row id)
+
+
+def _valid_key(target: str, id: str) -> bool:
+    """Whether reconcile_counters() can take the row; one bad id would fail the whole call"""
+    if target not in BUFFERED_COUNTERS:
+        return False
+    try:
+        uuid.UUID(id)
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return True
+
+
+class CounterJournal:
+    """Rows with unflushed deltas, per worker, in a local SQLite file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS counter_journal (owner TEXT NOT NULL, target TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (owner, target, id))")
+        conn.execute("CREATE TABLE IF NOT EXISTS counter_owners (owner TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        # Rows being recomputed; `dirty` is set when a worker holds one meanwhile
+        conn.execute("CREATE TABLE IF NOT EXISTS counter_claims (target TEXT NOT NULL, id TEXT NOT NULL, claimed_until REAL NOT NULL, dirty INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (target, id))")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _mark(self, owner: str, keys: List[Key]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO counter_journal (owner, target, id) VALUES (?, ?, ?)",
+                [(owner, target, id) for target, id in keys],
+            )
+            # A recompute running now may or may not see the write that follows
+            conn.executemany("UPDATE counter_claims SET dirty = 1 WHERE target = ? AND id = ?", keys)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _clear(self, owner: str, keys: List[Key]) -> None:
+        self._conn().executemany(
+            "DELETE FROM counter_journal WHERE owner = ? AND target = ? AND id = ?",
+            [(owner, target, id) for target, id in keys],
+        )
+
+    def _abandon(self, keys: List[Key]) -> None:
+        self._mark(ABANDONED, keys)
+
+    def _heartbeat(self, owner: str) -> None:
+        self._conn().execute(
+            "INSERT INTO counter_owners (owner, seen_at) VALUES (?, ?) ON CONFLICT(owner) DO UPDATE SET seen_at = excluded.seen_at",
+            (owner, time.time()),
+        )
+
+    def _retire(self, owner: str) -> None:
+        self._conn().execute("DELETE FROM counter_owners WHERE owner = ?", (owner,))
+
+    def _claim(self) -> List[Tuple[str, str, str]]:
+        """
+        Claim the rows no live worker holds and no other reconciler is recomputing;
+        returns their (owner, target, id) notes. The journal is only locked while
+        claiming, not during the recompute itself.
+        """
+        conn = self._conn()
+        now = time.time()
+        cutoff = now - OWNER_TIMEOUT_SECONDS
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            orphans = conn.execute(
+                """
+                SELECT j.owner, j.target, j.id FROM counter_journal j
+                LEFT JOIN counter_owners o ON o.owner = j.owner
+                WHERE (o.seen_at IS NULL OR o.seen_at < ?)
+                  AND NOT EXISTS (
+                    SELECT 1 FROM counter_journal k JOIN counter_owners lo ON lo.owner = k.owner
+                    WHERE k.target = j.target AND k.id = j.id AND lo.seen_at >= ?
+                  )
+                  AND NOT EXISTS (
+                    SELECT 1 FROM counter_claims c
+                    WHERE c.target = j.target AND c.id = j.id AND c.claimed_until >= ?
+                  )
+                """,
+                (cutoff, cutoff, now),
+            ).fetchall()
+            conn.executemany(
+                "INSERT OR REPLACE INTO counter_claims (target, id, claimed_until, dirty) VALUES (?, ?, ?, 0)",
+                {(target, id, now + CLAIM_SECONDS) for _, target, id in orphans},
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return orphans
+
+    def _finish(self, orphans: List[Tuple[str, str, str]], reconciled: bool) -> List[Tuple[str, str, str]]:
+        """
+        Release a claim. When the recompute succeeded, clear the notes of rows no
+        worker held meanwhile; a row held during the recompute may have had a
+        delta counted twice, so its notes stay for the next pass to recompute
+        once that worker is done with it. Returns the notes cleared.
+        """
+        conn = self._conn()
+        keys = {(target, id) for _, target, id in orphans}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cleared = []
+            if reconciled:
+                dirty = set(conn.execute("SELECT target, id FROM counter_claims WHERE dirty = 1").fetchall())
+                cleared = [orphan for orphan in orphans if (orphan[1], orphan[2]) not in dirty]
+                conn.executemany("DELETE FROM counter_journal WHERE owner = ? AND target = ? AND id = ?", cleared)
+            conn.executemany("DELETE FROM counter_claims WHERE target = ? AND id = ?", keys)
+            conn.execute(
+                "DELETE FROM counter_owners WHERE seen_at < ? AND owner NOT IN (SELECT owner FROM counter_journal)",
+                (time.time() - OWNER_TIMEOUT_SECONDS,),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cleared
+
+    async def mark(self, owner: str, keys: List[Key]) -> None:
+        await run_in_threadpool(self._mark, owner, keys)
+
+    async def clear(self, owner: str, keys: List[Key]) -> None:
+        await run_in_threadpool(self._clear, owner, keys)
+
+    async def abandon(self, keys: List[Key]) -> None:
+        """Leave rows to reconciliation once no live worker holds them"""
+        await run_in_threadpool(self._abandon, keys)
+
+    async def heartbeat(self, owner: str) -> None:
+        await run_in_threadpool(self._heartbeat, owner)
+
+    async def retire(self, owner: str) -> None:
+        await run_in_threadpool(self._retire, owner)
+
+    async def reconcile(self) -> int:
+        """
+        Recompute the counters of orphaned rows from the rows they count: claim
+        them, call reconcile_counters() with the journal unlocked, then clear them
+        """
+        orphans = await run_in_threadpool(self._claim)
+        if not orphans:
+            return 0
+        try:
+            keys = sorted({(target, id) for _, target, id in orphans})
+            bad = [key for key in keys if not _valid_key(*key)]
+            if bad:
+                # Cleared with the rest rather than retried forever
+                print(f"Warning: Dropping {len(bad)} invalid counter journal rows: {bad[:10]}")
+            targets = [{"target": target, "id": id} for target, id in keys if _valid_key(target, id)]
+            if targets:
+                await execute(get_db().rpc("reconcile_counters", {"p_targets": targets}))
+        except BaseException:
+            await run_in_threadpool(self._finish, orphans, False)
+            raise
+        cleared = await run_in_threadpool(self._finish, orphans, True)
+        return len({(target, id) for _, target, id in cleared})
+
+
+class CounterBuffer:
+    def __init__(self, journal: CounterJournal, threshold: int = COUNTER_FLUSH_THRESHOLD):
+        self.journal = journal
+        self.threshold = threshold
+        self.owner = uuid.uuid4().hex
+        self._pending: Dict[Key, Dict[str, int]] = {}
+        self._flushing: Dict[Key, Dict[str, int]] = {}
+        self._full: Optional[asyncio.Event] = None
+
+    async def hold(self, table: str, id: str) -> bool:
+        """
+        Journal a row before writing what it counts, so a crash in between is
+        reconciled. Returns False, journaling nothing, for an id that cannot be
+        a row. Whether the row exists is left to the write, which should
+        `release` the row when it finds none.
+        """
+        key = (table, id)
+        if key in self._pending:
+            return True
+        if not _valid_key(table, id):
+            return False
+        if key not in self._flushing:
+            await self.journal.mark(self.owner, [key])
+        self._pending.setdefault(key, {})
+        return True
+
+    async def release(self, table: str, id: str) -> None:
+        """Drop a hold whose write found no row, unless deltas were buffered for it since"""
+        key = (table, id)
+        if key in self._pending and not self._pending[key] and key not in self._flushing:
+            del self._pending[key]
+            await self.journal.clear(self.owner, [key])
+
+    def add(self, table: str, id: str, deltas: Dict[str, int]) -> None:
+        """Buffer deltas for a row already held"""
+        pending = self._pending.setdefault((table, id), {})
+        for column, delta in deltas.items():
+            pending[column] = pending.get(column, 0) + delta
+        if len(self._pending) >= self.threshold and self._full is not None:
+            self._full.set()
+
+    def overlay(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Add this worker's unapplied deltas to a row read from the database.
+        A row read while its flush is in flight may briefly show that delta twice.
+        """
+        key = (table, row.get("id"))
+        for buffered in (self._flushing.get(key), self._pending.get(key)):
+            for column, delta in (buffered or {}).items():
+                if column in row:
+                    row[column] = max((row[column] or 0) + delta, 0)
+        return row
+
+    async def flush(self) -> None:
+        if self._flushing or not self._pending:
+            return
+        self._flushing, self._pending = self._pending, {}
+        batch = [
+            {"target": table, "id": id, **deltas}
+            for (table, id), deltas in self._flushing.items()
+            if any(deltas.values())
+        ]
+        try:
+            result = await execute(get_db().rpc("apply_counter_deltas", {"p_deltas": batch})) if batch else None
+        except Exception as e:
+            # The batch may or may not have been applied, so leave these rows to reconciliation
+            print(f"Warning: Failed to flush counters, reconciling {len(batch)} rows: {e}")
+            await self._abandon_flushing()
+            return
+
+        # Rows buffered again during the flush stay journaled
+        await self.journal.clear(self.owner, [key for key in self._flushing if key not in self._pending])
+        self._flushing = {}
+        if result is not None and result.data:
+            await _on_posts_counted(result.data.get("posts") or [])
+
+    async def _abandon_flushing(self) -> None:
+        keys = list(self._flushing)
+        await self.journal.abandon(keys)
+        await self.journal.clear(self.owner, [key for key in keys if key not in self._pending])
+        self._flushing = {}
+
+    async def run(self) -> None:
+        """Flush on an interval or when full, heartbeat, and reconcile orphaned rows"""
+        self._full = asyncio.Event()
+        await self.journal.heartbeat(self.owner)
+        reconciled_at = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), COUNTER_FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+                await self.journal.heartbeat(self.owner)
+                if time.monotonic() - reconciled_at >= RECONCILE_INTERVAL_SECONDS:
+                    reconciled_at = time.monotonic()
+                    reconciled = await self.journal.reconcile()
+                    if reconciled:
+                        print(f"Reconciled {reconciled} buffered counters left by stopped workers")
+            except Exception as e:
+                print(f"Warning: Counter buffer maintenance failed: {e}")
+
+    async def close(self) -> None:
+        if self._flushing:
+            # The flush task was cancelled mid-call, so whether it landed is unknown
+            await self._abandon_flushing()
+        await self.flush()
+        await self.journal.retire(self.owner)
+
+
+async def _on_posts_counted(rows: List[Dict[str, Any]]) -> None:
+    """Keep the ranking index and cached feeds in step with flushed post counters"""
+    community_ids = set()
+    for row in rows:
+        ranking_index.on_post_scored(row)
+        community_ids.add(row.get("community_id"))
+    for community_id in community_ids:
+        await invalidate_feeds(community_id, include_all=False)
+
+
+counter_buffer = CounterBuffer(CounterJournal(COUNTER_JOURNAL_PATH)) if COUNTER_BUFFER != "off" else None
+
+
+def is_buffered() -> bool:
+    return counter_buffer is not None
+
+
+async def hold(table: str, id: str) -> bool:
+    """
+    Call before writing a row that `table`'s counter for `id` counts; False when
+    the buffer is on and `id` cannot be a row, so nothing should be written.
+    If the write then finds no such row, call `release`.
+    """
+    if counter_buffer is None:
+        return True
+    return await counter_buffer.hold(table, id)
+
+
+async def release(table: str, id: str) -> None:
+    if counter_buffer is not None:
+        await counter_buffer.release(table, id)
+
+
+async def adjust(table: str, id: str, column: str, delta: int) -> None:
+    """Move a counter by +1 or -1, buffered when the buffer is on"""
+    if counter_buffer is not None:
+        counter_buffer.add(table, id, {column: delta})
+        return
+    rpc = "increment" if delta > 0 else "decrement"
+    await execute(get_db().rpc(rpc, {"table_name": table, "column_name": column, "id": id}))
+
+
+def overlay(table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    if counter_buffer is None:
+        return row
+    return counter_buffer.overlay(table, row)
+
+
+async def flush_counters_periodically():
+    if counter_buffer is not None:
+        await counter_buffer.run()
+
+
+async def close_counter_buffer() -> None:
+    """Flush what is buffered; call at shutdown after the flush task is cancelled"""
+    if counter_buffer is not None:
+        try:
+            await counter_buffer.close()
+        except Exception as e:
+            print(f"Warning: Failed to flush counters at shutdown: {e}")
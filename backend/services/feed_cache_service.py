@@ -0,0 +1,192 @@
+# Response cache for public feeds. Entries are fresh for FEED_CACHE_TTL_SECONDS,
+# then served stale for up to FEED_CACHE_STALE_SECONDS while one request refreshes
+# them in the background. Each entry is keyed on the version of every scope it
+# covers (a community id, or ALL for cross-community feeds); writes bump the
+# versions of the scopes they touch, so invalidation is exact and O(1).
+from fastapi.concurrency import run_in_threadpool
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from services.cache_service import TTLCache
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+FEED_CACHE_BACKEND = os.getenv("FEED_CACHE_BACKEND", "memory")  # memory, sqlite or off
+FEED_CACHE_PATH = os.getenv("FEED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "x-repo-feed-cache.sqlite3"))
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "5000"))
+FEED_CACHE_TTL_SECONDS = float(os.getenv("FEED_CACHE_TTL_SECONDS", "5"))
+FEED_CACHE_STALE_SECONDS = float(os.getenv("FEED_CACHE_STALE_SECONDS", "30"))
+
+ALL = "*"
+
+
+class MemoryFeedCacheBackend:
+    """Entries and versions held in this worker only"""
+
+    def __init__(self, maxsize: int):
+        self._entries = TTLCache(maxsize=maxsize)
+        self._versions: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, value: Any, stored_at: float, ttl: float) -> None:
+        self._entries.set(key, (value, stored_at), ttl=ttl)
+
+    async def versions(self, scopes: List[str]) -> List[int]:
+        return [self._versions.get(scope, 0) for scope in scopes]
+
+    async def bump(self, scopes: List[str]) -> None:
+        for scope in scopes:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+
+class SQLiteFeedCacheBackend:
+    """
+    Entries and versions in a local SQLite file, shared by every worker on the host
+    """
+
+    PURGE_EVERY = 200
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS feed_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS feed_versions (scope TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Optional[Tuple[Any, float]]:
+        row = self._conn().execute(
+            "SELECT value, stored_at FROM feed_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def _set(self, key: str, value: Any, stored_at: float, ttl: float) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO feed_cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, default=str), stored_at, stored_at + ttl),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM feed_cache WHERE expires_at <= ?", (time.time(),))
+
+    def _versions(self, scopes: List[str]) -> List[int]:
+        placeholders = ", ".join("?" for _ in scopes)
+        rows = self._conn().execute(
+            f"SELECT scope, version FROM feed_versions WHERE scope IN ({placeholders})", scopes
+        ).fetchall()
+        found = dict(rows)
+        return [found.get(scope, 0) for scope in scopes]
+
+    def _bump(self, scopes: List[str]) -> None:
+        self._conn().executemany(
+            "INSERT INTO feed_versions (scope, version) VALUES (?, 1) ON CONFLICT(scope) DO UPDATE SET version = version + 1",
+            [(scope,) for scope in scopes],
+        )
+
+    async def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        return await run_in_threadpool(self._get, key)
+
+    async def set(self, key: str, value: Any, stored_at: float, ttl: float) -> None:
+        await run_in_threadpool(self._set, key, value, stored_at, ttl)
+
+    async def versions(self, scopes: List[str]) -> List[int]:
+        return await run_in_threadpool(self._versions, scopes)
+
+    async def bump(self, scopes: List[str]) -> None:
+        await run_in_threadpool(self._bump, scopes)
+
+
+class FeedCache:
+    def __init__(self, backend: Any, ttl: float = FEED_CACHE_TTL_SECONDS, stale: float = FEED_CACHE_STALE_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale = stale
+        # Single flight per worker: one computation per key at a time
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def _key(self, scopes: List[str], params: Hashable) -> str:
+        versions = await self.backend.versions(scopes)
+        return json.dumps([list(zip(scopes, versions)), params], default=str, separators=(",", ":"))
+
+    def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        future = self._inflight.get(key)
+        if future is None:
+            async def run():
+                value = await compute()
+                await self.backend.set(key, value, time.time(), self.ttl + self.stale)
+                return value
+
+            future = asyncio.ensure_future(run())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return future
+
+    def _refresh_in_background(self, key: str, compute: Callable[[], Awaitable[Any]]) -> None:
+        def report(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception() is not None:
+                print(f"Warning: Failed to refresh cached feed: {future.exception()}")
+
+        if key not in self._inflight:
+            self._compute(key, compute).add_done_callback(report)
+
+    async def get_or_compute(self, scopes: List[str], params: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Cached response for `params` over `scopes`, computing it with `compute` on a miss
+        """
+        key = await self._key(scopes, params)
+        entry = await self.backend.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            if time.time() - stored_at >= self.ttl:
+                self._refresh_in_background(key, compute)
+            return value
+        return await asyncio.shield(self._compute(key, compute))
+
+    async def invalidate(self, scopes: List[str]) -> None:
+        await self.backend.bump(scopes)
+
+
+def _create_backend() -> Optional[Any]:
+    if FEED_CACHE_BACKEND == "off":
+        return None
+    if FEED_CACHE_BACKEND == "sqlite":
+        return SQLiteFeedCacheBackend(FEED_CACHE_PATH)
+    return MemoryFeedCacheBackend(FEED_CACHE_SIZE)
+
+
+_backend = _create_backend()
+feed_cache = FeedCache(_backend) if _backend is not None else None
+
+
+async def cached_feed(scopes: List[str], params: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+    """Serve a feed response through the shared cache (or directly when it is off)"""
+    if feed_cache is None:
+        return await compute()
+    return await feed_cache.get_or_compute(scopes, params, compute)
+
+
+async def invalidate_feeds(community_id: Optional[str], include_all: bool = True) -> None:
+    """
+    Drop cached feeds covering a community; `include_all` also drops cross-community feeds
+    """
+    if feed_cache is None:
+        return
+    scopes = [community_id] if community_id else []
+    if include_all:
+        scopes.append(ALL)
+    if scopes:
+        await feed_cache.invalidate(scopes)
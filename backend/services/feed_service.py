@@ -0,0 +1,139 @@
+# Post feeds, shared by every route that lists posts (all posts, a community,
+# the home and explore feeds) so they rank, page and count alike. A page comes
+# from the cheapest source that covers it: computed sorts ("best", "rising") are
+# scored per request, time-ranged "top" comes from its leaderboard, unfiltered
+# ranked pages from the in-process ranking index, and everything else from the
+# database by keyset (the direct Postgres path for named projections). Searches
+# always read the database through PostgREST.
+from typing import Any, Dict, List, Optional, Tuple
+from services.supabase_service import get_db, execute
+from services import postgres_service, count_service
+from services.projection_service import Projection
+from services.pagination_service import apply_keyset, decode_cursor, keyset_cursor, row_keys
+from services.ranking_service import COMPUTED_SORTS, sort_column, time_range_start
+from services.ranking_index_service import read_computed_ranking, read_ranked_posts
+from services.leaderboard_service import LEADERBOARD_PERIODS, read_leaderboard
+
+
+def _search(query: Any, search: Optional[str]) -> Any:
+    if search:
+        query = query.text_search("title,content", search, {"type": "websearch"})
+    return query
+
+
+def _cursor_sort(sort: str) -> str:
+    # Cursors are named after what they hold: sorts that fall back to newest first carry timestamps
+    return "new" if sort_column(sort) == "created_at" else sort
+
+
+def _computed(sort: str, search: Optional[str]) -> bool:
+    # Searches are not scored; they list matches newest first
+    return sort in COMPUTED_SORTS and not search
+
+
+async def _fetch_posts(
+    community_ids: Optional[List[str]],
+    from_date: Optional[str],
+    projection: Projection,
+    order: str = "created_at",
+    limit: Optional[int] = None,
+    offset: int = 0,
+    cursor: Optional[Tuple[Any, str]] = None,
+    search: Optional[str] = None
+) -> Tuple[List[dict], List[Tuple[Any, str]]]:
+    """
+    Fetch the top posts (with user and community) by a sort column, by offset or
+    after a keyset cursor, with the (key, id) each ranked post was read at.
+    Ranked pages come from the in-process ranking index (merging per-community
+    rankings for several communities) when it covers them; otherwise named
+    projections are served from the direct Postgres read path when configured,
+    everything else (and every search) from PostgREST.
+    """
+    if limit is not None and from_date is None and not search:
+        page = await read_ranked_posts(community_ids, order, projection, offset, limit, cursor)
+        if page is not None:
+            return page
+
+    if not projection.adhoc and not search:
+        statement = postgres_service.POST_ORDERS[order][0]
+        if cursor is not None:
+            params = (community_ids, from_date, cursor[0], cursor[1], limit)
+            statement += "_after"
+        else:
+            params = (community_ids, from_date, limit, offset)
+        posts = await postgres_service.fetch_all(f"{statement}_{projection.key}", *params)
+        if posts is not None:
+            return posts, row_keys(posts, order)
+
+    query = get_db().table("posts").select(projection.select())
+    if community_ids is not None:
+        query = query.in_("community_id", community_ids)
+    if from_date:
+        query = query.gte("created_at", from_date)
+    query = apply_keyset(_search(query, search), order, cursor)
+    if limit is not None:
+        query = query.limit(limit)
+        if cursor is None:
+            query = query.offset(offset)
+
+    result = await execute(query)
+    posts = result.data or []
+    return posts, row_keys(posts, order)
+
+
+async def ranked_page(
+    community_ids: Optional[List[str]],
+    time_range: Optional[str],
+    projection: Projection,
+    sort: str,
+    limit: int,
+    offset: int,
+    cursor: Optional[str],
+    search: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    A page of posts in `community_ids` (None for all communities) for any sort,
+    optionally matching a full-text `search`, by offset or after `cursor` (a
+    next_cursor from the previous page), plus the next page's cursor. Computed
+    sorts page by offset only, so their cursor is None.
+    """
+    from_date = time_range_start(time_range)
+    if _computed(sort, search):
+        posts = await read_computed_ranking(community_ids, from_date, sort, projection, offset, limit)
+        return posts, None
+
+    # Every other sort is a persisted, indexed column, so the page is exactly the top-k rows
+    after = decode_cursor(cursor, _cursor_sort(sort))
+    order = sort_column(sort)
+    if sort == "top" and time_range in LEADERBOARD_PERIODS and not search:
+        # Top of the last day/week/month/year comes from its maintained leaderboard
+        posts, keys = await read_leaderboard(community_ids, time_range, projection, offset, limit, after)
+    else:
+        posts, keys = await _fetch_posts(community_ids, from_date, projection, order, limit, offset, after, search)
+    # From the keys the page was ranked by, which still count posts deleted before hydration
+    return posts, keyset_cursor(keys, _cursor_sort(sort), limit)
+
+
+async def count_posts(
+    community_ids: Optional[List[str]],
+    time_range: Optional[str],
+    scope: Any,
+    search: Optional[str] = None
+) -> int:
+    """
+    Total posts for the pages ranked_page serves, without scanning them: exact
+    from a community's post counter when unfiltered, estimated otherwise.
+    `scope` names the community set in the cache key (a community id, a user's home feed, ...).
+    """
+    # Leaderboard ("top" by day/week/month/year) pages list the same rolling range
+    from_date = time_range_start(time_range)
+    if community_ids is not None and len(community_ids) == 1 and not from_date and not search:
+        return await count_service.community_post_count(community_ids[0])
+
+    query = count_service.count_query("posts")
+    if community_ids is not None:
+        query = query.in_("community_id", community_ids)
+    if from_date:
+        query = query.gte("created_at", from_date)
+    # Keyed on the named range rather than from_date, which moves on every request
+    return await count_service.estimated_count(("posts", scope, time_range if from_date else None, search), _search(query, search))
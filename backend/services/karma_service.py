@@ -0,0 +1,39 @@
+# User karma (post_karma, comment_karma on users) moves with post and comment
+# vote counts wherever those are written (see docs/database_migrations.sql).
+# This job recomputes it from posts and comments now and then to correct any
+# drift. Workers share one pass, run a batch of users at a time in id order by
+# reconcile_user_karma(); a worker that finds a batch running leaves the pass
+# to that worker.
+from services.supabase_service import get_db, execute
+import asyncio
+import os
+
+KARMA_RECONCILE_INTERVAL_SECONDS = int(os.getenv("KARMA_RECONCILE_INTERVAL_SECONDS", "21600"))
+
+# Users recomputed per call
+KARMA_RECONCILE_BATCH_SIZE = 1000
+
+
+async def reconcile_karma() -> int:
+    """Run the rest of the current pass (or start one if due); returns how many users were corrected"""
+    corrected = 0
+    while True:
+        result = await execute(get_db().rpc("reconcile_user_karma", {
+            "p_limit": KARMA_RECONCILE_BATCH_SIZE,
+            "p_interval_seconds": KARMA_RECONCILE_INTERVAL_SECONDS,
+        }))
+        report = result.data or {}
+        corrected += report.get("corrected") or 0
+        if report.get("status") != "more":
+            return corrected
+
+
+async def reconcile_karma_periodically():
+    while True:
+        await asyncio.sleep(KARMA_RECONCILE_INTERVAL_SECONDS)
+        try:
+            corrected = await reconcile_karma()
+            if corrected:
+                print(f"Corrected karma drift for {corrected} users")
+        except Exception as e:
+            print(f"Warning: Failed to reconcile user karma: {e}")
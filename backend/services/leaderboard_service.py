@@ -0,0 +1,58 @@
+# "Top" leaderboards by net score for the last day, week, month and year, per
+# community and globally. Rows live in post_leaderboards and are maintained by
+# triggers on post creation and vote count changes (see
+# docs/database_migrations.sql), so a top-of-week page is an index scan by net
+# score that skips the few rows past the window not yet pruned. All-time top
+# is the (community_id, net_score) index on posts itself.
+from typing import Any, Dict, List, Optional, Tuple
+from services.supabase_service import get_db, execute
+from services.projection_service import Projection
+from services.pagination_service import apply_keyset
+from services.ranking_index_service import fetch_posts_by_ids
+from services.ranking_service import time_range_start
+import asyncio
+import os
+
+LEADERBOARD_PERIODS = ("day", "week", "month", "year")
+LEADERBOARD_PRUNE_INTERVAL_SECONDS = int(os.getenv("LEADERBOARD_PRUNE_INTERVAL_SECONDS", "3600"))
+
+
+def _in_window(query: Any, community_ids: Optional[List[str]], period: str) -> Any:
+    query = query.eq("period", period).gte("created_at", time_range_start(period))
+    if community_ids is not None:
+        query = query.in_("community_id", community_ids)
+    return query
+
+
+async def read_leaderboard(
+    community_ids: Optional[List[str]],
+    period: str,
+    projection: Projection,
+    offset: int,
+    limit: int,
+    cursor: Optional[Tuple[Any, str]] = None
+) -> Tuple[List[Dict[str, Any]], List[Tuple[Any, str]]]:
+    """
+    A page of the period's top posts by net score, by offset or after a
+    cursor, with the leaderboard's (net_score, post id) for each ranked post
+    to build the next cursor from (see keyset_cursor)
+    """
+    query = _in_window(get_db().table("post_leaderboards").select("post_id, net_score"), community_ids, period)
+    query = apply_keyset(query, "net_score", cursor, id_column="post_id").limit(limit)
+    if cursor is None:
+        query = query.offset(offset)
+
+    result = await execute(query)
+    keys = [(row["net_score"], row["post_id"]) for row in result.data or []]
+    posts = await fetch_posts_by_ids([id for _, id in keys], projection)
+    return posts, keys
+
+
+async def prune_leaderboards_periodically():
+    """Drop rows that have fallen out of their period's window"""
+    while True:
+        await asyncio.sleep(LEADERBOARD_PRUNE_INTERVAL_SECONDS)
+        try:
+            await execute(get_db().rpc("prune_post_leaderboards", {}))
+        except Exception as e:
+            print(f"Warning: Failed to prune leaderboards: {e}")
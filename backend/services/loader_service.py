@@ -0,0 +1,81 @@
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+from services.supabase_service import get_db, execute
+import asyncio
+
+
+class Loader:
+    """
+    DataLoader-style point lookups on one table column.
+
+    Every `load` issued in the same event-loop tick is coalesced into a single
+    `in_()` query, and results (including misses) are memoized for the lifetime
+    of the loader, which is one request.
+    """
+
+    def __init__(self, table: str, column: str = "id", select: str = "*"):
+        self.table = table
+        self.column = column
+        self.select = select
+        self._results: Dict[Hashable, asyncio.Future] = {}
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def load(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        future = self._results.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._results[key] = future
+            if not self._pending:
+                # First key of this tick: dispatch once the current callbacks have run
+                loop.call_soon(self._dispatch)
+            self._pending[key] = future
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Optional[Dict[str, Any]]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Hashable, row: Optional[Dict[str, Any]]) -> None:
+        """Seed a known row so later loads skip the database"""
+        if key not in self._results:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(row)
+            self._results[key] = future
+
+    def _dispatch(self) -> None:
+        batch, self._pending = self._pending, {}
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: Dict[Hashable, asyncio.Future]) -> None:
+        try:
+            result = await execute(get_db().table(self.table).select(self.select).in_(self.column, list(batch)))
+        except Exception as e:
+            for key, future in batch.items():
+                # Failed keys are forgotten so a retry in the same request hits the database again
+                self._results.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        rows = {row[self.column]: row for row in result.data or []}
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(rows.get(key))
+
+
+class Loaders:
+    """Request-scoped registry of loaders, one per (table, column, select)"""
+
+    def __init__(self):
+        self._loaders: Dict[Tuple[str, str, str], Loader] = {}
+
+    def get(self, table: str, column: str = "id", select: str = "*") -> Loader:
+        """`select` must include `column` so results can be matched back to keys"""
+        key = (table, column, select)
+        if key not in self._loaders:
+            self._loaders[key] = Loader(table, column, select)
+        return self._loaders[key]
+
+
+async def get_loaders() -> Loaders:
+    """Dependency providing a fresh set of loaders for each request"""
+    return Loaders()
@@ -0,0 +1,26 @@
+from typing import List
+from services.cache_service import TTLCache
+from services.supabase_service import get_db, execute
+import os
+
+# user id -> ids of the communities they have joined, for the home feed
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "10000"))
+MEMBERSHIP_CACHE_TTL_SECONDS = int(os.getenv("MEMBERSHIP_CACHE_TTL_SECONDS", "300"))
+
+_memberships = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL_SECONDS)
+
+
+async def get_community_ids(user_id: str) -> List[str]:
+    community_ids = _memberships.get(user_id)
+    if community_ids is not None:
+        return community_ids
+
+    result = await execute(get_db().table("community_members").select("community_id").eq("user_id", user_id))
+    community_ids = [m["community_id"] for m in result.data or []]
+    _memberships.set(user_id, community_ids)
+    return community_ids
+
+
+def invalidate_memberships(user_id: str) -> None:
+    """Drop a user's cached memberships; call whenever they join or leave a community"""
+    _memberships.pop(user_id)
@@ -0,0 +1,113 @@
+# @mentions. Usernames in a text are de-duplicated and capped at
+# MAX_MENTIONS_PER_COMMENT, then resolved to user ids from an in-process
+# username -> id cache, with every miss looked up in one `in_` query. Unknown
+# names are cached too, briefly, so repeated misspellings stay cheap.
+# Registering (or renaming) a user invalidates the names involved on this
+# worker; other workers catch up when their entries expire.
+from typing import Dict, Iterable, List, Optional
+from services.cache_service import TTLCache
+from services.supabase_service import get_db, execute
+from services.projection_service import USER_CARD
+import os
+import re
+
+MENTION_PATTERN = re.compile(r'@([a-zA-Z0-9_]+)')
+USERNAME_PATTERN = re.compile(r'[a-zA-Z0-9_]+')
+
+MAX_MENTIONS_PER_COMMENT = int(os.getenv("MAX_MENTIONS_PER_COMMENT", "10"))
+USERNAME_CACHE_SIZE = int(os.getenv("USERNAME_CACHE_SIZE", "50000"))
+USERNAME_CACHE_TTL_SECONDS = int(os.getenv("USERNAME_CACHE_TTL_SECONDS", "600"))
+
+# Unknown usernames are remembered for less time, since someone may register them
+UNKNOWN_USERNAME_TTL_SECONDS = 30
+
+AUTOCOMPLETE_CACHE_TTL_SECONDS = 30
+
+# username -> user id, or "" for a name that does not exist
+_user_ids = TTLCache(maxsize=USERNAME_CACHE_SIZE, ttl=USERNAME_CACHE_TTL_SECONDS)
+
+# (prefix, limit) -> user cards
+_suggestions = TTLCache(maxsize=5000, ttl=AUTOCOMPLETE_CACHE_TTL_SECONDS)
+
+
+def extract_mentions(text: str, limit: int = MAX_MENTIONS_PER_COMMENT) -> List[str]:
+    """Distinct @usernames in order of first appearance, at most `limit`"""
+    usernames = []
+    seen = set()
+    for match in MENTION_PATTERN.finditer(text or ""):
+        username = match.group(1)
+        if username not in seen:
+            seen.add(username)
+            usernames.append(username)
+            if len(usernames) >= limit:
+                break
+    return usernames
+
+
+async def resolve_usernames(usernames: Iterable[str]) -> Dict[str, str]:
+    """username -> user id for the usernames that exist, with one query for cache misses"""
+    resolved: Dict[str, str] = {}
+    missing = []
+    for username in dict.fromkeys(usernames):
+        user_id = _user_ids.get(username)
+        if user_id is None:
+            missing.append(username)
+        elif user_id:
+            resolved[username] = user_id
+
+    if missing:
+        result = await execute(get_db().table("users").select("id, username").in_("username", missing))
+        found = {row["username"]: row["id"] for row in result.data or []}
+        for username in missing:
+            user_id = found.get(username)
+            if user_id:
+                _user_ids.set(username, user_id)
+                resolved[username] = user_id
+            else:
+                _user_ids.set(username, "", ttl=UNKNOWN_USERNAME_TTL_SECONDS)
+    return resolved
+
+
+async def resolve_mentions(text: str) -> List[Dict[str, str]]:
+    """{"id", "username"} of the existing users mentioned in a text"""
+    usernames = extract_mentions(text)
+    if not usernames:
+        return []
+    resolved = await resolve_usernames(usernames)
+    return [{"id": resolved[username], "username": username} for username in usernames if username in resolved]
+
+
+def invalidate_usernames(*usernames: Optional[str]) -> None:
+    """Call when a username is taken or released (registration, rename, deletion)"""
+    for username in usernames:
+        if username:
+            _user_ids.pop(username)
+    # Suggestions are keyed by prefix, so any of them may now be stale
+    _suggestions.clear()
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("_", "\\_")
+
+
+async def suggest_usernames(prefix: str, limit: int = 8) -> List[Dict[str, object]]:
+    """Users whose username starts with `prefix`, for @-autocomplete"""
+    if not USERNAME_PATTERN.fullmatch(prefix or ""):
+        return []
+    key = (prefix, limit)
+    cached = _suggestions.get(key)
+    if cached is not None:
+        return cached
+
+    result = await execute(
+        get_db().table("users").select(", ".join(USER_CARD))
+        .like("username", f"{_escape_like(prefix)}%")
+        .order("username")
+        .limit(limit)
+    )
+    users = result.data or []
+    for user in users:
+        # Picking a suggestion usually means mentioning that user next
+        _user_ids.set(user["username"], user["id"])
+    _suggestions.set(key, users)
+    return users
@@ -0,0 +1,140 @@
+# Per-user notification push. Users connected to this worker, by websocket
+# (through the ConnectionManager) or by the server-sent events fallback, are
+# sent each new notification and their unread count as it changes, so clients
+# need not poll. The count is read from notification_counters once when a user
+# connects and then moved by the inserts, reads and deletes this worker makes.
+# Changes made on other workers are caught by a periodic sync that reads the
+# counters of connected users, a hundred per query.
+from typing import Any, Dict, List, Set
+from services.supabase_service import get_db, execute
+from services.websocket_service import manager
+from services import count_service
+import asyncio
+import json
+import os
+
+NOTIFICATION_COUNTS_SYNC_SECONDS = int(os.getenv("NOTIFICATION_COUNTS_SYNC_SECONDS", "30"))
+
+# Messages held for a slow event-stream client before newer ones are dropped
+STREAM_QUEUE_SIZE = 100
+
+# Users whose counters are read per sync query
+SYNC_BATCH_SIZE = 100
+
+
+class NotificationPush:
+    def __init__(self):
+        # user id -> {"total", "unread"} for users connected to this worker
+        self._counts: Dict[str, Dict[str, int]] = {}
+        # user id -> open notification connections (websockets and event streams)
+        self._connections: Dict[str, int] = {}
+        # user id -> queues of their open event streams
+        self._streams: Dict[str, Set[asyncio.Queue]] = {}
+
+    async def attach(self, user_id: str) -> Dict[str, int]:
+        """Track a user on each new connection; returns their counts"""
+        self._connections[user_id] = self._connections.get(user_id, 0) + 1
+        counts = self._counts.get(user_id)
+        if counts is None:
+            try:
+                fresh = dict(await count_service.notification_counts(user_id))
+            except BaseException:
+                self.detach(user_id)
+                raise
+            counts = self._counts.setdefault(user_id, fresh)
+        return counts
+
+    def detach(self, user_id: str) -> None:
+        """Call once for each attach, when that connection closes"""
+        remaining = self._connections.get(user_id, 0) - 1
+        if remaining > 0:
+            self._connections[user_id] = remaining
+            return
+        self._connections.pop(user_id, None)
+        self._counts.pop(user_id, None)
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        """Queue of messages for an event stream"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._streams.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue) -> None:
+        queues = self._streams.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._streams[user_id]
+
+    async def publish(self, user_id: str, message: Dict[str, Any]) -> None:
+        text = json.dumps(message)
+        # Only the notification sockets; the user's reaction sockets are registered under their id too
+        await manager.broadcast_to_user(user_id, text, connection_type="notifications")
+        for queue in self._streams.get(user_id, ()):
+            try:
+                queue.put_nowait(text)
+            except asyncio.QueueFull:
+                # The next count message brings the client back in step
+                pass
+
+    async def notified(self, rows: List[Dict[str, Any]]) -> None:
+        """Push notifications just inserted or merged into to recipients connected here"""
+        for row in rows:
+            counts = self._counts.get(row["recipient_id"])
+            if counts is None:
+                continue
+            notification = dict(row)
+            if not notification.pop("merged", False):
+                counts["total"] += 1
+                if not row.get("is_read"):
+                    counts["unread"] += 1
+            actors = row.get("actors") or []
+            notification["actor"] = actors[0] if actors else None
+            await self.publish(row["recipient_id"], {"type": "notification", "notification": notification, **counts})
+
+    async def adjust(self, user_id: str, total: int = 0, unread: int = 0) -> None:
+        """Move a connected user's counts after a read or delete"""
+        counts = self._counts.get(user_id)
+        if counts is None or not (total or unread):
+            return
+        counts["total"] = max(counts["total"] + total, 0)
+        counts["unread"] = max(counts["unread"] + unread, 0)
+        await self.publish(user_id, {"type": "unread_count", **counts})
+
+    async def read_all(self, user_id: str) -> None:
+        counts = self._counts.get(user_id)
+        if counts is not None and counts["unread"]:
+            counts["unread"] = 0
+            await self.publish(user_id, {"type": "unread_count", **counts})
+
+    async def sync(self) -> None:
+        """Re-read connected users' counters and push the ones that changed elsewhere"""
+        user_ids = list(self._counts)
+        for start in range(0, len(user_ids), SYNC_BATCH_SIZE):
+            batch = user_ids[start:start + SYNC_BATCH_SIZE]
+            result = await execute(
+                get_db().table("notification_counters").select("user_id, total_count, unread_count").in_("user_id", batch)
+            )
+            stored = {row["user_id"]: row for row in result.data or []}
+            for user_id in batch:
+                counts = self._counts.get(user_id)
+                row = stored.get(user_id, {})
+                fresh = {"total": row.get("total_count", 0), "unread": row.get("unread_count", 0)}
+                if counts is not None and counts != fresh:
+                    counts.update(fresh)
+                    await self.publish(user_id, {"type": "unread_count", **counts})
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(NOTIFICATION_COUNTS_SYNC_SECONDS)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Warning: Failed to sync notification counts: {e}")
+
+
+notification_push = NotificationPush()
+
+
+async def sync_notification_counts_periodically():
+    await notification_push.run()
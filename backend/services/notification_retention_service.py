@@ -0,0 +1,50 @@
+# Notification retention. Read notifications older than
+# NOTIFICATION_RETENTION_DAYS are moved to notifications_archive by
+# archive_notifications() (see docs/database_migrations.sql), a batch per call,
+# so the notifications table keeps only recent and unread rows. Counters are
+# adjusted once per recipient per batch. Every worker runs the job; concurrent
+# runs skip each other's rows.
+from typing import Dict
+from services.supabase_service import get_db, execute
+import asyncio
+import os
+import time
+
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "30"))  # 0 keeps everything
+NOTIFICATION_RETENTION_INTERVAL_SECONDS = int(os.getenv("NOTIFICATION_RETENTION_INTERVAL_SECONDS", "3600"))
+
+ARCHIVE_BATCH_SIZE = 5000
+
+
+async def archive_read_notifications() -> Dict[str, float]:
+    """One retention run: archive until nothing old is left; returns rows archived, batches and seconds taken"""
+    started = time.monotonic()
+    archived = 0
+    batches = 0
+    while True:
+        result = await execute(get_db().rpc("archive_notifications", {
+            "p_older_than_seconds": NOTIFICATION_RETENTION_DAYS * 86400,
+            "p_limit": ARCHIVE_BATCH_SIZE,
+        }))
+        moved = result.data or 0
+        archived += moved
+        batches += 1
+        if moved < ARCHIVE_BATCH_SIZE:
+            break
+    return {"archived": archived, "batches": batches, "seconds": round(time.monotonic() - started, 3)}
+
+
+async def archive_notifications_periodically():
+    if NOTIFICATION_RETENTION_DAYS <= 0:
+        return
+    while True:
+        await asyncio.sleep(NOTIFICATION_RETENTION_INTERVAL_SECONDS)
+        try:
+            report = await archive_read_notifications()
+            if report["archived"]:
+                print(
+                    f"Archived {report['archived']} read notifications older than {NOTIFICATION_RETENTION_DAYS} days "
+                    f"in {report['batches']} batches ({report['seconds']}s)"
+                )
+        except Exception as e:
+            print(f"Warning: Failed to archive notifications: {e}")
@@ -0,0 +1,318 @@
+# Notification fan-out off the request path. Writers hand over the
+# notifications an event causes with `notify`, which drops self-notifications,
+# keeps one per recipient and appends them to a SQLite spool shared by the
+# workers on this host, then returns. Each worker drains the spool in batches:
+# it leases up to NOTIFICATION_BATCH_SIZE rows, bulk-inserts them in one call
+# and pushes them to the recipients' open connections. Rows carry their id, so
+# a batch re-sent after a crash or an expired lease is inserted at most once.
+#
+# Notifications created with an `action` coalesce: insert_notifications() (see
+# docs/database_migrations.sql) merges them into the recipient's unread
+# notification of the same type on the same post from the last
+# NOTIFICATION_COALESCE_WINDOW_SECONDS, as "Alice and 41 others <action>".
+from fastapi.concurrency import run_in_threadpool
+from postgrest.exceptions import APIError
+from typing import Any, Dict, List, Optional, Tuple
+from services.supabase_service import get_db, execute
+from services.notification_push_service import notification_push
+from services import count_service
+from datetime import datetime
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+NOTIFICATION_QUEUE = os.getenv("NOTIFICATION_QUEUE", "on")  # on or off
+NOTIFICATION_FLUSH_INTERVAL_MS = int(os.getenv("NOTIFICATION_FLUSH_INTERVAL_MS", "1000"))
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "500"))
+NOTIFICATION_COALESCE_WINDOW_SECONDS = int(os.getenv("NOTIFICATION_COALESCE_WINDOW_SECONDS", "86400"))
+NOTIFICATION_SPOOL_PATH = os.getenv("NOTIFICATION_SPOOL_PATH", os.path.join(tempfile.gettempdir(), "x-repo-notification-spool.sqlite3"))
+
+# A leased batch not cleared within this long is presumed lost with its worker and re-sent
+LEASE_SECONDS = 60
+
+# Rows that fail to insert this many times on their own are dropped
+MAX_ATTEMPTS = 5
+
+# Longest wait before re-sending after the database was unreachable; the wait doubles from 1s
+MAX_RETRY_SECONDS = 60
+
+Spooled = Tuple[int, Dict[str, Any]]  # (spool sequence, {"row": ..., "actor": ...})
+
+
+def notification(
+    recipient_id: str,
+    type: str,
+    title: str,
+    content: Optional[str] = None,
+    post_id: Optional[str] = None,
+    comment_id: Optional[str] = None,
+    actor_id: Optional[str] = None,
+    action: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    A notifications row ready to insert. With `action`, the text that follows
+    the actor's name in `content` (e.g. "reacted to your post 'X'"), it merges
+    with the recipient's unread notifications of the same type on the same post.
+    """
+    now = datetime.utcnow().isoformat()
+    grouped = {"group_key": f"{type}:{post_id}", "action": action} if action and post_id else {}
+    return {
+        "id": str(uuid.uuid4()),
+        "recipient_id": recipient_id,
+        "type": type,
+        "title": title,
+        "content": content,
+        "post_id": post_id,
+        "comment_id": comment_id,
+        "actor_id": actor_id,
+        "is_read": False,
+        "created_at": now,
+        "updated_at": now,
+        **grouped,
+    }
+
+
+def fan_out(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop self-notifications and keep the first notification per recipient"""
+    recipients = set()
+    kept = []
+    for row in rows:
+        recipient_id = row["recipient_id"]
+        if recipient_id == row.get("actor_id") or recipient_id in recipients:
+            continue
+        recipients.add(recipient_id)
+        kept.append(row)
+    return kept
+
+
+def actor_card(user: Dict[str, Any]) -> Dict[str, Any]:
+    """The acting user as notifications list it, plus their id for coalescing"""
+    card = {key: user.get(key) for key in ("id", "display_name", "username")}
+    # Listed as avatar_url, as the notification reads alias profile_picture_url
+    card["avatar_url"] = user.get("profile_picture_url")
+    return card
+
+
+class NotificationSpool:
+    """Notifications waiting to be inserted, in a local SQLite file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS notification_spool ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+                "leased_until REAL NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+        return conn
+
+    def _append(self, payloads: List[Dict[str, Any]]) -> None:
+        self._conn().executemany(
+            "INSERT INTO notification_spool (payload) VALUES (?)",
+            [(json.dumps(payload),) for payload in payloads],
+        )
+
+    def _lease(self, limit: int) -> List[Spooled]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT seq, payload FROM notification_spool WHERE leased_until < ? ORDER BY seq LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE notification_spool SET leased_until = ? WHERE seq = ?",
+                [(now + LEASE_SECONDS, seq) for seq, _ in rows],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [(seq, json.loads(payload)) for seq, payload in rows]
+
+    def _remove(self, seqs: List[int]) -> None:
+        self._conn().executemany("DELETE FROM notification_spool WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def _release(self, seqs: List[int], delay: Optional[float] = None) -> int:
+        """
+        Count a failed attempt and retry after a backoff; returns how many were
+        dropped. With `delay`, retry after it without counting an attempt.
+        """
+        conn = self._conn()
+        if delay is not None:
+            conn.executemany(
+                "UPDATE notification_spool SET leased_until = ? WHERE seq = ?",
+                [(time.time() + delay, seq) for seq in seqs],
+            )
+            return 0
+        conn.executemany(
+            "UPDATE notification_spool SET leased_until = ? + (1 << attempts), attempts = attempts + 1 WHERE seq = ?",
+            [(time.time(), seq) for seq in seqs],
+        )
+        return conn.execute("DELETE FROM notification_spool WHERE attempts >= ?", (MAX_ATTEMPTS,)).rowcount
+
+    async def append(self, payloads: List[Dict[str, Any]]) -> None:
+        await run_in_threadpool(self._append, payloads)
+
+    async def lease(self, limit: int) -> List[Spooled]:
+        return await run_in_threadpool(self._lease, limit)
+
+    async def remove(self, seqs: List[int]) -> None:
+        await run_in_threadpool(self._remove, seqs)
+
+    async def release(self, seqs: List[int], delay: Optional[float] = None) -> int:
+        return await run_in_threadpool(self._release, seqs, delay)
+
+
+class NotificationQueue:
+    def __init__(self, spool: NotificationSpool, batch_size: int = NOTIFICATION_BATCH_SIZE):
+        self.spool = spool
+        self.batch_size = batch_size
+        self._ready: Optional[asyncio.Event] = None
+        # Seconds to wait after the next failure to reach the database
+        self._retry_seconds = 1.0
+
+    async def put(self, rows: List[Dict[str, Any]], actor: Optional[Dict[str, Any]] = None) -> None:
+        await self.spool.append([{"row": row, "actor": actor} for row in rows])
+        if self._ready is not None:
+            self._ready.set()
+
+    async def drain(self) -> int:
+        """Insert and push spooled notifications until the spool is empty; returns how many were sent"""
+        sent = 0
+        while True:
+            batch = await self.spool.lease(self.batch_size)
+            if not batch:
+                return sent
+            sent += await self._send(batch)
+            if len(batch) < self.batch_size:
+                return sent
+
+    async def _send(self, batch: List[Spooled]) -> int:
+        """
+        Insert and push a leased batch. Rows the database rejects are retried on
+        their own with a backoff; if it cannot be reached, the rest of the batch
+        waits and the error is raised to end the drain.
+        """
+        try:
+            saved = await _insert([payload for _, payload in batch])
+            sent = [seq for seq, _ in batch]
+        except Exception as e:
+            if not _is_data_error(e):
+                await self._postpone([seq for seq, _ in batch])
+                raise
+            # One bad row (say, a deleted recipient) must not hold back the rest
+            print(f"Warning: Failed to insert {len(batch)} notifications, retrying one by one: {e}")
+            saved = []
+            sent = []
+            failed = []
+            unreachable: Optional[Exception] = None
+            for i, (seq, payload) in enumerate(batch):
+                try:
+                    saved += await _insert([payload])
+                    sent.append(seq)
+                except Exception as row_error:
+                    if not _is_data_error(row_error):
+                        unreachable = row_error
+                        await self._postpone([seq for seq, _ in batch[i:]])
+                        break
+                    failed.append(seq)
+            dropped = await self.spool.release(failed)
+            if dropped:
+                print(f"Warning: Dropped {dropped} notifications after {MAX_ATTEMPTS} failed attempts")
+            if unreachable is not None:
+                await self.spool.remove(sent)
+                await _push(saved)
+                raise unreachable
+
+        self._retry_seconds = 1.0
+        await self.spool.remove(sent)
+        await _push(saved)
+        return len(sent)
+
+    async def _postpone(self, seqs: List[int]) -> None:
+        """Hold rows back while the database is unreachable, without counting it against them"""
+        await self.spool.release(seqs, delay=self._retry_seconds)
+        self._retry_seconds = min(self._retry_seconds * 2, MAX_RETRY_SECONDS)
+
+    async def run(self) -> None:
+        """Drain when notified or on an interval, which also picks up rows left by stopped workers"""
+        self._ready = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._ready.wait(), NOTIFICATION_FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._ready.clear()
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"Warning: Notification delivery failed: {e}")
+
+
+def _is_data_error(error: Exception) -> bool:
+    """Whether the database rejected the rows themselves (SQLSTATE class 22 or 23, e.g. a foreign key violation)"""
+    return isinstance(error, APIError) and str(error.code or "")[:2] in ("22", "23")
+
+
+async def _insert(payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert or merge spooled notifications; returns the rows written, each flagged "merged" or not"""
+    rows = [
+        {"actor_count": 1, "actors": [payload["actor"]] if payload["actor"] else [], **payload["row"]}
+        for payload in payloads
+    ]
+    result = await execute(get_db().rpc("insert_notifications", {
+        "p_rows": rows,
+        "p_window_seconds": NOTIFICATION_COALESCE_WINDOW_SECONDS,
+    }))
+    return result.data or []
+
+
+async def _push(rows: List[Dict[str, Any]]) -> None:
+    """Send new and merged notifications to their recipients' open connections on this worker"""
+    for row in rows:
+        count_service.invalidate(("notifications", row["recipient_id"]))
+    await notification_push.notified(rows)
+
+
+notification_queue = NotificationQueue(NotificationSpool(NOTIFICATION_SPOOL_PATH)) if NOTIFICATION_QUEUE != "off" else None
+
+
+async def notify(rows: List[Dict[str, Any]], actor: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Deliver the notifications one event causes. `actor` is the acting user's
+    card from `actor_card`, kept in the notification's latest actors.
+    """
+    rows = fan_out(rows)
+    if not rows:
+        return
+    if notification_queue is not None:
+        await notification_queue.put(rows, actor)
+        return
+    await _push(await _insert([{"row": row, "actor": actor} for row in rows]))
+
+
+async def deliver_notifications_periodically():
+    if notification_queue is not None:
+        await notification_queue.run()
+
+
+async def close_notification_queue() -> None:
+    """Send what is spooled; call at shutdown after the delivery task is cancelled"""
+    if notification_queue is not None:
+        try:
+            await notification_queue.drain()
+        except Exception as e:
+            print(f"Warning: Failed to send notifications at shutdown: {e}")
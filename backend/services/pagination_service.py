@@ -0,0 +1,90 @@
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import json
+import math
+import re
+import uuid
+
+# Keyset (cursor) pagination on (sort_key, id). Cursors are opaque to clients:
+# base64url JSON carrying the sort they belong to and the last row's key and id.
+# Keys of "new" sorts (and "<list>_new") are timestamps; every other sort's are scores.
+
+_TIMESTAMP = re.compile(r"\d{4}-\d\d-\d\d([T ]\d\d:\d\d(:\d\d(\.\d+)?)?)?(Z|[+-]\d\d(:?\d\d)?)?")
+
+
+def encode_cursor(sort: str, key: Any, id: str) -> str:
+    payload = json.dumps({"s": sort, "k": key, "id": id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], sort: str) -> Optional[Tuple[Any, str]]:
+    """Return (key, id) from a cursor issued for `sort`, or None when no cursor was given"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if payload["s"] != sort:
+            raise ValueError("cursor was issued for a different sort")
+        key, id = payload["k"], payload["id"]
+        # Checked here, since a key of the wrong type fails only when it is compared
+        if not _valid_key(sort, key) or not isinstance(id, str):
+            raise ValueError("cursor key does not match its sort")
+        uuid.UUID(id)
+        return key, id
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _valid_key(sort: str, key: Any) -> bool:
+    if sort == "new" or sort.endswith("_new"):
+        return isinstance(key, str) and _TIMESTAMP.fullmatch(key) is not None
+    return isinstance(key, (int, float)) and not isinstance(key, bool) and math.isfinite(key)
+
+
+def next_cursor(rows: List[Dict[str, Any]], sort: str, key_column: str, limit: int) -> Optional[str]:
+    """Cursor for the page after `rows` (in database order), or None if this was the last page"""
+    return keyset_cursor(row_keys(rows, key_column), sort, limit)
+
+
+def row_keys(rows: List[Dict[str, Any]], key_column: str) -> List[Tuple[Any, str]]:
+    return [(row[key_column], row["id"]) for row in rows]
+
+
+def keyset_cursor(keys: List[Tuple[Any, str]], sort: str, limit: int) -> Optional[str]:
+    """
+    Cursor for the page after one whose (key, id) pairs are `keys`, or None if it
+    was the last page. For pages read as ids from an index and fetched afterwards,
+    pass the index's keys: rows deleted in between must not end the feed early.
+    """
+    if not keys or len(keys) < limit:
+        return None
+    key, id = keys[-1]
+    return encode_cursor(sort, key, id)
+
+
+def _quote(value: Any) -> str:
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def order_keyset(query: Any, key_column: str, desc: bool = True, id_column: str = "id") -> Any:
+    """
+    Order by (key_column, id) in one `order` parameter; postgrest-py versions
+    differ on whether repeated .order() calls combine or replace each other.
+    """
+    direction = ".desc" if desc else ".asc"
+    query.params = query.params.set("order", f"{key_column}{direction},{id_column}{direction}")
+    return query
+
+
+def apply_keyset(query: Any, key_column: str, cursor: Optional[Tuple[Any, str]], desc: bool = True, id_column: str = "id") -> Any:
+    """
+    Restrict a PostgREST query to rows strictly after the cursor and order it by (key, id)
+    """
+    if cursor is not None:
+        key, id = cursor
+        op = "lt" if desc else "gt"
+        query = query.or_(f"{key_column}.{op}.{_quote(key)},and({key_column}.eq.{_quote(key)},{id_column}.{op}.{_quote(id)})")
+    return order_keyset(query, key_column, desc, id_column)
@@ -0,0 +1,189 @@
+# Optional direct-Postgres read path for the hottest queries. When DATABASE_URL is
+# set, rows are built as JSON inside Postgres in the same shape PostgREST returns for
+# the equivalent embedded select; otherwise callers get None and use PostgREST.
+from fastapi.concurrency import run_in_threadpool
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from threading import Lock
+from services.projection_service import POST_PROJECTIONS
+import psycopg2
+import psycopg2.extensions
+import os
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+PG_POOL_MIN_CONNECTIONS = int(os.getenv("PG_POOL_MIN_CONNECTIONS", "1"))
+PG_POOL_MAX_CONNECTIONS = int(os.getenv("PG_POOL_MAX_CONNECTIONS", "10"))
+
+_POST_JOINS = """
+    FROM posts p
+    LEFT JOIN users u ON u.id = p.user_id
+    LEFT JOIN communities c ON c.id = p.community_id
+"""
+
+_POSTS_FILTER = """
+    WHERE ($1::uuid[] IS NULL OR p.community_id = ANY($1))
+      AND ($2::timestamptz IS NULL OR p.created_at >= $2)
+"""
+
+# sort column -> (statement name, sort column type) for keyset-paginated post reads
+POST_ORDERS = {
+    "created_at": ("posts_by_created", "timestamptz"),
+    "net_score": ("posts_by_net_score", "integer"),
+    "hot_score": ("posts_by_hot", "double precision"),
+    "controversy_score": ("posts_by_controversy", "double precision"),
+}
+
+def _post_statements() -> Dict[str, Tuple[Sequence[str], str]]:
+    """Post reads, one prepared statement per named projection"""
+    statements = {}
+    for projection in POST_PROJECTIONS.values():
+        row = projection.json_sql("p", {"user": "u", "community": "c"})
+        suffix = projection.key
+        statements[f"post_detail_{suffix}"] = (
+            ["uuid"],
+            f"SELECT {row} {_POST_JOINS} WHERE p.id = $1",
+        )
+        statements[f"posts_by_ids_{suffix}"] = (
+            ["uuid[]"],
+            f"SELECT {row} {_POST_JOINS} WHERE p.id = ANY($1)",
+        )
+        for order, (name, key_type) in POST_ORDERS.items():
+            statements[f"{name}_{suffix}"] = (
+                ["uuid[]", "timestamptz", "integer", "integer"],
+                f"SELECT {row} {_POST_JOINS} {_POSTS_FILTER} ORDER BY p.{order} DESC, p.id DESC LIMIT $3 OFFSET $4",
+            )
+            # Keyset variant: rows strictly after the cursor's (key, id)
+            statements[f"{name}_after_{suffix}"] = (
+                ["uuid[]", "timestamptz", key_type, "uuid", "integer"],
+                f"SELECT {row} {_POST_JOINS} {_POSTS_FILTER} AND (p.{order}, p.id) < ($3, $4) ORDER BY p.{order} DESC, p.id DESC LIMIT $5",
+            )
+    return statements
+
+# name -> (argument types, statement body)
+STATEMENTS: Dict[str, Tuple[Sequence[str], str]] = {
+    **_post_statements(),
+    # Columnar candidate set for computed sorts, as one JSON object of arrays
+    "post_candidates": (
+        ["uuid[]", "timestamptz", "integer"],
+        f"""
+        SELECT jsonb_build_object(
+            'id', COALESCE(jsonb_agg(p.id ORDER BY p.created_at DESC), '[]'::jsonb),
+            'upvotes', COALESCE(jsonb_agg(COALESCE(p.upvotes, 0) ORDER BY p.created_at DESC), '[]'::jsonb),
+            'downvotes', COALESCE(jsonb_agg(COALESCE(p.downvotes, 0) ORDER BY p.created_at DESC), '[]'::jsonb),
+            'created_epoch', COALESCE(jsonb_agg(EXTRACT(EPOCH FROM p.created_at) ORDER BY p.created_at DESC), '[]'::jsonb)
+        )
+        FROM (
+            SELECT p.id, p.upvotes, p.downvotes, p.created_at
+            FROM posts p {_POSTS_FILTER}
+            ORDER BY p.created_at DESC
+            LIMIT $3
+        ) p
+        """,
+    ),
+    "notifications_list": (
+        ["uuid", "boolean", "integer", "integer"],
+        """
+        SELECT to_jsonb(n) || jsonb_build_object('actor', CASE WHEN a.id IS NULL THEN NULL ELSE
+            jsonb_build_object('display_name', a.display_name, 'username', a.username, 'avatar_url', a.profile_picture_url) END)
+        FROM notifications n
+        LEFT JOIN users a ON a.id = n.actor_id
+        WHERE n.recipient_id = $1 AND (NOT $2 OR n.is_read = FALSE)
+        ORDER BY n.created_at DESC, n.id DESC
+        LIMIT $3 OFFSET $4
+        """,
+    ),
+    "notifications_list_after": (
+        ["uuid", "boolean", "timestamptz", "uuid", "integer"],
+        """
+        SELECT to_jsonb(n) || jsonb_build_object('actor', CASE WHEN a.id IS NULL THEN NULL ELSE
+            jsonb_build_object('display_name', a.display_name, 'username', a.username, 'avatar_url', a.profile_picture_url) END)
+        FROM notifications n
+        LEFT JOIN users a ON a.id = n.actor_id
+        WHERE n.recipient_id = $1 AND (NOT $2 OR n.is_read = FALSE)
+          AND (n.created_at, n.id) < ($3, $4)
+        ORDER BY n.created_at DESC, n.id DESC
+        LIMIT $5
+        """,
+    ),
+    "post_comments": (
+        ["uuid"],
+        """
+        SELECT to_jsonb(cm) || jsonb_build_object('user', to_jsonb(u))
+        FROM comments cm
+        LEFT JOIN users u ON u.id = cm.user_id
+        WHERE cm.post_id = $1 AND cm.parent_comment_id IS NULL
+        ORDER BY cm.created_at ASC
+        """,
+    ),
+}
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which named statements it has already prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = Lock()
+
+# Statements whose failure has been logged; each is logged once, then falls back quietly
+_failed_statements = set()
+
+def is_enabled() -> bool:
+    return bool(DATABASE_URL)
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                PG_POOL_MIN_CONNECTIONS,
+                PG_POOL_MAX_CONNECTIONS,
+                DATABASE_URL,
+                connection_factory=PreparingConnection,
+            )
+        return _pool
+
+def _fetch_json_rows(name: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+    arg_types, body = STATEMENTS[name]
+    pool = _get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        if not conn.autocommit:
+            conn.set_session(readonly=True, autocommit=True)
+        with conn.cursor() as cur:
+            if name not in conn.prepared:
+                cur.execute(f"PREPARE {name} ({', '.join(arg_types)}) AS {body}")
+                conn.prepared.add(name)
+            placeholders = ", ".join(f"%s::{arg_type}" for arg_type in arg_types)
+            cur.execute(f"EXECUTE {name} ({placeholders})", list(params))
+            return [row[0] for row in cur.fetchall()]
+    except psycopg2.Error:
+        broken = conn.closed != 0
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
+
+async def fetch_all(name: str, *params: Any) -> Optional[List[Dict[str, Any]]]:
+    """
+    Run a prepared read statement; returns None when the direct path is unavailable
+    """
+    if not is_enabled():
+        return None
+    try:
+        return await run_in_threadpool(_fetch_json_rows, name, params)
+    except (psycopg2.Error, PoolError) as e:
+        # Any database error, including a statement the live schema rejects, falls back
+        if name not in _failed_statements:
+            _failed_statements.add(name)
+            print(f"Warning: direct Postgres read {name} failed, falling back to PostgREST: {e}")
+        return None
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
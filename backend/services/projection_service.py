@@ -0,0 +1,142 @@
+from fastapi import HTTPException
+from typing import Dict, List, Optional, Tuple
+
+# Named column sets for list and detail views. Bump a projection's version
+# whenever its columns change so anything keyed on `Projection.key` (caches,
+# prepared statements) picks up the new shape.
+
+
+class Projection:
+    """
+    Columns to fetch for a table plus its embedded relations (alias -> (table, columns))
+    """
+
+    def __init__(self, name: str, version: int, columns: List[str], embeds: Optional[Dict[str, Tuple[str, List[str]]]] = None, adhoc: bool = False):
+        self.name = name
+        self.version = version
+        self.columns = columns
+        self.embeds = embeds or {}
+        # Ad-hoc projections come from client `fields=` and are never prepared server-side
+        self.adhoc = adhoc
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}_v{self.version}"
+
+    def select(self) -> str:
+        """PostgREST select string, e.g. `id, title, user:users(id, username)`"""
+        parts = [", ".join(self.columns)]
+        for alias, (table, columns) in self.embeds.items():
+            parts.append(f"{alias}:{table}({', '.join(columns)})")
+        return ", ".join(parts)
+
+    def json_sql(self, table_alias: str, embed_aliases: Dict[str, str]) -> str:
+        """
+        SQL expression building the same JSON object from a row joined to its embeds
+        """
+        def build(alias: str, columns: List[str]) -> str:
+            if columns == ["*"]:
+                return f"to_jsonb({alias})"
+            pairs = ", ".join(f"'{column}', {alias}.{column}" for column in columns)
+            return f"jsonb_build_object({pairs})"
+
+        expression = build(table_alias, self.columns)
+        for embed, (_, columns) in self.embeds.items():
+            alias = embed_aliases[embed]
+            expression += f" || jsonb_build_object('{embed}', CASE WHEN {alias}.id IS NULL THEN NULL ELSE {build(alias, columns)} END)"
+        return expression
+
+    def extend(self, extra: List[str], name: str) -> "Projection":
+        columns = list(self.columns)
+        embeds = {alias: (table, list(cols)) for alias, (table, cols) in self.embeds.items()}
+        for field in extra:
+            alias, _, column = field.rpartition(".")
+            target = embeds[alias][1] if alias else columns
+            if column not in target and target != ["*"]:
+                target.append(column)
+        return Projection(name, self.version, columns, embeds, adhoc=True)
+
+
+def _fields_of(projection: Projection) -> List[str]:
+    fields = list(projection.columns)
+    for alias, (_, columns) in projection.embeds.items():
+        fields.extend(f"{alias}.{column}" for column in columns)
+    return fields
+
+
+def resolve_projection(projections: Dict[str, Projection], fields: Optional[str], default: str = "card") -> Projection:
+    """
+    Resolve a `fields=` query option against a projection family.
+
+    `fields` is a comma-separated list of a projection name ("detail") and/or
+    extra fields ("user.bio", "description") allowed by the "detail" projection.
+    The "admin" projection is never selectable by clients.
+    """
+    if not fields:
+        return projections[default]
+
+    base = projections[default]
+    extra = []
+    allowed = set(_fields_of(projections["detail"]))
+    for field in (f.strip() for f in fields.split(",")):
+        if not field:
+            continue
+        if field in projections and field != "admin":
+            base = projections[field]
+        elif field in allowed:
+            extra.append(field)
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown field '{field}'")
+
+    if not extra:
+        return base
+    return base.extend(extra, name=f"{base.name}+{','.join(sorted(extra))}")
+
+
+USER_CARD = ["id", "username", "display_name", "profile_picture_url", "post_karma", "comment_karma"]
+USER_DETAIL = USER_CARD + ["bio", "location", "website", "quantum_interests", "created_at"]
+COMMUNITY_CARD = ["id", "name", "display_name"]
+COMMUNITY_DETAIL = COMMUNITY_CARD + ["description", "rules", "member_count", "created_by", "created_at"]
+
+POST_COLUMNS = [
+    "id", "community_id", "user_id", "title", "content", "post_type",
+    "upvotes", "downvotes", "net_score", "comment_count", "hot_score", "controversy_score",
+    "created_at", "updated_at",
+]
+
+POST_PROJECTIONS = {
+    "card": Projection("card", 4, POST_COLUMNS, {
+        "user": ("users", USER_CARD),
+        "community": ("communities", COMMUNITY_CARD),
+    }),
+    "detail": Projection("detail", 4, POST_COLUMNS, {
+        "user": ("users", USER_DETAIL),
+        "community": ("communities", COMMUNITY_DETAIL),
+    }),
+    "admin": Projection("admin", 4, ["*"], {
+        "user": ("users", ["*"]),
+        "community": ("communities", ["*"]),
+    }),
+}
+
+PROJECT_CARD = [
+    "id", "user_id", "title", "description", "visibility", "tags",
+    "star_count", "fork_count", "created_at", "updated_at",
+]
+
+PROJECT_PROJECTIONS = {
+    "card": Projection("card", 2, PROJECT_CARD, {"user": ("users", USER_CARD)}),
+    "detail": Projection("detail", 2, PROJECT_CARD + ["readme_content"], {"user": ("users", USER_DETAIL)}),
+    "admin": Projection("admin", 2, ["*"], {"user": ("users", ["*"])}),
+}
+
+BOOKMARK_COLUMNS = ["id", "post_id", "user_id", "created_at"]
+
+BOOKMARK_PROJECTIONS = {
+    "card": Projection("card", 4, BOOKMARK_COLUMNS, {"post": ("posts", POST_COLUMNS)}),
+    "detail": Projection("detail", 4, BOOKMARK_COLUMNS, {
+        "post": ("posts", POST_COLUMNS),
+        "user": ("users", USER_CARD),
+    }),
+    "admin": Projection("admin", 4, ["*"], {"post": ("posts", ["*"]), "user": ("users", ["*"])}),
+}
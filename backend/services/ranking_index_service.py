@@ -0,0 +1,250 @@
+# Ranked feed reads. The in-process ranking index keeps, for each community (and
+# for all communities together), the top RANKING_INDEX_SIZE posts by hot, top and
+# controversial score, so ranked feed pages are read from memory and only the
+# page's rows are fetched. Post writes in this process feed it incrementally;
+# a periodic reload from the database picks up writes from other workers. Only
+# scopes read since the previous reload are reloaded; the rest are dropped and
+# loaded afresh when next read. A page across more communities than are cold
+# (not loaded) is read from the database while they load in the background.
+# Computed sorts ("best", "rising") are scored per request over a candidate set.
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+from services.supabase_service import get_db, execute
+from services import postgres_service
+from services.projection_service import Projection
+from services.pagination_service import order_keyset
+from services.ranking_service import COMPUTED_SORTS, Ranking, merge_rankings, top_k
+import asyncio
+import numpy as np
+import os
+
+RANKING_INDEX_SIZE = int(os.getenv("RANKING_INDEX_SIZE", "500"))
+RANKING_INDEX_MAX_SCOPES = int(os.getenv("RANKING_INDEX_MAX_SCOPES", "200"))
+RANKING_INDEX_REFRESH_SECONDS = int(os.getenv("RANKING_INDEX_REFRESH_SECONDS", "60"))
+
+# Scopes loaded from the database at once (each is one query per indexed column)
+RANKING_INDEX_LOAD_CONCURRENCY = 4
+
+# Cold scopes one page may wait for; a page needing more is read from the database
+RANKING_INDEX_MAX_COLD_SCOPES = 4
+
+# Newest posts considered for computed sorts
+RANKING_CANDIDATES = int(os.getenv("RANKING_CANDIDATES", "10000"))
+
+# Sort columns the index serves; "new" is a plain index scan in the database
+INDEXED_COLUMNS = ["hot_score", "net_score", "controversy_score"]
+
+SCORE_SELECT = "id, community_id, " + ", ".join(INDEXED_COLUMNS)
+
+
+def _warm_done(loading: asyncio.Future) -> None:
+    if not loading.cancelled() and loading.exception() is not None:
+        print(f"Warning: Failed to load ranking index scope: {loading.exception()}")
+
+
+class RankingIndex:
+    def __init__(self, capacity: int = RANKING_INDEX_SIZE, max_scopes: int = RANKING_INDEX_MAX_SCOPES):
+        self.capacity = capacity
+        self.max_scopes = max_scopes
+        # scope (community id, or None for all communities) -> sort column -> ranking
+        self._scopes: "OrderedDict[Optional[str], Dict[str, Ranking]]" = OrderedDict()
+        self._loading: Dict[Optional[str], asyncio.Future] = {}
+        # Scopes read since the last refresh
+        self._read: Set[Optional[str]] = set()
+        self._load_slots: Optional[asyncio.Semaphore] = None
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._load_slots is None:
+            self._load_slots = asyncio.Semaphore(RANKING_INDEX_LOAD_CONCURRENCY)
+        return self._load_slots
+
+    async def _fetch(self, scope: Optional[str], column: str) -> List[Dict[str, Any]]:
+        query = get_db().table("posts").select(SCORE_SELECT)
+        if scope is not None:
+            query = query.eq("community_id", scope)
+        # One row past capacity tells whether the scope fits in the index entirely
+        result = await execute(order_keyset(query, column).limit(self.capacity + 1))
+        return result.data or []
+
+    async def _load(self, scope: Optional[str]) -> Dict[str, Ranking]:
+        async with self._slots():
+            rows_by_column = await asyncio.gather(*(self._fetch(scope, column) for column in INDEXED_COLUMNS))
+        rankings = {}
+        for column, rows in zip(INDEXED_COLUMNS, rows_by_column):
+            complete = len(rows) <= self.capacity
+            rankings[column] = Ranking(self.capacity, rows[:self.capacity], column, complete)
+        self._scopes[scope] = rankings
+        self._scopes.move_to_end(scope)
+        while len(self._scopes) > self.max_scopes:
+            self._scopes.popitem(last=False)
+        return rankings
+
+    async def _rankings(self, scope: Optional[str]) -> Dict[str, Ranking]:
+        rankings = self._scopes.get(scope)
+        if rankings is not None:
+            self._scopes.move_to_end(scope)
+            return rankings
+
+        return await asyncio.shield(self._start_load(scope))
+
+    def _start_load(self, scope: Optional[str]) -> asyncio.Future:
+        # One load per scope at a time; concurrent readers wait for it
+        loading = self._loading.get(scope)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(scope))
+            self._loading[scope] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(scope, None))
+        return loading
+
+    def _warm(self, scopes: List[Optional[str]]) -> None:
+        """Load scopes in the background, for the pages that follow"""
+        for scope in scopes:
+            self._start_load(scope).add_done_callback(_warm_done)
+
+    async def page(
+        self,
+        scopes: List[Optional[str]],
+        column: str,
+        offset: int,
+        limit: int,
+        after: Optional[Tuple[Any, str]] = None
+    ) -> Optional[List[Tuple[Any, str]]]:
+        """
+        (score, id) of a ranked page of posts across `scopes`, or None if this sort
+        or page must come from the database.
+
+        The scopes' rankings are combined by a lazy heap k-way merge that stops once
+        offset + limit posts are produced: O((offset + limit) log len(scopes)).
+        """
+        if column not in INDEXED_COLUMNS or len(scopes) > self.max_scopes // 2:
+            return None
+        self._read.update(scopes)
+        cold = [scope for scope in scopes if scope not in self._scopes]
+        if len(cold) > RANKING_INDEX_MAX_COLD_SCOPES:
+            # Loading them all would hold up this page; the database serves it meanwhile
+            self._warm(cold)
+            return None
+        rankings = await asyncio.gather(*(self._rankings(scope) for scope in scopes))
+        return merge_rankings([ranking[column] for ranking in rankings], offset, limit, after)
+
+    def _affected(self, community_id: Optional[str]) -> List[Dict[str, Ranking]]:
+        return [self._scopes[scope] for scope in (community_id, None) if scope in self._scopes]
+
+    def on_post_scored(self, row: Dict[str, Any]) -> None:
+        """Record a created or re-voted post; `row` carries community_id and the score columns"""
+        for rankings in self._affected(row.get("community_id")):
+            for column, ranking in rankings.items():
+                if column in row:
+                    ranking.upsert(row["id"], row[column])
+
+    def on_post_deleted(self, community_id: Optional[str], post_id: str) -> None:
+        for rankings in self._affected(community_id):
+            for ranking in rankings.values():
+                ranking.remove(post_id)
+
+    async def refresh(self) -> None:
+        """Reload the scopes read since the last refresh, a few at a time, and drop the others"""
+        read, self._read = self._read, set()
+        for scope in list(self._scopes):
+            if scope not in read:
+                del self._scopes[scope]
+        await asyncio.gather(*(self._load(scope) for scope in list(self._scopes)))
+
+    def clear(self) -> None:
+        self._scopes.clear()
+
+
+ranking_index = RankingIndex()
+
+
+async def fetch_posts_by_ids(post_ids: List[str], projection: Projection) -> List[Dict[str, Any]]:
+    """Rows for `post_ids` in the given order; posts deleted in the meantime are skipped"""
+    if not post_ids:
+        return []
+    rows = None
+    if not projection.adhoc:
+        rows = await postgres_service.fetch_all(f"posts_by_ids_{projection.key}", post_ids)
+    if rows is None:
+        result = await execute(get_db().table("posts").select(projection.select()).in_("id", post_ids))
+        rows = result.data or []
+    by_id = {row["id"]: row for row in rows}
+    return [by_id[id] for id in post_ids if id in by_id]
+
+
+async def read_ranked_posts(
+    community_ids: Optional[List[str]],
+    column: str,
+    projection: Projection,
+    offset: int,
+    limit: int,
+    after: Optional[Tuple[Any, str]] = None
+) -> Optional[Tuple[List[Dict[str, Any]], List[Tuple[Any, str]]]]:
+    """
+    A ranked page of posts in `community_ids` (None for all communities) served
+    from the index, with the index's (score, id) for each ranked post, or None to
+    fall back to the database. Posts deleted since they were indexed are missing
+    from the rows but not the keys, so page cursors are built from the keys.
+    """
+    scopes = list(community_ids) if community_ids is not None else [None]
+    entries = await ranking_index.page(scopes, column, offset, limit, after)
+    if entries is None:
+        return None
+    posts = await fetch_posts_by_ids([id for _, id in entries], projection)
+    return posts, entries
+
+
+async def refresh_ranking_index_periodically():
+    while True:
+        await asyncio.sleep(RANKING_INDEX_REFRESH_SECONDS)
+        try:
+            await ranking_index.refresh()
+        except Exception as e:
+            print(f"Warning: Failed to refresh ranking index: {e}")
+
+
+def _epoch(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+
+async def _fetch_candidates(community_ids: Optional[List[str]], from_date: Optional[str]) -> Dict[str, Any]:
+    """Newest posts in scope as columns: id, upvotes, downvotes, created_epoch"""
+    rows = await postgres_service.fetch_all("post_candidates", community_ids, from_date, RANKING_CANDIDATES)
+    if rows is not None:
+        return rows[0]
+
+    # PostgREST caps rows per request (max-rows), so this path sees fewer candidates
+    query = get_db().table("posts").select("id, upvotes, downvotes, created_at")
+    if community_ids is not None:
+        query = query.in_("community_id", community_ids)
+    if from_date:
+        query = query.gte("created_at", from_date)
+    result = await execute(query.order("created_at", desc=True).limit(RANKING_CANDIDATES))
+    data = result.data or []
+    return {
+        "id": [row["id"] for row in data],
+        "upvotes": [row["upvotes"] or 0 for row in data],
+        "downvotes": [row["downvotes"] or 0 for row in data],
+        "created_epoch": [_epoch(row["created_at"]) for row in data],
+    }
+
+
+async def read_computed_ranking(
+    community_ids: Optional[List[str]],
+    from_date: Optional[str],
+    sort: str,
+    projection: Projection,
+    offset: int,
+    limit: int
+) -> List[Dict[str, Any]]:
+    """A page of posts for a computed sort ("best", "rising") by offset"""
+    candidates = await _fetch_candidates(community_ids, from_date)
+    columns = {
+        "upvotes": np.asarray(candidates["upvotes"], dtype=np.float64),
+        "downvotes": np.asarray(candidates["downvotes"], dtype=np.float64),
+        "created_epoch": np.asarray(candidates["created_epoch"], dtype=np.float64),
+    }
+    page = top_k(COMPUTED_SORTS[sort](columns), offset, limit)
+    ids = candidates["id"]
+    return await fetch_posts_by_ids([ids[i] for i in page], projection)
@@ -0,0 +1,177 @@
+# Post ranking. Hot and controversial scores are persisted on posts and kept
+# current by a trigger whenever votes change (see docs/database_migrations.sql),
+# so those feeds are indexed top-k reads. Sorts that depend on the current time
+# or are not worth persisting ("best", "rising") are scored here in one
+# vectorized pass over a candidate set, and the page is picked with argpartition.
+# Nothing here touches the database, so it can be replayed offline (benchmarks.ranking_replay).
+from bisect import bisect_left, insort
+from itertools import islice
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import heapq
+import numpy as np
+import time
+
+# Sort name -> column the feed is ordered by (ties broken by id)
+SORT_COLUMNS = {
+    "hot": "hot_score",
+    "top": "net_score",
+    "controversial": "controversy_score",
+    "new": "created_at",
+}
+
+# time_range -> how far back it reaches; anything else (including "all") is all time.
+# Must match leaderboard_window() in SQL.
+TIME_RANGES = {
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30),
+    "year": timedelta(days=365),
+}
+
+# Reddit's hot epoch and decay; must match post_hot_score() in SQL
+HOT_EPOCH = 1134028003
+HOT_DECAY_SECONDS = 45000
+
+# z for an 80% confidence interval, as used by Reddit's "best"
+WILSON_Z = 1.281551565545
+
+RISING_GRAVITY = 1.5
+
+
+def sort_column(sort: str) -> str:
+    """Column to order a feed by; unknown sorts fall back to newest first"""
+    return SORT_COLUMNS.get(sort, "created_at")
+
+
+def time_range_start(time_range: Optional[str]) -> Optional[str]:
+    """Return the ISO timestamp a day/week/month/year window starts at, or None for all time"""
+    span = TIME_RANGES.get(time_range or "all")
+    if span is None:
+        return None
+    return (datetime.utcnow() - span).isoformat()
+
+
+def hot_scores(upvotes: np.ndarray, downvotes: np.ndarray, created_epoch: np.ndarray) -> np.ndarray:
+    """Same values as the persisted hot_score column"""
+    score = np.asarray(upvotes, dtype=np.float64) - np.asarray(downvotes, dtype=np.float64)
+    order = np.log10(np.maximum(np.abs(score), 1))
+    seconds = np.asarray(created_epoch, dtype=np.float64) - HOT_EPOCH
+    return np.round(np.sign(score) * order + seconds / HOT_DECAY_SECONDS, 7)
+
+
+def controversy_scores(upvotes: np.ndarray, downvotes: np.ndarray) -> np.ndarray:
+    """Vote volume weighted by balance: 1 at a 50/50 split, 0 when one-sided"""
+    up = np.asarray(upvotes, dtype=np.float64)
+    total = up + np.asarray(downvotes, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        balance = 1 - np.abs(0.5 - up / total) * 2
+    return np.where(total > 0, balance * total, 0.0)
+
+
+def wilson_scores(upvotes: np.ndarray, downvotes: np.ndarray, z: float = WILSON_Z) -> np.ndarray:
+    """Lower bound of the Wilson score interval for the upvote ratio ("best")"""
+    up = np.asarray(upvotes, dtype=np.float64)
+    n = up + np.asarray(downvotes, dtype=np.float64)
+    z2 = z * z
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = up / n
+        lower = (p + z2 / (2 * n) - z * np.sqrt((p * (1 - p) + z2 / (4 * n)) / n)) / (1 + z2 / n)
+    return np.where(n > 0, lower, 0.0)
+
+
+def rising_scores(upvotes: np.ndarray, downvotes: np.ndarray, created_epoch: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+    """Net votes per unit of age, so young posts gaining votes quickly rise"""
+    now = time.time() if now is None else now
+    hours = np.maximum((now - np.asarray(created_epoch, dtype=np.float64)) / 3600, 0)
+    net = np.asarray(upvotes, dtype=np.float64) - np.asarray(downvotes, dtype=np.float64)
+    return net / np.power(hours + 2, RISING_GRAVITY)
+
+
+def top_k(scores: np.ndarray, offset: int, limit: int) -> np.ndarray:
+    """
+    Indices of ranks [offset, offset + limit) by descending score in O(n + k log k).
+    Ties keep candidate order.
+    """
+    n = min(offset + limit, scores.size)
+    if n <= offset:
+        return np.empty(0, dtype=np.intp)
+    if n < scores.size:
+        # Everything tied with the n-th score, so ties at the cutoff also keep candidate order
+        kth = -np.partition(-scores, n - 1)[n - 1]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(scores.size)
+    ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return ranked[offset:n]
+
+
+# Sorts scored per request: name -> scorer over candidate columns
+COMPUTED_SORTS: Dict[str, Callable[[Dict[str, np.ndarray]], np.ndarray]] = {
+    "best": lambda c: wilson_scores(c["upvotes"], c["downvotes"]),
+    "rising": lambda c: rising_scores(c["upvotes"], c["downvotes"], c["created_epoch"]),
+}
+
+
+class RankingExhausted(Exception):
+    """Raised when a merge runs past the tracked posts of an incomplete ranking"""
+
+
+class Ranking:
+    """
+    Top `capacity` posts of one scope by one score, as (score, id) ascending,
+    so pages read from the end match the database's `score DESC, id DESC`.
+    """
+
+    def __init__(self, capacity: int, rows: List[Dict[str, Any]], column: str, complete: bool):
+        self.capacity = capacity
+        self.column = column
+        self.scores: Dict[str, Any] = {row["id"]: row[column] for row in rows}
+        self.entries: List[Tuple[Any, str]] = sorted((score, id) for id, score in self.scores.items())
+        # Complete when every post in the scope is tracked, so any page can be served
+        self.complete = complete
+
+    def _discard(self, post_id: str) -> None:
+        score = self.scores.pop(post_id, None)
+        if score is not None:
+            del self.entries[bisect_left(self.entries, (score, post_id))]
+
+    def upsert(self, post_id: str, score: Any) -> None:
+        self._discard(post_id)
+        entry = (score, post_id)
+        if not self.complete and self.entries and len(self.entries) >= self.capacity and entry < self.entries[0]:
+            # Below the cutoff: untracked posts may outrank it, so leave it to the database
+            return
+        insort(self.entries, entry)
+        self.scores[post_id] = score
+        if len(self.entries) > self.capacity:
+            _, dropped = self.entries.pop(0)
+            del self.scores[dropped]
+            self.complete = False
+
+    def remove(self, post_id: str) -> None:
+        self._discard(post_id)
+
+    def descending(self, after: Optional[Tuple[Any, str]] = None) -> Iterator[Tuple[Any, str]]:
+        """Lazily yield (score, id) from the top down, starting strictly after `after`"""
+        end = bisect_left(self.entries, tuple(after)) if after is not None else len(self.entries)
+        for i in range(end - 1, -1, -1):
+            yield self.entries[i]
+        if not self.complete:
+            # The next post in this scope is untracked, so the caller must use the database
+            raise RankingExhausted()
+
+
+def merge_rankings(rankings: List[Ranking], offset: int, limit: int, after: Optional[Tuple[Any, str]] = None) -> Optional[List[Tuple[Any, str]]]:
+    """
+    (score, id) of ranks [offset, offset + limit) across several rankings of one
+    score, or None when the page reaches past what an incomplete ranking tracks.
+
+    A lazy heap k-way merge that stops once offset + limit posts are produced:
+    O((offset + limit) log len(rankings)).
+    """
+    streams = [ranking.descending(after) for ranking in rankings]
+    try:
+        return list(islice(heapq.merge(*streams, reverse=True), offset, offset + limit))
+    except RankingExhausted:
+        return None
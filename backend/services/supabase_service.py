@@ -1,4 +1,11 @@
 from supabase import create_client, Client
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+from postgrest.exceptions import APIError
+from fastapi import HTTPException
+from typing import Any, Optional
+import asyncio
+import httpx
 import os
 
 supabase_url = os.getenv("SUPABASE_URL")
@@ -7,8 +14,72 @@ supabase_key = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_ANON_KEY
 if not supabase_url or not supabase_key:
     raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
 
+# Synchronous client, still used for Storage uploads (run in the threadpool)
 supabase: Client = create_client(supabase_url, supabase_key)
 
 def get_supabase() -> Client:
     return supabase
 
+# Async PostgREST access for request handlers: one shared HTTP/2 pool per worker,
+# a per-call timeout and a cap on in-flight queries so bursts queue instead of piling up
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "100"))
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """AsyncPostgrestClient whose session is a bounded, HTTP/2 keep-alive pool"""
+
+    def create_session(self, base_url: str, headers: dict, timeout: Any, verify: bool = True, *args, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=DB_MAX_CONNECTIONS,
+                max_keepalive_connections=DB_MAX_CONNECTIONS,
+            ),
+            follow_redirects=True,
+        )
+
+db = PooledPostgrestClient(
+    f"{supabase_url}/rest/v1",
+    headers={
+        **DEFAULT_POSTGREST_CLIENT_HEADERS,
+        "apikey": supabase_key,
+        "Authorization": f"Bearer {supabase_key}",
+    },
+    timeout=DB_TIMEOUT_SECONDS,
+)
+
+_db_semaphore: Optional[asyncio.Semaphore] = None
+
+def get_db() -> AsyncPostgrestClient:
+    return db
+
+def _get_semaphore() -> asyncio.Semaphore:
+    # Created lazily so it binds to the running event loop
+    global _db_semaphore
+    if _db_semaphore is None:
+        _db_semaphore = asyncio.Semaphore(DB_MAX_CONCURRENCY)
+    return _db_semaphore
+
+async def execute(query: Any, timeout: Optional[float] = None) -> Any:
+    """
+    Execute a PostgREST query builder without blocking the event loop
+    """
+    try:
+        async with _get_semaphore():
+            return await asyncio.wait_for(query.execute(), timeout or DB_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Database request timed out")
+
+def is_missing_reference(error: Exception, column: Optional[str] = None) -> bool:
+    """Whether a write failed on a foreign key (SQLSTATE 23503), on `column` if given"""
+    if not isinstance(error, APIError) or error.code != "23503":
+        return False
+    return column is None or column in f"{error.message} {error.details}"
+
+async def close_db() -> None:
+    await db.aclose()
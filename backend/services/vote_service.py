@@ -0,0 +1,49 @@
+from typing import Any, Dict, Optional
+from services.supabase_service import get_db, execute
+from services import counter_buffer_service
+
+# Votes go through the cast_vote() function (see docs/database_migrations.sql):
+# the vote row and the target's counters change in one transaction and one
+# round trip, so concurrent clicks cannot drift the totals. With the counter
+# buffer on, record_vote() writes only the vote row and the counter delta is
+# buffered (see counter_buffer_service).
+VOTE_TYPES = ("upvote", "downvote")
+
+# votable type -> table holding its counters
+VOTABLE_TABLES = {"post": "posts", "comment": "comments"}
+
+
+async def cast_vote(user_id: str, votable_type: str, votable_id: str, vote_type: str) -> Optional[Dict[str, Any]]:
+    """
+    Toggle a user's vote on a post or comment: a repeat of the current vote
+    removes it, the other type replaces it.
+
+    Returns the target's new totals ("upvotes", "downvotes", plus "community_id"
+    for posts, and the score columns when applied directly) and the user's
+    resulting "vote_type" (None when removed), or None when the target does not exist.
+    """
+    params = {
+        "p_user_id": user_id,
+        "p_votable_type": votable_type,
+        "p_votable_id": votable_id,
+        "p_vote_type": vote_type,
+    }
+    if not counter_buffer_service.is_buffered():
+        result = await execute(get_db().rpc("cast_vote", params))
+        return result.data or None
+
+    table = VOTABLE_TABLES[votable_type]
+    if not await counter_buffer_service.hold(table, votable_id):
+        return None
+    result = await execute(get_db().rpc("record_vote", params))
+    if not result.data:
+        # record_vote() found no such target; its NULL stands in for an existence check
+        await counter_buffer_service.release(table, votable_id)
+        return None
+    totals = dict(result.data)
+    counter_buffer_service.counter_buffer.add(table, votable_id, {
+        "upvotes": totals.pop("up_delta"),
+        "downvotes": totals.pop("down_delta"),
+    })
+    # Stored totals plus what is still buffered, including this vote
+    return counter_buffer_service.overlay(table, totals)
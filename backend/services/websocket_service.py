@@ -32,7 +32,9 @@ class ConnectionManager:
             self.user_connections[user_id].add(websocket)
 
     def disconnect(self, websocket: WebSocket, post_id: str = None, user_id: str = None):
-        self.active_connections.remove(websocket)
+        # A socket dropped by a failed broadcast is disconnected again when its handler exits
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
         
         # Remove from specific connection pools
         for connection_type, connections in self.connections.items():
@@ -55,24 +57,28 @@ class ConnectionManager:
         """Send message to all connections watching a specific post"""
         if post_id in self.post_connections:
             disconnected = set()
-            for connection in self.post_connections[post_id]:
+            # Copied, since connections may come and go while a send is awaited
+            for connection in list(self.post_connections[post_id]):
                 try:
                     await connection.send_text(message)
-                except WebSocketDisconnect:
+                except Exception:
+                    # Closed sockets raise RuntimeError or WebSocketDisconnect; either way the rest still get the message
                     disconnected.add(connection)
             
             # Clean up disconnected connections
             for connection in disconnected:
                 self.disconnect(connection, post_id=post_id)
 
-    async def broadcast_to_user(self, user_id: str, message: str):
-        """Send message to all connections for a specific user"""
+    async def broadcast_to_user(self, user_id: str, message: str, connection_type: str = None):
+        """Send message to all connections for a specific user, optionally only those of one type"""
         if user_id in self.user_connections:
             disconnected = set()
-            for connection in self.user_connections[user_id]:
+            for connection in list(self.user_connections[user_id]):
+                if connection_type and connection not in self.connections.get(connection_type, ()):
+                    continue
                 try:
                     await connection.send_text(message)
-                except WebSocketDisconnect:
+                except Exception:
                     disconnected.add(connection)
             
             # Clean up disconnected connections
@@ -82,10 +88,10 @@ class ConnectionManager:
     async def broadcast_global(self, message: str):
         """Send message to all active connections"""
         disconnected = set()
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
             try:
                 await connection.send_text(message)
-            except WebSocketDisconnect:
+            except Exception:
                 disconnected.add(connection)
         
         # Clean up disconnected connections
@@ -0,0 +1,10 @@
+# Tests run from backend/ with `python -m pytest tests`. They need the backend
+# requirements installed, but no database: modules read these settings at import
+# time, and anything that would reach Supabase is replaced per test.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test.test.test")
@@ -0,0 +1,221 @@
+# Crash recovery of the write-behind counters: journal notes left by a stopped
+# worker or a failed flush are reconciled, live workers' rows are left alone,
+# and reconciliation never holds the journal lock across the database call.
+from types import SimpleNamespace
+from typing import Any, Dict, List, Set, Tuple
+from services import counter_buffer_service
+from services.counter_buffer_service import CounterBuffer, CounterJournal
+import asyncio
+import uuid
+
+import pytest
+
+POST_ID = str(uuid.uuid4())
+OTHER_POST_ID = str(uuid.uuid4())
+
+
+class FakeDB:
+    """Records RPCs; `on_rpc` may raise, or act while a call is in flight"""
+
+    def __init__(self):
+        self.rpcs: List[Tuple[str, Any]] = []
+        self.on_rpc = None
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> Any:
+        return SimpleNamespace(rpc=name, params=params)
+
+
+@pytest.fixture
+def db(monkeypatch) -> FakeDB:
+    fake = FakeDB()
+
+    async def execute(query: Any) -> Any:
+        fake.rpcs.append((query.rpc, query.params))
+        if fake.on_rpc is not None:
+            await fake.on_rpc()
+        return SimpleNamespace(data={})
+
+    monkeypatch.setattr(counter_buffer_service, "get_db", lambda: fake)
+    monkeypatch.setattr(counter_buffer_service, "execute", execute)
+
+    async def on_posts_counted(rows: List[Dict[str, Any]]) -> None:
+        pass
+
+    monkeypatch.setattr(counter_buffer_service, "_on_posts_counted", on_posts_counted)
+    return fake
+
+
+@pytest.fixture
+def journal(tmp_path) -> CounterJournal:
+    return CounterJournal(str(tmp_path / "journal.sqlite3"))
+
+
+def notes(journal: CounterJournal) -> Set[Tuple[str, str, str]]:
+    return set(journal._conn().execute("SELECT owner, target, id FROM counter_journal").fetchall())
+
+
+def reconciled(db: FakeDB) -> List[Tuple[str, str]]:
+    return [(target["target"], target["id"]) for name, params in db.rpcs if name == "reconcile_counters" for target in params["p_targets"]]
+
+
+def test_rows_of_a_crashed_worker_are_reconciled(db, journal):
+    async def scenario():
+        crashed = CounterBuffer(journal)
+        assert await crashed.hold("posts", POST_ID)
+        crashed.add("posts", POST_ID, {"upvotes": 1})
+        # The worker dies before flushing and never heartbeats
+
+        assert await journal.reconcile() == 1
+        assert reconciled(db) == [("posts", POST_ID)]
+        assert notes(journal) == set()
+
+    asyncio.run(scenario())
+
+
+def test_rows_held_by_a_live_worker_are_left_alone(db, journal):
+    async def scenario():
+        live = CounterBuffer(journal)
+        await journal.heartbeat(live.owner)
+        assert await live.hold("posts", POST_ID)
+
+        crashed = CounterBuffer(journal)
+        assert await crashed.hold("posts", POST_ID)
+
+        # The live worker's flush will write its delta; recomputing now could count it twice
+        assert await journal.reconcile() == 0
+        assert reconciled(db) == []
+        assert len(notes(journal)) == 2
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_is_reconciled(db, journal):
+    async def scenario():
+        buffer = CounterBuffer(journal)
+        await journal.heartbeat(buffer.owner)
+        assert await buffer.hold("posts", POST_ID)
+        buffer.add("posts", POST_ID, {"comment_count": 1})
+
+        async def fail():
+            raise ConnectionError("database unreachable")
+
+        db.on_rpc = fail
+        await buffer.flush()
+        db.on_rpc = None
+        assert db.rpcs[-1][0] == "apply_counter_deltas"
+
+        # Whether the batch landed is unknown, so the row is recomputed
+        assert await journal.reconcile() == 1
+        assert reconciled(db) == [("posts", POST_ID)]
+        assert notes(journal) == set()
+
+    asyncio.run(scenario())
+
+
+def test_failed_reconcile_keeps_its_rows_for_the_next_pass(db, journal):
+    async def scenario():
+        crashed = CounterBuffer(journal)
+        assert await crashed.hold("posts", POST_ID)
+
+        async def fail():
+            raise TimeoutError("statement timeout")
+
+        db.on_rpc = fail
+        with pytest.raises(TimeoutError):
+            await journal.reconcile()
+        assert len(notes(journal)) == 1
+
+        db.on_rpc = None
+        assert await journal.reconcile() == 1
+        assert notes(journal) == set()
+
+    asyncio.run(scenario())
+
+
+def test_journal_is_not_locked_during_reconcile(db, journal):
+    async def scenario():
+        crashed = CounterBuffer(journal)
+        assert await crashed.hold("posts", POST_ID)
+
+        live = CounterBuffer(journal)
+        await journal.heartbeat(live.owner)
+
+        async def hold_meanwhile():
+            # Would wait on the SQLite busy timeout if the journal stayed locked
+            assert await live.hold("posts", OTHER_POST_ID)
+
+        db.on_rpc = hold_meanwhile
+        assert await journal.reconcile() == 1
+        assert (live.owner, "posts", OTHER_POST_ID) in notes(journal)
+
+    asyncio.run(scenario())
+
+
+def test_row_held_during_reconcile_is_recomputed_again(db, journal):
+    async def scenario():
+        crashed = CounterBuffer(journal)
+        assert await crashed.hold("posts", POST_ID)
+
+        live = CounterBuffer(journal)
+        await journal.heartbeat(live.owner)
+
+        async def vote_meanwhile():
+            assert await live.hold("posts", POST_ID)
+            live.add("posts", POST_ID, {"upvotes": 1})
+
+        db.on_rpc = vote_meanwhile
+        # The recompute may already include the vote its delta will add again
+        assert await journal.reconcile() == 0
+        db.on_rpc = None
+        assert (crashed.owner, "posts", POST_ID) in notes(journal)
+
+        # Not while the live worker still holds the row...
+        assert await journal.reconcile() == 0
+        await live.flush()
+        # ...but once its delta is written
+        assert await journal.reconcile() == 1
+        assert reconciled(db) == [("posts", POST_ID)] * 2
+        assert notes(journal) == set()
+
+    asyncio.run(scenario())
+
+
+def test_missing_targets_are_not_journaled(db, journal):
+    async def scenario():
+        buffer = CounterBuffer(journal)
+        assert not await buffer.hold("posts", "not-a-uuid")
+        assert not await buffer.hold("votes", POST_ID)
+        assert notes(journal) == set()
+
+        # Holding takes no query; a write that finds no row releases it
+        missing = str(uuid.uuid4())
+        assert await buffer.hold("posts", missing)
+        await buffer.release("posts", missing)
+        assert notes(journal) == set()
+        assert db.rpcs == []
+
+    asyncio.run(scenario())
+
+
+def test_release_keeps_rows_with_buffered_deltas(db, journal):
+    async def scenario():
+        buffer = CounterBuffer(journal)
+        assert await buffer.hold("posts", POST_ID)
+        buffer.add("posts", POST_ID, {"upvotes": 1})
+        await buffer.release("posts", POST_ID)
+        assert notes(journal) == {(buffer.owner, "posts", POST_ID)}
+
+    asyncio.run(scenario())
+
+
+def test_invalid_journal_rows_do_not_block_the_batch(db, journal):
+    async def scenario():
+        crashed = CounterBuffer(journal)
+        assert await crashed.hold("posts", POST_ID)
+        await journal.mark(crashed.owner, [("posts", "not-a-uuid"), ("users", OTHER_POST_ID)])
+
+        assert await journal.reconcile() == 3
+        assert reconciled(db) == [("posts", POST_ID)]
+        assert notes(journal) == set()
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+# Keyset cursors: a cursor round-trips for its own sort, and anything that
+# would fail later, when its key is compared with real keys, is a 400 up front.
+from fastapi import HTTPException
+from services.pagination_service import decode_cursor, encode_cursor
+import base64
+import json
+import uuid
+
+import pytest
+
+ROW_ID = str(uuid.uuid4())
+
+
+def raw_cursor(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("hot", 12.5),
+    ("top", -3),
+    ("comments_best", 0.25),
+    ("new", "2026-10-19T08:30:00.123456+00:00"),
+    ("comments_new", "2026-10-19T08:30:00Z"),
+])
+def test_round_trip(sort, key):
+    assert decode_cursor(encode_cursor(sort, key, ROW_ID), sort) == (key, ROW_ID)
+
+
+def test_no_cursor():
+    assert decode_cursor(None, "hot") is None
+    assert decode_cursor("", "hot") is None
+
+
+@pytest.mark.parametrize("sort, payload", [
+    ("hot", {"s": "top", "k": 1, "id": ROW_ID}),
+    ("hot", {"s": "hot", "k": "x", "id": ROW_ID}),
+    ("hot", {"s": "hot", "k": True, "id": ROW_ID}),
+    ("hot", {"s": "hot", "k": None, "id": ROW_ID}),
+    ("hot", {"s": "hot", "k": 1, "id": 1}),
+    ("hot", {"s": "hot", "k": 1, "id": "not-a-uuid"}),
+    ("hot", {"s": "hot", "k": 1}),
+    ("new", {"s": "new", "k": 1, "id": ROW_ID}),
+    ("new", {"s": "new", "k": "yesterday", "id": ROW_ID}),
+    ("comments_new", {"s": "comments_new", "k": [2026], "id": ROW_ID}),
+])
+def test_rejects_mismatched_cursor(sort, payload):
+    with pytest.raises(HTTPException) as raised:
+        decode_cursor(raw_cursor(payload), sort)
+    assert raised.value.status_code == 400
+
+
+def test_rejects_garbage():
+    with pytest.raises(HTTPException):
+        decode_cursor("not base64 json!", "hot")
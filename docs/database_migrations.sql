@@ -0,0 +1,1030 @@
+-- X-Repo incremental migrations
+-- Run these in the Supabase SQL Editor after database_schema.sql, in order.
+-- Every statement is idempotent, so re-running the file is safe.
+
+-- ============================================================
+-- Keyset (cursor) pagination
+-- Every cursor-paginated list orders by (sort_key, id), so each needs a
+-- matching composite index for "rows after the cursor" to be an index range scan.
+-- ============================================================
+CREATE INDEX IF NOT EXISTS idx_posts_created_at_id ON posts(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_community_created_at_id ON posts(community_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_upvotes_id ON posts(upvotes DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_community_upvotes_id ON posts(community_id, upvotes DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_notifications_recipient_created_at_id ON notifications(recipient_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_bookmarks_user_created_at_id ON bookmarks(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_reports_status_created_at_id ON reports(status, created_at DESC, id DESC);
+
+-- ============================================================
+-- Maintained counters (count service)
+-- List totals are read from these instead of counting rows per request.
+-- posts.comment_count is maintained by the API; the counters below are kept
+-- by triggers so every write path (API, dashboard, jobs) stays in step.
+-- ============================================================
+ALTER TABLE communities ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION maintain_community_post_count()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE communities SET post_count = post_count + 1 WHERE id = NEW.community_id;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE communities SET post_count = GREATEST(post_count - 1, 0) WHERE id = OLD.community_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_community_post_count ON posts;
+CREATE TRIGGER posts_community_post_count
+AFTER INSERT OR DELETE ON posts
+FOR EACH ROW EXECUTE FUNCTION maintain_community_post_count();
+
+CREATE TABLE IF NOT EXISTS notification_counters (
+  user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+  total_count INTEGER NOT NULL DEFAULT 0,
+  unread_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION maintain_notification_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO notification_counters (user_id, total_count, unread_count)
+    VALUES (NEW.recipient_id, 1, CASE WHEN NEW.is_read THEN 0 ELSE 1 END)
+    ON CONFLICT (user_id) DO UPDATE SET
+      total_count = notification_counters.total_count + 1,
+      unread_count = notification_counters.unread_count + EXCLUDED.unread_count;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE notification_counters SET
+      total_count = GREATEST(total_count - 1, 0),
+      unread_count = GREATEST(unread_count - CASE WHEN OLD.is_read THEN 0 ELSE 1 END, 0)
+    WHERE user_id = OLD.recipient_id;
+  ELSIF NEW.is_read IS DISTINCT FROM OLD.is_read THEN
+    UPDATE notification_counters SET
+      unread_count = GREATEST(unread_count + CASE WHEN NEW.is_read THEN -1 ELSE 1 END, 0)
+    WHERE user_id = NEW.recipient_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notifications_counters ON notifications;
+CREATE TRIGGER notifications_counters
+AFTER INSERT OR DELETE OR UPDATE OF is_read ON notifications
+FOR EACH ROW EXECUTE FUNCTION maintain_notification_counters();
+
+-- Backfill (and repair) the counters from the current rows
+UPDATE communities c SET post_count = (SELECT COUNT(*) FROM posts p WHERE p.community_id = c.id);
+
+INSERT INTO notification_counters (user_id, total_count, unread_count)
+SELECT recipient_id, COUNT(*), COUNT(*) FILTER (WHERE NOT is_read)
+FROM notifications
+GROUP BY recipient_id
+ON CONFLICT (user_id) DO UPDATE SET
+  total_count = EXCLUDED.total_count,
+  unread_count = EXCLUDED.unread_count;
+
+ALTER TABLE notification_counters ENABLE ROW LEVEL SECURITY;
+
+-- ============================================================
+-- Persisted ranking scores
+-- hot_score and controversy_score are recomputed by a trigger whenever a
+-- post's votes change, so hot/controversial feeds are indexed top-k reads.
+-- hot_score is anchored to a fixed epoch (Reddit-style): newer posts get a
+-- higher base, which decays older posts relative to them without rewriting
+-- stored scores as time passes.
+-- ============================================================
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS hot_score DOUBLE PRECISION NOT NULL DEFAULT 0;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS controversy_score DOUBLE PRECISION NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION post_hot_score(upvotes INTEGER, downvotes INTEGER, created_at TIMESTAMPTZ)
+RETURNS DOUBLE PRECISION AS $$
+  SELECT ROUND((
+    SIGN(COALESCE(upvotes, 0) - COALESCE(downvotes, 0))
+      * LOG(GREATEST(ABS(COALESCE(upvotes, 0) - COALESCE(downvotes, 0)), 1))
+    + (EXTRACT(EPOCH FROM created_at) - 1134028003) / 45000
+  )::NUMERIC, 7)::DOUBLE PRECISION;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION post_controversy_score(upvotes INTEGER, downvotes INTEGER)
+RETURNS DOUBLE PRECISION AS $$
+  -- Vote volume weighted by balance: 1 at a 50/50 split, 0 when one-sided
+  SELECT CASE WHEN COALESCE(upvotes, 0) + COALESCE(downvotes, 0) = 0 THEN 0
+    ELSE (1 - ABS(0.5 - COALESCE(upvotes, 0)::DOUBLE PRECISION / (COALESCE(upvotes, 0) + COALESCE(downvotes, 0))) * 2)
+      * (COALESCE(upvotes, 0) + COALESCE(downvotes, 0))
+  END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION maintain_post_scores()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.hot_score := post_hot_score(NEW.upvotes, NEW.downvotes, NEW.created_at);
+  NEW.controversy_score := post_controversy_score(NEW.upvotes, NEW.downvotes);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_scores ON posts;
+CREATE TRIGGER posts_scores
+BEFORE INSERT OR UPDATE OF upvotes, downvotes, created_at ON posts
+FOR EACH ROW EXECUTE FUNCTION maintain_post_scores();
+
+-- Backfill existing rows (also re-run after changing either score function)
+UPDATE posts SET
+  hot_score = post_hot_score(upvotes, downvotes, created_at),
+  controversy_score = post_controversy_score(upvotes, downvotes);
+
+CREATE INDEX IF NOT EXISTS idx_posts_hot_id ON posts(hot_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_community_hot_id ON posts(community_id, hot_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_controversy_id ON posts(controversy_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_community_controversy_id ON posts(community_id, controversy_score DESC, id DESC);
+
+-- ============================================================
+-- Net score and "top" leaderboards
+-- Top ranks by net score (upvotes - downvotes). All-time top reads the
+-- (community_id, net_score) index; day/week/month/year top read
+-- post_leaderboards, which holds the posts of the last 1/7/30/365 days (the
+-- same rolling windows the other feeds filter on), maintained from post
+-- creation and vote count changes. Reads filter on created_at; rows that fall
+-- out of their window are pruned periodically (prune_post_leaderboards()).
+-- bucket_start is the calendar bucket the first version read; it is still
+-- filled but no longer read.
+-- ============================================================
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS net_score INTEGER
+  GENERATED ALWAYS AS (COALESCE(upvotes, 0) - COALESCE(downvotes, 0)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_posts_net_score_id ON posts(net_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_community_net_score_id ON posts(community_id, net_score DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS post_leaderboards (
+  period TEXT NOT NULL CHECK (period IN ('day', 'week', 'month', 'year')),
+  bucket_start TIMESTAMPTZ NOT NULL,
+  post_id UUID NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+  community_id UUID NOT NULL,
+  net_score INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (period, post_id)
+);
+
+ALTER TABLE post_leaderboards ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ;
+UPDATE post_leaderboards l SET created_at = p.created_at
+FROM posts p
+WHERE p.id = l.post_id AND l.created_at IS NULL;
+ALTER TABLE post_leaderboards ALTER COLUMN created_at SET NOT NULL;
+
+-- How far back each period reaches; must match TIME_RANGES in ranking_service.py
+CREATE OR REPLACE FUNCTION leaderboard_window(p_period TEXT)
+RETURNS INTERVAL AS $$
+  SELECT CASE p_period
+    WHEN 'day' THEN INTERVAL '1 day'
+    WHEN 'week' THEN INTERVAL '7 days'
+    WHEN 'month' THEN INTERVAL '30 days'
+    WHEN 'year' THEN INTERVAL '365 days'
+  END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Top-k by net score within a period; the few rows past their window are skipped by the created_at filter
+DROP INDEX IF EXISTS idx_post_leaderboards_global;
+DROP INDEX IF EXISTS idx_post_leaderboards_community;
+CREATE INDEX IF NOT EXISTS idx_post_leaderboards_period
+  ON post_leaderboards(period, net_score DESC, post_id DESC);
+CREATE INDEX IF NOT EXISTS idx_post_leaderboards_period_community
+  ON post_leaderboards(period, community_id, net_score DESC, post_id DESC);
+
+CREATE OR REPLACE FUNCTION maintain_post_leaderboards()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO post_leaderboards (period, bucket_start, post_id, community_id, net_score, created_at)
+    SELECT period, date_trunc(period, NEW.created_at), NEW.id, NEW.community_id,
+           COALESCE(NEW.upvotes, 0) - COALESCE(NEW.downvotes, 0), NEW.created_at
+    FROM unnest(ARRAY['day', 'week', 'month', 'year']) AS period
+    WHERE NEW.created_at >= now() - leaderboard_window(period)
+    ON CONFLICT (period, post_id) DO NOTHING;
+  ELSE
+    UPDATE post_leaderboards
+    SET net_score = COALESCE(NEW.upvotes, 0) - COALESCE(NEW.downvotes, 0)
+    WHERE post_id = NEW.id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_leaderboards ON posts;
+CREATE TRIGGER posts_leaderboards
+AFTER INSERT OR UPDATE OF upvotes, downvotes ON posts
+FOR EACH ROW EXECUTE FUNCTION maintain_post_leaderboards();
+
+CREATE OR REPLACE FUNCTION prune_post_leaderboards()
+RETURNS INTEGER AS $$
+  WITH pruned AS (
+    DELETE FROM post_leaderboards
+    WHERE created_at < now() - leaderboard_window(period)
+    RETURNING 1
+  )
+  SELECT COUNT(*)::INTEGER FROM pruned;
+$$ LANGUAGE sql;
+
+-- Backfill the current windows
+INSERT INTO post_leaderboards (period, bucket_start, post_id, community_id, net_score, created_at)
+SELECT period, date_trunc(period, p.created_at), p.id, p.community_id, p.net_score, p.created_at
+FROM posts p
+CROSS JOIN unnest(ARRAY['day', 'week', 'month', 'year']) AS period
+WHERE p.created_at >= now() - leaderboard_window(period)
+ON CONFLICT (period, post_id) DO UPDATE SET net_score = EXCLUDED.net_score;
+
+ALTER TABLE post_leaderboards ENABLE ROW LEVEL SECURITY;
+
+-- ============================================================
+-- Single-call voting
+-- cast_vote() toggles a user's vote on a post or comment and applies the
+-- exact counter delta in one transaction, returning the new totals (and, for
+-- posts, the recomputed scores), along with the author's karma (see Maintained
+-- user karma below). The target row is locked for the duration, so concurrent
+-- clicks serialize instead of double counting. Returns NULL when the target
+-- does not exist.
+-- ============================================================
+-- Toggles the vote row only: a repeat of the current vote removes it, the
+-- other type replaces it. Returns the vote before and after (NULL for none).
+CREATE OR REPLACE FUNCTION toggle_vote(p_user_id UUID, p_votable_type TEXT, p_votable_id UUID, p_vote_type TEXT,
+                                       OUT previous TEXT, OUT current TEXT) AS $$
+BEGIN
+  LOOP
+    INSERT INTO votes (user_id, votable_type, votable_id, vote_type)
+    VALUES (p_user_id, p_votable_type, p_votable_id, p_vote_type)
+    ON CONFLICT (user_id, votable_type, votable_id) DO NOTHING;
+    IF FOUND THEN
+      current := p_vote_type;
+      EXIT;
+    END IF;
+
+    SELECT vote_type INTO previous FROM votes
+    WHERE user_id = p_user_id AND votable_type = p_votable_type AND votable_id = p_votable_id
+    FOR UPDATE;
+    IF FOUND THEN
+      IF previous = p_vote_type THEN
+        DELETE FROM votes
+        WHERE user_id = p_user_id AND votable_type = p_votable_type AND votable_id = p_votable_id;
+      ELSE
+        UPDATE votes SET vote_type = p_vote_type
+        WHERE user_id = p_user_id AND votable_type = p_votable_type AND votable_id = p_votable_id;
+        current := p_vote_type;
+      END IF;
+      EXIT;
+    END IF;
+    -- The conflicting vote was removed by a concurrent call; try again
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION cast_vote(p_user_id UUID, p_votable_type TEXT, p_votable_id UUID, p_vote_type TEXT)
+RETURNS JSONB AS $$
+DECLARE
+  previous TEXT;
+  current TEXT;
+  up_delta INTEGER;
+  down_delta INTEGER;
+  totals JSONB;
+  author UUID;
+  old_net INTEGER;
+BEGIN
+  IF p_votable_type = 'post' THEN
+    SELECT user_id, COALESCE(upvotes, 0) - COALESCE(downvotes, 0) INTO author, old_net
+    FROM posts WHERE id = p_votable_id FOR UPDATE;
+  ELSE
+    SELECT user_id, COALESCE(upvotes, 0) - COALESCE(downvotes, 0) INTO author, old_net
+    FROM comments WHERE id = p_votable_id FOR UPDATE;
+  END IF;
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT t.previous, t.current INTO previous, current
+  FROM toggle_vote(p_user_id, p_votable_type, p_votable_id, p_vote_type) t;
+
+  up_delta := (current IS NOT DISTINCT FROM 'upvote')::INTEGER - (previous IS NOT DISTINCT FROM 'upvote')::INTEGER;
+  down_delta := (current IS NOT DISTINCT FROM 'downvote')::INTEGER - (previous IS NOT DISTINCT FROM 'downvote')::INTEGER;
+
+  IF p_votable_type = 'post' THEN
+    UPDATE posts SET
+      upvotes = GREATEST(COALESCE(upvotes, 0) + up_delta, 0),
+      downvotes = GREATEST(COALESCE(downvotes, 0) + down_delta, 0)
+    WHERE id = p_votable_id
+    RETURNING jsonb_build_object(
+      'id', id, 'community_id', community_id, 'upvotes', upvotes, 'downvotes', downvotes,
+      'hot_score', hot_score, 'net_score', net_score, 'controversy_score', controversy_score
+    ) INTO totals;
+  ELSE
+    UPDATE comments SET
+      upvotes = GREATEST(COALESCE(upvotes, 0) + up_delta, 0),
+      downvotes = GREATEST(COALESCE(downvotes, 0) + down_delta, 0)
+    WHERE id = p_votable_id
+    RETURNING jsonb_build_object('id', id, 'upvotes', upvotes, 'downvotes', downvotes) INTO totals;
+  END IF;
+
+  IF (totals->>'upvotes')::INTEGER - (totals->>'downvotes')::INTEGER <> old_net THEN
+    IF p_votable_type = 'post' THEN
+      UPDATE users SET post_karma = post_karma + (totals->>'upvotes')::INTEGER - (totals->>'downvotes')::INTEGER - old_net
+      WHERE id = author;
+    ELSE
+      UPDATE users SET comment_karma = comment_karma + (totals->>'upvotes')::INTEGER - (totals->>'downvotes')::INTEGER - old_net
+      WHERE id = author;
+    END IF;
+  END IF;
+
+  RETURN totals || jsonb_build_object('vote_type', current);
+END;
+$$ LANGUAGE plpgsql;
+
+-- They take the voter's id as an argument, so only the backend (service role) may call them
+REVOKE EXECUTE ON FUNCTION toggle_vote(UUID, TEXT, UUID, TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION cast_vote(UUID, TEXT, UUID, TEXT) FROM PUBLIC, anon, authenticated;
+
+-- ============================================================
+-- Write-behind counters
+-- With the backend's counter buffer on (COUNTER_BUFFER), record_vote() writes
+-- only the vote row and returns the counter delta; the backend accumulates
+-- deltas per row and applies them in batches with apply_counter_deltas(), so
+-- a burst of votes on one post takes its row lock once per flush rather than
+-- once per vote. Authors' karma moves in the same statement, summed per author,
+-- so a flush updates each author's users row once. reconcile_counters()
+-- recomputes counters from the rows they count (votes, comments,
+-- project_stars) after a worker died with deltas still buffered.
+-- ============================================================
+CREATE OR REPLACE FUNCTION record_vote(p_user_id UUID, p_votable_type TEXT, p_votable_id UUID, p_vote_type TEXT)
+RETURNS JSONB AS $$
+DECLARE
+  previous TEXT;
+  current TEXT;
+  stored JSONB;
+BEGIN
+  IF p_votable_type = 'post' THEN
+    SELECT jsonb_build_object('id', id, 'community_id', community_id, 'upvotes', COALESCE(upvotes, 0), 'downvotes', COALESCE(downvotes, 0))
+    INTO stored FROM posts WHERE id = p_votable_id;
+  ELSE
+    SELECT jsonb_build_object('id', id, 'upvotes', COALESCE(upvotes, 0), 'downvotes', COALESCE(downvotes, 0))
+    INTO stored FROM comments WHERE id = p_votable_id;
+  END IF;
+  IF stored IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT t.previous, t.current INTO previous, current
+  FROM toggle_vote(p_user_id, p_votable_type, p_votable_id, p_vote_type) t;
+
+  RETURN stored || jsonb_build_object(
+    'vote_type', current,
+    'up_delta', (current IS NOT DISTINCT FROM 'upvote')::INTEGER - (previous IS NOT DISTINCT FROM 'upvote')::INTEGER,
+    'down_delta', (current IS NOT DISTINCT FROM 'downvote')::INTEGER - (previous IS NOT DISTINCT FROM 'downvote')::INTEGER
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE EXECUTE ON FUNCTION record_vote(UUID, TEXT, UUID, TEXT) FROM PUBLIC, anon, authenticated;
+
+-- p_deltas: [{"target": "posts", "id": ..., "upvotes": 3, "downvotes": -1, "comment_count": 0}, ...]
+-- Returns the updated posts with their scores, for the ranking index.
+CREATE OR REPLACE FUNCTION apply_counter_deltas(p_deltas JSONB)
+RETURNS JSONB AS $$
+DECLARE
+  result JSONB;
+BEGIN
+  -- Lock the rows in a fixed order, so concurrent flushes from several workers cannot deadlock
+  PERFORM 1 FROM posts WHERE id IN (
+    SELECT (d->>'id')::UUID FROM jsonb_array_elements(p_deltas) d WHERE d->>'target' = 'posts'
+  ) ORDER BY id FOR UPDATE;
+  PERFORM 1 FROM comments WHERE id IN (
+    SELECT (d->>'id')::UUID FROM jsonb_array_elements(p_deltas) d WHERE d->>'target' = 'comments'
+  ) ORDER BY id FOR UPDATE;
+  PERFORM 1 FROM projects WHERE id IN (
+    SELECT (d->>'id')::UUID FROM jsonb_array_elements(p_deltas) d WHERE d->>'target' = 'projects'
+  ) ORDER BY id FOR UPDATE;
+  -- Then the authors, whose karma moves with the vote counts
+  PERFORM 1 FROM users WHERE id IN (
+    SELECT p.user_id FROM posts p JOIN jsonb_array_elements(p_deltas) d
+      ON d->>'target' = 'posts' AND p.id = (d->>'id')::UUID
+    UNION
+    SELECT c.user_id FROM comments c JOIN jsonb_array_elements(p_deltas) d
+      ON d->>'target' = 'comments' AND c.id = (d->>'id')::UUID
+  ) ORDER BY id FOR UPDATE;
+
+  WITH deltas AS (
+    SELECT target, id,
+           COALESCE(upvotes, 0) AS upvotes, COALESCE(downvotes, 0) AS downvotes,
+           COALESCE(comment_count, 0) AS comment_count, COALESCE(star_count, 0) AS star_count
+    FROM jsonb_to_recordset(p_deltas)
+      AS d(target TEXT, id UUID, upvotes INTEGER, downvotes INTEGER, comment_count INTEGER, star_count INTEGER)
+  ),
+  -- Sub-statements share one snapshot, so these read the locked rows before the updates below
+  old_posts AS (
+    SELECT p.id, COALESCE(p.upvotes, 0) - COALESCE(p.downvotes, 0) AS net
+    FROM posts p JOIN deltas d ON d.target = 'posts' AND p.id = d.id
+  ),
+  old_comments AS (
+    SELECT c.id, COALESCE(c.upvotes, 0) - COALESCE(c.downvotes, 0) AS net
+    FROM comments c JOIN deltas d ON d.target = 'comments' AND c.id = d.id
+  ),
+  updated_posts AS (
+    UPDATE posts p SET
+      upvotes = GREATEST(COALESCE(p.upvotes, 0) + d.upvotes, 0),
+      downvotes = GREATEST(COALESCE(p.downvotes, 0) + d.downvotes, 0),
+      comment_count = GREATEST(COALESCE(p.comment_count, 0) + d.comment_count, 0)
+    FROM deltas d
+    WHERE d.target = 'posts' AND p.id = d.id
+    RETURNING p.id, p.user_id, p.community_id, p.upvotes, p.downvotes, p.comment_count, p.hot_score, p.net_score, p.controversy_score
+  ),
+  updated_comments AS (
+    UPDATE comments c SET
+      upvotes = GREATEST(COALESCE(c.upvotes, 0) + d.upvotes, 0),
+      downvotes = GREATEST(COALESCE(c.downvotes, 0) + d.downvotes, 0)
+    FROM deltas d
+    WHERE d.target = 'comments' AND c.id = d.id
+    RETURNING c.id, c.user_id, c.upvotes - c.downvotes AS net
+  ),
+  updated_projects AS (
+    UPDATE projects pr SET star_count = GREATEST(COALESCE(pr.star_count, 0) + d.star_count, 0)
+    FROM deltas d
+    WHERE d.target = 'projects' AND pr.id = d.id
+    RETURNING pr.id
+  ),
+  karma AS (
+    SELECT user_id, SUM(post_delta) AS post_delta, SUM(comment_delta) AS comment_delta
+    FROM (
+      SELECT u.user_id, (u.upvotes - u.downvotes) - o.net AS post_delta, 0 AS comment_delta
+      FROM updated_posts u JOIN old_posts o ON o.id = u.id
+      UNION ALL
+      SELECT u.user_id, 0, u.net - o.net
+      FROM updated_comments u JOIN old_comments o ON o.id = u.id
+    ) changes
+    GROUP BY user_id
+  ),
+  updated_authors AS (
+    UPDATE users SET
+      post_karma = users.post_karma + k.post_delta,
+      comment_karma = users.comment_karma + k.comment_delta
+    FROM karma k
+    WHERE users.id = k.user_id AND (k.post_delta <> 0 OR k.comment_delta <> 0)
+    RETURNING users.id
+  )
+  SELECT jsonb_build_object(
+    'posts', COALESCE((SELECT jsonb_agg(to_jsonb(u) - 'user_id') FROM updated_posts u), '[]'::jsonb),
+    'comments', (SELECT COUNT(*) FROM updated_comments),
+    'projects', (SELECT COUNT(*) FROM updated_projects)
+  ) INTO result;
+  RETURN result;
+END;
+$$ LANGUAGE plpgsql;
+
+-- p_targets: [{"target": "posts", "id": ...}, ...]; returns the number of rows rewritten.
+-- Authors' karma moves by the same correction.
+CREATE OR REPLACE FUNCTION reconcile_counters(p_targets JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+  rewritten INTEGER;
+BEGIN
+  -- Same lock order as apply_counter_deltas()
+  PERFORM 1 FROM posts WHERE id IN (
+    SELECT (t->>'id')::UUID FROM jsonb_array_elements(p_targets) t WHERE t->>'target' = 'posts'
+  ) ORDER BY id FOR UPDATE;
+  PERFORM 1 FROM comments WHERE id IN (
+    SELECT (t->>'id')::UUID FROM jsonb_array_elements(p_targets) t WHERE t->>'target' = 'comments'
+  ) ORDER BY id FOR UPDATE;
+  PERFORM 1 FROM projects WHERE id IN (
+    SELECT (t->>'id')::UUID FROM jsonb_array_elements(p_targets) t WHERE t->>'target' = 'projects'
+  ) ORDER BY id FOR UPDATE;
+  PERFORM 1 FROM users WHERE id IN (
+    SELECT p.user_id FROM posts p JOIN jsonb_array_elements(p_targets) t
+      ON t->>'target' = 'posts' AND p.id = (t->>'id')::UUID
+    UNION
+    SELECT c.user_id FROM comments c JOIN jsonb_array_elements(p_targets) t
+      ON t->>'target' = 'comments' AND c.id = (t->>'id')::UUID
+  ) ORDER BY id FOR UPDATE;
+
+  WITH targets AS (
+    SELECT DISTINCT target, id FROM jsonb_to_recordset(p_targets) AS t(target TEXT, id UUID)
+  ),
+  old_posts AS (
+    SELECT p.id, COALESCE(p.upvotes, 0) - COALESCE(p.downvotes, 0) AS net
+    FROM posts p JOIN targets t ON t.target = 'posts' AND p.id = t.id
+  ),
+  old_comments AS (
+    SELECT c.id, COALESCE(c.upvotes, 0) - COALESCE(c.downvotes, 0) AS net
+    FROM comments c JOIN targets t ON t.target = 'comments' AND c.id = t.id
+  ),
+  reconciled_posts AS (
+    UPDATE posts p SET
+      upvotes = (SELECT COUNT(*) FROM votes v WHERE v.votable_type = 'post' AND v.votable_id = p.id AND v.vote_type = 'upvote'),
+      downvotes = (SELECT COUNT(*) FROM votes v WHERE v.votable_type = 'post' AND v.votable_id = p.id AND v.vote_type = 'downvote'),
+      comment_count = (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id)
+    FROM targets t
+    WHERE t.target = 'posts' AND p.id = t.id
+    RETURNING p.id, p.user_id, p.upvotes - p.downvotes AS net
+  ),
+  reconciled_comments AS (
+    UPDATE comments c SET
+      upvotes = (SELECT COUNT(*) FROM votes v WHERE v.votable_type = 'comment' AND v.votable_id = c.id AND v.vote_type = 'upvote'),
+      downvotes = (SELECT COUNT(*) FROM votes v WHERE v.votable_type = 'comment' AND v.votable_id = c.id AND v.vote_type = 'downvote')
+    FROM targets t
+    WHERE t.target = 'comments' AND c.id = t.id
+    RETURNING c.id, c.user_id, c.upvotes - c.downvotes AS net
+  ),
+  reconciled_projects AS (
+    UPDATE projects pr SET star_count = (SELECT COUNT(*) FROM project_stars s WHERE s.project_id = pr.id)
+    FROM targets t
+    WHERE t.target = 'projects' AND pr.id = t.id
+    RETURNING 1
+  ),
+  karma AS (
+    SELECT user_id, SUM(post_delta) AS post_delta, SUM(comment_delta) AS comment_delta
+    FROM (
+      SELECT r.user_id, r.net - o.net AS post_delta, 0 AS comment_delta
+      FROM reconciled_posts r JOIN old_posts o ON o.id = r.id
+      UNION ALL
+      SELECT r.user_id, 0, r.net - o.net
+      FROM reconciled_comments r JOIN old_comments o ON o.id = r.id
+    ) changes
+    GROUP BY user_id
+  ),
+  corrected_authors AS (
+    UPDATE users SET
+      post_karma = users.post_karma + k.post_delta,
+      comment_karma = users.comment_karma + k.comment_delta
+    FROM karma k
+    WHERE users.id = k.user_id AND (k.post_delta <> 0 OR k.comment_delta <> 0)
+    RETURNING users.id
+  )
+  SELECT ((SELECT COUNT(*) FROM reconciled_posts) + (SELECT COUNT(*) FROM reconciled_comments)
+          + (SELECT COUNT(*) FROM reconciled_projects))::INTEGER
+  INTO rewritten;
+  RETURN rewritten;
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE EXECUTE ON FUNCTION apply_counter_deltas(JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION reconcile_counters(JSONB) FROM PUBLIC, anon, authenticated;
+
+-- ============================================================
+-- Maintained user karma
+-- users.post_karma / comment_karma hold the net score of everything a user
+-- wrote, so reputation is a single-row read. Vote count changes move them
+-- where the counts are written: cast_vote() per vote, apply_counter_deltas()
+-- once per author per flush, reconcile_counters() by its correction. A
+-- trigger covers posts and comments being created or deleted; it does not
+-- fire on vote count updates, so a burst of votes does not update the
+-- author's row once per vote.
+-- reconcile_user_karma() recomputes karma from posts and comments, a batch
+-- of users at a time in id order, to fix any drift; the backend runs a pass
+-- every KARMA_RECONCILE_INTERVAL_SECONDS.
+-- ============================================================
+ALTER TABLE users ADD COLUMN IF NOT EXISTS post_karma INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS comment_karma INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION maintain_user_karma()
+RETURNS TRIGGER AS $$
+DECLARE
+  karma_column TEXT := CASE WHEN TG_TABLE_NAME = 'posts' THEN 'post_karma' ELSE 'comment_karma' END;
+  delta INTEGER;
+  author UUID;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    author := NEW.user_id;
+    delta := COALESCE(NEW.upvotes, 0) - COALESCE(NEW.downvotes, 0);
+  ELSE
+    author := OLD.user_id;
+    delta := -(COALESCE(OLD.upvotes, 0) - COALESCE(OLD.downvotes, 0));
+  END IF;
+
+  IF delta <> 0 THEN
+    EXECUTE format('UPDATE users SET %I = %I + $1 WHERE id = $2', karma_column, karma_column) USING delta, author;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_user_karma ON posts;
+CREATE TRIGGER posts_user_karma
+AFTER INSERT OR DELETE ON posts
+FOR EACH ROW EXECUTE FUNCTION maintain_user_karma();
+
+DROP TRIGGER IF EXISTS comments_user_karma ON comments;
+CREATE TRIGGER comments_user_karma
+AFTER INSERT OR DELETE ON comments
+FOR EACH ROW EXECUTE FUNCTION maintain_user_karma();
+
+-- Where the current reconciliation pass has got to (after_id), and when the
+-- last one finished. A single row.
+CREATE TABLE IF NOT EXISTS karma_reconcile_state (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  after_id UUID,
+  finished_at TIMESTAMP WITH TIME ZONE
+);
+
+INSERT INTO karma_reconcile_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+ALTER TABLE karma_reconcile_state ENABLE ROW LEVEL SECURITY;
+
+-- Replaced by the batched version below
+DROP FUNCTION IF EXISTS reconcile_user_karma();
+
+-- Reconciles the next p_limit users (by id) of the current pass, starting a
+-- new pass when the last finished over p_interval_seconds ago. Returns
+-- {"status", "corrected"}: "more" while the pass has users left, "done" when
+-- it finished, "idle" between passes, and "busy" when another worker is
+-- running a batch (it carries the pass on, so the caller stops). Workers
+-- share one pass, and an advisory lock runs its batches one at a time.
+-- Corrections are applied as a delta against the value read with the sums,
+-- so votes that land while a batch runs are kept.
+CREATE OR REPLACE FUNCTION reconcile_user_karma(p_limit INTEGER, p_interval_seconds INTEGER)
+RETURNS JSONB AS $$
+DECLARE
+  state karma_reconcile_state;
+  batch_count INTEGER;
+  last_id UUID;
+  corrected_count INTEGER;
+BEGIN
+  IF NOT pg_try_advisory_xact_lock(hashtext('reconcile_user_karma')) THEN
+    RETURN jsonb_build_object('status', 'busy', 'corrected', 0);
+  END IF;
+
+  SELECT * INTO state FROM karma_reconcile_state WHERE id FOR UPDATE;
+  IF state.after_id IS NULL AND state.finished_at > NOW() - make_interval(secs => p_interval_seconds) THEN
+    RETURN jsonb_build_object('status', 'idle', 'corrected', 0);
+  END IF;
+
+  WITH batch AS (
+    SELECT id FROM users
+    WHERE state.after_id IS NULL OR id > state.after_id
+    ORDER BY id
+    LIMIT p_limit
+  ),
+  karma AS (
+    SELECT u.id,
+           u.post_karma AS stored_post_karma,
+           u.comment_karma AS stored_comment_karma,
+           COALESCE((
+             SELECT SUM(COALESCE(p.upvotes, 0) - COALESCE(p.downvotes, 0)) FROM posts p WHERE p.user_id = u.id
+           ), 0)::INTEGER AS post_karma,
+           COALESCE((
+             SELECT SUM(COALESCE(c.upvotes, 0) - COALESCE(c.downvotes, 0)) FROM comments c WHERE c.user_id = u.id
+           ), 0)::INTEGER AS comment_karma
+    FROM users u JOIN batch b ON b.id = u.id
+  ),
+  corrected AS (
+    UPDATE users u SET
+      post_karma = u.post_karma + (k.post_karma - k.stored_post_karma),
+      comment_karma = u.comment_karma + (k.comment_karma - k.stored_comment_karma)
+    FROM karma k
+    WHERE u.id = k.id
+      AND (k.stored_post_karma, k.stored_comment_karma) IS DISTINCT FROM (k.post_karma, k.comment_karma)
+    RETURNING 1
+  )
+  SELECT (SELECT COUNT(*) FROM batch), (SELECT id FROM batch ORDER BY id DESC LIMIT 1), (SELECT COUNT(*) FROM corrected)
+  INTO batch_count, last_id, corrected_count;
+
+  IF batch_count < p_limit THEN
+    UPDATE karma_reconcile_state SET after_id = NULL, finished_at = NOW() WHERE id;
+    RETURN jsonb_build_object('status', 'done', 'corrected', corrected_count);
+  END IF;
+  UPDATE karma_reconcile_state SET after_id = last_id WHERE id;
+  RETURN jsonb_build_object('status', 'more', 'corrected', corrected_count);
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE EXECUTE ON FUNCTION reconcile_user_karma(INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+
+-- Backfill
+DO $$
+BEGIN
+  UPDATE karma_reconcile_state SET after_id = NULL, finished_at = NULL WHERE id;
+  LOOP
+    EXIT WHEN reconcile_user_karma(5000, 0)->>'status' <> 'more';
+  END LOOP;
+END;
+$$;
+
+-- ============================================================
+-- Comment trees
+-- GET /api/comments/post/{post_id}/tree reads the comments one screen shows
+-- with comment_tree(): a bounded index read per level, whatever the size of
+-- the thread. Each sort ("best", "top", "new") has a persisted key and an
+-- index by (post, parent, key), so the top children of a parent are the first
+-- entries of one index range.
+-- ============================================================
+DROP INDEX IF EXISTS idx_comments_post_tree;
+
+-- Lower bound of the Wilson score interval for the upvote ratio, as wilson_scores() in ranking_service.py
+CREATE OR REPLACE FUNCTION comment_best_score(p_upvotes INTEGER, p_downvotes INTEGER)
+RETURNS DOUBLE PRECISION AS $$
+  SELECT CASE WHEN n > 0 THEN
+    (up / n + z * z / (2 * n) - z * sqrt((up / n * (1 - up / n) + z * z / (4 * n)) / n)) / (1 + z * z / n)
+  ELSE 0 END
+  FROM (SELECT COALESCE(p_upvotes, 0)::DOUBLE PRECISION AS up,
+               COALESCE(p_upvotes, 0)::DOUBLE PRECISION + COALESCE(p_downvotes, 0) AS n,
+               1.281551565545::DOUBLE PRECISION AS z) v;
+$$ LANGUAGE sql IMMUTABLE;
+
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS net_score INTEGER
+  GENERATED ALWAYS AS (COALESCE(upvotes, 0) - COALESCE(downvotes, 0)) STORED;
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS best_score DOUBLE PRECISION
+  GENERATED ALWAYS AS (comment_best_score(upvotes, downvotes)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_comments_tree_best ON comments(post_id, parent_comment_id, best_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_comments_tree_top ON comments(post_id, parent_comment_id, net_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_comments_tree_new ON comments(post_id, parent_comment_id, created_at DESC, id DESC);
+
+-- The first screen of a thread, as {"comments": [...], "siblings": n}:
+-- up to p_limit children of p_parent_id (top-level comments when NULL) after
+-- the cursor (p_after_key, p_after_id), then level by level up to p_replies
+-- children of each comment shown, parents in the order shown, down to p_depth
+-- levels and at most p_max_nodes comments in all. Each comment is
+-- {"id", "parent_comment_id", "key", "level", "reply_count"}; "siblings" counts
+-- the first level's comments after the cursor, shown or not. NULL when
+-- p_parent_id is not a comment of the post.
+CREATE OR REPLACE FUNCTION comment_tree(
+  p_post_id UUID, p_parent_id UUID, p_sort TEXT, p_after_key TEXT, p_after_id UUID,
+  p_limit INTEGER, p_depth INTEGER, p_replies INTEGER, p_max_nodes INTEGER
+) RETURNS JSONB AS $$
+DECLARE
+  key_column TEXT := CASE p_sort WHEN 'new' THEN 'created_at' WHEN 'top' THEN 'net_score' ELSE 'best_score' END;
+  key_type TEXT := CASE p_sort WHEN 'new' THEN 'timestamptz' WHEN 'top' THEN 'integer' ELSE 'double precision' END;
+  sibling_filter TEXT := CASE WHEN p_parent_id IS NULL THEN 'c.parent_comment_id IS NULL' ELSE 'c.parent_comment_id = $2' END;
+  after_filter TEXT := 'TRUE';
+  current_level INTEGER := 1;
+  budget INTEGER := p_max_nodes;
+  nodes JSONB;
+  shown JSONB;
+  siblings INTEGER;
+BEGIN
+  IF p_parent_id IS NOT NULL AND NOT EXISTS (
+    SELECT 1 FROM comments WHERE id = p_parent_id AND post_id = p_post_id
+  ) THEN
+    RETURN NULL;
+  END IF;
+  IF p_after_key IS NOT NULL THEN
+    after_filter := format('(c.%I, c.id) < ($3::%s, $4)', key_column, key_type);
+  END IF;
+
+  EXECUTE format(
+    'SELECT COALESCE(jsonb_agg(jsonb_build_object(''id'', c.id, ''parent_comment_id'', c.parent_comment_id, ''key'', c.key, ''level'', 1)
+                               ORDER BY c.key DESC, c.id DESC), ''[]'')
+     FROM (SELECT c.id, c.parent_comment_id, c.%1$I AS key FROM comments c
+           WHERE c.post_id = $1 AND %2$s AND %3$s
+           ORDER BY c.%1$I DESC, c.id DESC
+           LIMIT $5) c',
+    key_column, sibling_filter, after_filter)
+  INTO nodes USING p_post_id, p_parent_id, p_after_key, p_after_id, LEAST(p_limit, budget);
+
+  EXECUTE format('SELECT COUNT(*) FROM comments c WHERE c.post_id = $1 AND %s AND %s', sibling_filter, after_filter)
+  INTO siblings USING p_post_id, p_parent_id, p_after_key, p_after_id;
+
+  shown := nodes;
+  budget := budget - jsonb_array_length(shown);
+  WHILE current_level < p_depth AND p_replies > 0 AND budget > 0 AND jsonb_array_length(shown) > 0 LOOP
+    current_level := current_level + 1;
+    EXECUTE format(
+      'SELECT COALESCE(jsonb_agg(jsonb_build_object(''id'', r.id, ''parent_comment_id'', r.parent_comment_id, ''key'', r.key, ''level'', $5)
+                                 ORDER BY r.n), ''[]'')
+       FROM (SELECT k.id, k.parent_comment_id, k.key,
+                    row_number() OVER (ORDER BY p.ord, k.key DESC, k.id DESC) AS n
+             FROM jsonb_array_elements($1) WITH ORDINALITY AS p(node, ord)
+             CROSS JOIN LATERAL (
+               SELECT c.id, c.parent_comment_id, c.%1$I AS key FROM comments c
+               WHERE c.post_id = $2 AND c.parent_comment_id = (p.node->>''id'')::UUID
+               ORDER BY c.%1$I DESC, c.id DESC
+               LIMIT $3
+             ) k) r
+       WHERE r.n <= $4',
+      key_column)
+    INTO shown USING shown, p_post_id, p_replies, budget, current_level;
+    nodes := nodes || shown;
+    budget := budget - jsonb_array_length(shown);
+  END LOOP;
+
+  SELECT COALESCE(jsonb_agg(t.node || jsonb_build_object('reply_count', (
+           SELECT COUNT(*) FROM comments c
+           WHERE c.post_id = p_post_id AND c.parent_comment_id = (t.node->>'id')::UUID
+         )) ORDER BY t.ord), '[]')
+  INTO nodes
+  FROM jsonb_array_elements(nodes) WITH ORDINALITY AS t(node, ord);
+
+  RETURN jsonb_build_object('comments', nodes, 'siblings', siblings);
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- ============================================================
+-- Mention autocomplete
+-- GET /api/users/mentions/autocomplete matches username prefixes with LIKE,
+-- which the plain unique index cannot serve outside the C collation.
+-- ============================================================
+CREATE INDEX IF NOT EXISTS idx_users_username_pattern ON users(username text_pattern_ops);
+
+-- ============================================================
+-- Notification coalescing
+-- Notifications that carry a group_key (e.g. every reaction to one post)
+-- are merged at write time into the recipient's latest unread notification
+-- with the same key, if it is newer than the coalescing window: actor_count
+-- goes up, actors keeps the three most recent actors, the text is rewritten
+-- ("Alice and 41 others reacted ...") and the row moves to the top of the
+-- list. A merge inserts no row and leaves is_read alone, so the
+-- notification counters are unchanged by it.
+-- ============================================================
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS group_key TEXT;
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS actor_count INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS actors JSONB NOT NULL DEFAULT '[]'::jsonb;
+
+CREATE INDEX IF NOT EXISTS idx_notifications_unread_group
+  ON notifications(recipient_id, group_key, created_at DESC)
+  WHERE group_key IS NOT NULL AND NOT is_read;
+
+-- Inserts a batch of notifications (JSON rows; grouped rows also carry
+-- "action", the text after the actor names) and returns every row inserted
+-- or merged into, each with "merged": true|false. Rows whose id already
+-- exists, and grouped rows whose actor is already among the latest actors,
+-- are skipped, so a re-sent batch is harmless.
+CREATE OR REPLACE FUNCTION insert_notifications(p_rows JSONB, p_window_seconds INTEGER)
+RETURNS SETOF JSONB AS $$
+DECLARE
+  r JSONB;
+  actor JSONB;
+  target notifications;
+  saved notifications;
+BEGIN
+  FOR r IN SELECT value FROM jsonb_array_elements(p_rows) LOOP
+    IF EXISTS (SELECT 1 FROM notifications WHERE id = (r->>'id')::uuid) THEN
+      CONTINUE;
+    END IF;
+
+    target := NULL;
+    IF r->>'group_key' IS NOT NULL THEN
+      SELECT * INTO target FROM notifications n
+      WHERE n.recipient_id = (r->>'recipient_id')::uuid
+        AND n.group_key = r->>'group_key'
+        AND NOT n.is_read
+        AND n.created_at > NOW() - make_interval(secs => p_window_seconds)
+      ORDER BY n.created_at DESC
+      LIMIT 1
+      FOR UPDATE;
+    END IF;
+
+    IF target.id IS NULL THEN
+      INSERT INTO notifications SELECT * FROM jsonb_populate_record(NULL::notifications, r)
+      ON CONFLICT (id) DO NOTHING
+      RETURNING * INTO saved;
+      IF saved.id IS NOT NULL THEN
+        RETURN NEXT to_jsonb(saved) || jsonb_build_object('merged', false);
+      END IF;
+      CONTINUE;
+    END IF;
+
+    actor := r->'actors'->0;
+    IF actor IS NULL OR EXISTS (
+      SELECT 1 FROM jsonb_array_elements(target.actors) a WHERE a->>'id' = actor->>'id'
+    ) THEN
+      CONTINUE;
+    END IF;
+
+    UPDATE notifications SET
+      actor_count = target.actor_count + 1,
+      actors = (
+        SELECT COALESCE(jsonb_agg(a.value ORDER BY a.ordinality), '[]'::jsonb)
+        FROM jsonb_array_elements(jsonb_build_array(actor) || target.actors) WITH ORDINALITY a
+        WHERE a.ordinality <= 3
+      ),
+      actor_id = (r->>'actor_id')::uuid,
+      comment_id = (r->>'comment_id')::uuid,
+      title = r->>'title',
+      content = COALESCE(NULLIF(actor->>'display_name', ''), 'A user')
+        || CASE WHEN target.actor_count = 1 THEN ' and 1 other'
+                ELSE ' and ' || target.actor_count || ' others' END
+        || ' ' || COALESCE(r->>'action', ''),
+      created_at = NOW(),
+      updated_at = NOW()
+    WHERE id = target.id
+    RETURNING * INTO saved;
+    RETURN NEXT to_jsonb(saved) || jsonb_build_object('merged', true);
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE EXECUTE ON FUNCTION insert_notifications(JSONB, INTEGER) FROM PUBLIC, anon, authenticated;
+
+-- ============================================================
+-- Notification retention
+-- archive_notifications() moves read notifications older than the
+-- retention age into notifications_archive, a batch at a time, so the hot
+-- table only holds what users still look at. mark_all_notifications_read()
+-- touches only unread rows. Both adjust notification_counters once per
+-- recipient instead of once per row: while they run, the per-row counter
+-- trigger is switched off for the transaction.
+-- ============================================================
+CREATE TABLE IF NOT EXISTS notifications_archive (
+  id UUID PRIMARY KEY,
+  recipient_id UUID NOT NULL,
+  type TEXT NOT NULL,
+  title TEXT,
+  content TEXT,
+  post_id UUID,
+  comment_id UUID,
+  actor_id UUID,
+  actor_count INTEGER NOT NULL DEFAULT 1,
+  created_at TIMESTAMPTZ NOT NULL,
+  archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_notifications_archive_recipient_created_at
+  ON notifications_archive(recipient_id, created_at DESC);
+
+ALTER TABLE notifications_archive ENABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_notifications_read_created_at ON notifications(created_at) WHERE is_read;
+CREATE INDEX IF NOT EXISTS idx_notifications_recipient_unread ON notifications(recipient_id) WHERE NOT is_read;
+
+CREATE OR REPLACE FUNCTION maintain_notification_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+  -- Bulk operations below adjust the counters themselves
+  IF current_setting('x_repo.bulk_notification_counters', true) = 'on' THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO notification_counters (user_id, total_count, unread_count)
+    VALUES (NEW.recipient_id, 1, CASE WHEN NEW.is_read THEN 0 ELSE 1 END)
+    ON CONFLICT (user_id) DO UPDATE SET
+      total_count = notification_counters.total_count + 1,
+      unread_count = notification_counters.unread_count + EXCLUDED.unread_count;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE notification_counters SET
+      total_count = GREATEST(total_count - 1, 0),
+      unread_count = GREATEST(unread_count - CASE WHEN OLD.is_read THEN 0 ELSE 1 END, 0)
+    WHERE user_id = OLD.recipient_id;
+  ELSIF NEW.is_read IS DISTINCT FROM OLD.is_read THEN
+    UPDATE notification_counters SET
+      unread_count = GREATEST(unread_count + CASE WHEN NEW.is_read THEN -1 ELSE 1 END, 0)
+    WHERE user_id = NEW.recipient_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Moves up to p_limit read notifications older than p_older_than_seconds;
+-- returns how many were moved. Concurrent runs skip each other's rows.
+CREATE OR REPLACE FUNCTION archive_notifications(p_older_than_seconds INTEGER, p_limit INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+  moved INTEGER;
+BEGIN
+  PERFORM set_config('x_repo.bulk_notification_counters', 'on', true);
+
+  WITH picked AS (
+    SELECT id FROM notifications
+    WHERE is_read AND created_at < NOW() - make_interval(secs => p_older_than_seconds)
+    ORDER BY created_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  ),
+  deleted AS (
+    DELETE FROM notifications n USING picked
+    WHERE n.id = picked.id
+    RETURNING n.*
+  ),
+  archived AS (
+    INSERT INTO notifications_archive (id, recipient_id, type, title, content, post_id, comment_id, actor_id, actor_count, created_at)
+    SELECT id, recipient_id, type, title, content, post_id, comment_id, actor_id, actor_count, created_at FROM deleted
+    ON CONFLICT (id) DO NOTHING
+  ),
+  counted AS (
+    -- Only read rows are moved, so unread counts are unchanged
+    UPDATE notification_counters c SET total_count = GREATEST(c.total_count - d.moved, 0)
+    FROM (SELECT recipient_id, COUNT(*) AS moved FROM deleted GROUP BY recipient_id) d
+    WHERE c.user_id = d.recipient_id
+  )
+  SELECT COUNT(*)::INTEGER INTO moved FROM deleted;
+
+  PERFORM set_config('x_repo.bulk_notification_counters', 'off', true);
+  RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Marks a user's unread notifications read; returns how many changed
+CREATE OR REPLACE FUNCTION mark_all_notifications_read(p_user_id UUID)
+RETURNS INTEGER AS $$
+DECLARE
+  marked INTEGER;
+BEGIN
+  PERFORM set_config('x_repo.bulk_notification_counters', 'on', true);
+
+  UPDATE notifications SET is_read = TRUE
+  WHERE recipient_id = p_user_id AND NOT is_read;
+  GET DIAGNOSTICS marked = ROW_COUNT;
+
+  UPDATE notification_counters SET unread_count = GREATEST(unread_count - marked, 0)
+  WHERE user_id = p_user_id AND marked > 0;
+
+  PERFORM set_config('x_repo.bulk_notification_counters', 'off', true);
+  RETURN marked;
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE EXECUTE ON FUNCTION archive_notifications(INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION mark_all_notifications_read(UUID) FROM PUBLIC, anon, authenticated;
@@ -9,6 +9,8 @@ export interface User {
   location: string | null
   website: string | null
   quantum_interests: string[] | null
+  post_karma?: number
+  comment_karma?: number
   created_at: string
   updated_at: string
 }